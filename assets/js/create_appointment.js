@@ -3,12 +3,56 @@ $(document).ready(function() {
     var today = new Date().toISOString().split('T')[0];
     $('#appointment-date').attr('min', today);
 
-    // Reload the page with the selected date in the query string to update available slots
+    const slotGrid = $('#time-slots');
+    const availabilityUrl = slotGrid.data('availability-url');
+    const daysPerRequest = 14;
+    // Slots per date ('YYYY-MM-DD'), filled from the availability API two weeks at a time
+    const availability = {};
+
+    // Reloads the page for the selected date by posting the form without its
+    // confirm button, which carries the booking token in its hidden field
+    // rather than in the URL. submit() skips the required slot check.
+    function reloadWithDate() {
+        $('#appointment-date').closest('form')[0].submit();
+    }
+
+    function renderSlots(day) {
+        slotGrid.empty();
+        day.slots.forEach(function(slot, index) {
+            const id = 'time-' + (index + 1);
+            const input = $('<input class="form-check-input" type="radio" name="appointment_time" required>')
+                .attr('id', id).val(slot.start).prop('disabled', slot.booked);
+            const label = $('<label class="form-check-label">').attr('for', id).text(slot.label)
+                .toggleClass('text-muted text-decoration-line-through', slot.booked);
+            slotGrid.append($('<div class="col">').append($('<div class="form-check">').append(input, label)));
+        });
+        $('#fully-booked-alert').toggleClass('d-none', !day.fully_booked);
+    }
+
+    function showDate(selectedDate) {
+        if (availability[selectedDate]) {
+            renderSlots(availability[selectedDate]);
+            return $.Deferred().resolve().promise();
+        }
+        return $.getJSON(availabilityUrl, { start: selectedDate, days: daysPerRequest }).then(function(data) {
+            data.days.forEach(function(day) {
+                availability[day.date] = day;
+            });
+            renderSlots(availability[selectedDate]);
+        });
+    }
+
+    // Show the slots for the selected date without reloading the page,
+    // falling back to a reload when the doctor has no slot grid or the API fails.
     $('#appointment-date').on('change', function() {
         const selectedDate = $(this).val();
-        if (selectedDate) {
-            const currentUrl = window.location.pathname;
-            window.location.href = currentUrl + '?date=' + selectedDate;
+        if (!selectedDate) {
+            return;
+        }
+        if (!availabilityUrl) {
+            reloadWithDate();
+            return;
         }
+        showDate(selectedDate).fail(reloadWithDate);
     });
-});
\ No newline at end of file
+});
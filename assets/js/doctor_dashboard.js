@@ -9,4 +9,24 @@ $(document).ready(function() {
         modal.find('#confirmationModalBody').text(modalBodyText);
         modal.find('#confirmActionButton').attr('href', actionUrl);
     });
-});
\ No newline at end of file
+
+    // "Load more" appends the next page of appointments in place. Without
+    // JavaScript the link simply opens that page.
+    $('#load-more').on('click', function(event) {
+        event.preventDefault();
+        var button = $(this);
+        var params = button.data('query-params');
+        var url = '?after=' + encodeURIComponent(button.data('next-cursor')) + '&format=json' + (params ? '&' + params : '');
+        button.addClass('disabled');
+        $.getJSON(url).then(function(data) {
+            $('#appointment-rows').append(data.html);
+            if (data.next_cursor) {
+                button.data('next-cursor', data.next_cursor).removeClass('disabled');
+            } else {
+                button.remove();
+            }
+        }, function() {
+            window.location.href = button.attr('href');
+        });
+    });
+});
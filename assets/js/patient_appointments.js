@@ -4,4 +4,37 @@ $(document).ready(function() {
         modal.find('#confirmationModalBody').text(modalBodyText);
         modal.find('#confirmActionButton').attr('href', actionUrl);
     });
-});
\ No newline at end of file
+
+    // Only the active tab is rendered with the page; load the other one when it is first shown.
+    $('#myBookingsTab button[data-bs-toggle="tab"]').on('shown.bs.tab', function(event) {
+        var placeholder = $($(event.target).data('bs-target')).find('.lazy-tab');
+        if (!placeholder.length || placeholder.data('loading')) {
+            return;
+        }
+        placeholder.data('loading', true);
+        $.get(placeholder.data('url')).then(function(html) {
+            placeholder.replaceWith(html);
+        }, function() {
+            placeholder.data('loading', false).text('Could not load this tab. Please reload the page.');
+        });
+    });
+
+    // "Load more" appends the tab's next rows in place. Without JavaScript the link opens that page.
+    $(document).on('click', '.load-more', function(event) {
+        event.preventDefault();
+        var button = $(this);
+        var params = button.data('query-params');
+        var url = button.data('url') + '?after=' + encodeURIComponent(button.data('next-cursor')) + '&format=json' + (params ? '&' + params : '');
+        button.addClass('disabled');
+        $.getJSON(url).then(function(data) {
+            button.closest('.card-body').find('.booking-rows').append(data.html);
+            if (data.next_cursor) {
+                button.data('next-cursor', data.next_cursor).removeClass('disabled');
+            } else {
+                button.parent().remove();
+            }
+        }, function() {
+            window.location.href = button.attr('href');
+        });
+    });
+});
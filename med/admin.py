@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Doctor, Appointment, LabTest, EmailLog
+from .models import Doctor, Appointment, LabTest, EmailLog, OutboxMessage, Specialty, Location
 # Register your models here.
 
 @admin.register(Doctor)
@@ -7,10 +7,17 @@ class DoctorAdmin(admin.ModelAdmin):
     """Custom admin view for the Doctor model."""
     list_display = ('name', 'expert', 'location', 'rating', 'user')
     search_fields = ('name', 'expert', 'location')
-    list_filter = ('location', 'expert', 'gender')
+    # Filter on the small lookup tables instead of DISTINCT over all doctors
+    list_filter = ('city', 'specialty', 'gender')
     # Use raw_id_fields for better performance with thousands of users
     raw_id_fields = ('user',)
 
+@admin.register(Specialty, Location)
+class CatalogAdmin(admin.ModelAdmin):
+    """Admin view for the Specialty and Location lookup tables."""
+    list_display = ('name', 'normalized')
+    search_fields = ('name',)
+
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
     """Custom admin view for the Appointment model."""
@@ -37,4 +44,12 @@ class EmailLogAdmin(admin.ModelAdmin):
     list_display = ('recipient', 'subject', 'status', 'sent_at')
     list_filter = ('status', 'sent_at')
     search_fields = ('recipient', 'subject')
-    readonly_fields = ('recipient', 'subject', 'body', 'status', 'sent_at', 'error_message')
\ No newline at end of file
+    fields = readonly_fields = ('recipient', 'subject', 'template', 'body', 'status', 'sent_at', 'error_message')
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    """Custom admin view for the OutboxMessage model."""
+    list_display = ('kind', 'channel', 'object_id', 'user_id', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'kind', 'channel')
+    search_fields = ('object_id', 'user_id')
+    readonly_fields = ('created_at', 'sent_at', 'claim_token', 'claimed_until', 'last_error')
\ No newline at end of file
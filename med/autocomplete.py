@@ -0,0 +1,138 @@
+"""
+In-memory autocomplete for the select2 widgets on the booking forms.
+
+Each source's values are loaded once per process into a sorted array. A
+lookup binary-searches the array for values starting with the term and
+then fills the remaining slots with values containing it elsewhere, so
+autocomplete requests do not query the database. An empty term, sent when
+a widget is opened, lists every value with the source's pinned values
+(such as 'Other') first, as the lists did before they were indexed.
+
+Sources backed by the database declare a `version_key`. The signal handlers
+in `med.signals` bump that key's counter in the Django cache whenever the
+underlying rows change (see med.versioning). The next lookup in any process
+sharing the cache then sees the new version and rebuilds its index. The
+version is also part of the ETag, so select2 widgets can revalidate a
+cached response with a 304.
+"""
+import hashlib
+import threading
+from bisect import bisect_left
+from itertools import chain
+
+from django.conf import settings
+
+from .catalog import ANY, get_symptom_catalog
+from .models import Location
+from .versioning import data_version
+
+# Sorts after any character a search term can contain.
+_PREFIX_END = '\U0010ffff'
+
+
+def normalize(term):
+    return ' '.join(term.lower().split())
+
+
+class PrefixIndex:
+    """
+    A sorted array of (normalized key, value) pairs. Each value is its own
+    key; `aliases`, (alias, value) pairs, add keys that find a value without
+    being listed themselves. `pinned` values are listed first when the term
+    is empty.
+    """
+
+    def __init__(self, values, pinned=(), aliases=()):
+        names = {(normalize(value), value) for value in values if value}
+        listed = {value for _, value in names}
+        self.all_values = [value for _, value in sorted(names)]
+        pairs = sorted(names | {(normalize(alias), value) for alias, value in aliases if alias and value in listed})
+        self.keys = [key for key, _ in pairs]
+        self.values = [value for _, value in pairs]
+        self.pinned = list(pinned)
+
+    def search(self, term, limit):
+        """
+        Returns up to `limit` values matching `term`: values starting with it
+        first, then values containing it anywhere else, each group sorted.
+        An empty term returns every value, uncapped, pinned values first.
+        """
+        term = normalize(term)
+        if not term:
+            pinned = set(self.pinned)
+            return self.pinned + [value for value in self.all_values if value not in pinned]
+        start = bisect_left(self.keys, term)
+        end = bisect_left(self.keys, term + _PREFIX_END, start)
+        substring_matches = (i for i, key in enumerate(self.keys) if term in key and not start <= i < end)
+        results = []
+        for i in chain(range(start, end), substring_matches):
+            # A value found under its own name and an alias is listed once.
+            if self.values[i] not in results:
+                results.append(self.values[i])
+                if len(results) == limit:
+                    break
+        return results
+
+
+class Source:
+    """An autocomplete value list, rebuilt whenever its version key is bumped."""
+
+    def __init__(self, name, loader, version_key=None, pinned=(), alias_loader=None):
+        self.name = name
+        self.loader = loader
+        self.version_key = version_key
+        self.pinned = pinned
+        self.alias_loader = alias_loader
+        self._index = None
+        self._built_version = None
+        self._lock = threading.Lock()
+
+    def version(self):
+        return data_version(self.version_key) if self.version_key else 0
+
+    def index(self):
+        version = self.version()
+        if self._index is None or self._built_version != version:
+            with self._lock:
+                if self._index is None or self._built_version != version:
+                    self._index = PrefixIndex(
+                        self.loader(), self.pinned, self.alias_loader() if self.alias_loader else (),
+                    )
+                    self._built_version = version
+        return self._index
+
+    def search(self, term, limit=None):
+        return self.index().search(term, limit or max_results())
+
+    def etag(self, term):
+        digest = hashlib.md5(normalize(term).encode('utf-8')).hexdigest()[:16]
+        return f'{self.name}-{self.version()}-{max_results()}-{digest}'
+
+
+def max_results():
+    return getattr(settings, 'AUTOCOMPLETE_MAX_RESULTS', 20)
+
+
+def _doctor_locations():
+    return Location.objects.filter(doctors__isnull=False).values_list('name', flat=True).distinct()
+
+
+def _symptom_terms():
+    return get_symptom_catalog().names() + [ANY]
+
+
+def _symptom_aliases():
+    # Synonyms find their specialty rather than competing with it for a slot.
+    return get_symptom_catalog().aliases()
+
+
+SOURCES = {source.name: source for source in [
+    Source('locations', _doctor_locations, version_key='doctors'),
+    Source('diseases', _symptom_terms, version_key='doctors', pinned=[ANY], alias_loader=_symptom_aliases),
+    Source('lab_locations', lambda: ["Aurangabad", "Beed", "Latur", "Osmanabad", "Solapur"]),
+    Source('lab_tests', lambda: ["Blood Test", "Urine Test", "RTPCR Test", "HIV Test", "DNA Test"]),
+]}
+
+
+def get_source(name):
+    return SOURCES[name]
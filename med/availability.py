@@ -0,0 +1,248 @@
+"""
+Per doctor-day availability bitmaps.
+
+A day is divided into 48 half-hour slots; slot i starts i * 30 minutes after
+midnight. DoctorDayAvailability.booked holds one bit per slot that has a
+non-cancelled appointment, and a doctor's working hours are a second mask
+derived from from_time/to_time. Checking a slot, listing the free ones or
+telling whether a day is fully booked is then a single row fetch followed by
+bit operations, instead of a booked-slots query and list scans.
+
+The bitmaps are maintained incrementally by the Appointment signal handlers
+in med.signals. `rebuild()` recomputes them from the appointments table.
+
+For the multi-day availability API, each doctor-week of bitmaps is also
+cached in the Django cache. A week is loaded with one range query over the
+(doctor, date) index and dropped from the cache after any booking change
+in it commits.
+"""
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F
+
+from .models import Appointment, DoctorDayAvailability
+
+SLOT_MINUTES = 30
+
+
+def slot_index(slot_time):
+    return (slot_time.hour * 60 + slot_time.minute) // SLOT_MINUTES
+
+
+def slot_bit(slot_time):
+    return 1 << slot_index(slot_time)
+
+
+@lru_cache(maxsize=256)
+def time_slots(start_time, end_time):
+    """
+    Returns the doctor's bookable slots as a tuple of (start, end) times.
+    Computed once per distinct pair of working hours.
+    """
+    slots = []
+    if not start_time or not end_time:
+        return ()
+    current_start = datetime.combine(datetime.min, start_time)
+    end_datetime = datetime.combine(datetime.min, end_time)
+    while current_start + timedelta(minutes=SLOT_MINUTES) <= end_datetime:
+        current_end = current_start + timedelta(minutes=SLOT_MINUTES)
+        slots.append((current_start.time(), current_end.time()))
+        current_start = current_end
+    return tuple(slots)
+
+
+@lru_cache(maxsize=256)
+def working_mask(start_time, end_time):
+    mask = 0
+    for slot_start, _ in time_slots(start_time, end_time):
+        mask |= slot_bit(slot_start)
+    return mask
+
+
+@lru_cache(maxsize=256)
+def slot_starts(start_time, end_time):
+    return frozenset(slot_start for slot_start, _ in time_slots(start_time, end_time))
+
+
+def doctor_mask(doctor):
+    return working_mask(doctor.from_time, doctor.to_time)
+
+
+def is_slot_start(doctor, slot_time):
+    """
+    Whether `slot_time` is exactly the start of one of the doctor's slots.
+    slot_bit() maps any time within a slot to that slot's bit, so check this
+    before trusting a submitted time.
+    """
+    return slot_time in slot_starts(doctor.from_time, doctor.to_time)
+
+
+def booked_mask(doctor_id, day, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the booked-slot bitmask for a doctor-day (one indexed lookup).
+    `using` is the doctor's shard (see med.sharding), as in the functions below.
+    """
+    # Slicing rather than .first() avoids an ORDER BY; the row is unique.
+    booked = DoctorDayAvailability.objects.using(using).filter(doctor_id=doctor_id, date=day).values_list('booked', flat=True)[:1]
+    return booked[0] if booked else 0
+
+
+def booked_masks(doctor_id, start_day, end_day, using=DEFAULT_DB_ALIAS):
+    """Returns {date: booked bitmask} for the days in [start_day, end_day] that have bookings."""
+    return dict(
+        DoctorDayAvailability.objects.using(using).filter(doctor_id=doctor_id, date__range=(start_day, end_day))
+        .values_list('date', 'booked')
+    )
+
+
+def free_mask(doctor, booked):
+    return doctor_mask(doctor) & ~booked
+
+
+def is_free(doctor, booked, slot_time):
+    return bool(free_mask(doctor, booked) & slot_bit(slot_time))
+
+
+def is_fully_booked(doctor, booked):
+    return free_mask(doctor, booked) == 0
+
+
+def slot_states(doctor, booked):
+    """Returns the doctor's slots as (start, end, is_booked) tuples."""
+    return [
+        (slot_start, slot_end, bool(booked & slot_bit(slot_start)))
+        for slot_start, slot_end in time_slots(doctor.from_time, doctor.to_time)
+    ]
+
+
+def slot_taken(doctor_id, day, slot_time, using=DEFAULT_DB_ALIAS, exclude_id=None):
+    """
+    Whether a live appointment other than `exclude_id` holds the slot. Reads
+    the appointments rather than the bitmap, to tell a booking that lost the
+    race for its slot from other integrity errors.
+    """
+    return Appointment.objects.using(using).filter(
+        doctor_id=doctor_id, appointment_date=day, appointment_time=slot_time,
+    ).exclude(status='Cancelled').exclude(pk=exclude_id).exists()
+
+
+# --- Doctor-week cache ---
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _week_cache_key(doctor_id, monday):
+    return f'med:availability:{doctor_id}:{monday:%Y%m%d}'
+
+
+def range_masks(doctor_id, start_day, days, using=DEFAULT_DB_ALIAS):
+    """
+    Returns {date: booked bitmask} for `days` days from `start_day`. Weeks
+    missing from the cache are loaded together with one range query.
+    """
+    end_day = start_day + timedelta(days=days - 1)
+    mondays = []
+    monday = week_start(start_day)
+    while monday <= end_day:
+        mondays.append(monday)
+        monday += timedelta(days=7)
+
+    keys = {_week_cache_key(doctor_id, monday): monday for monday in mondays}
+    weeks = {keys[key]: week for key, week in cache.get_many(keys).items()}
+    missing = [monday for monday in mondays if monday not in weeks]
+    if missing:
+        loaded = booked_masks(doctor_id, missing[0], missing[-1] + timedelta(days=6), using)
+        fresh = {}
+        for monday in missing:
+            week = {}
+            for offset in range(7):
+                day = monday + timedelta(days=offset)
+                if loaded.get(day):
+                    week[day] = loaded[day]
+            weeks[monday] = fresh[_week_cache_key(doctor_id, monday)] = week
+        cache.set_many(fresh, getattr(settings, 'AVAILABILITY_CACHE_TIMEOUT', 600))
+
+    masks = {}
+    for offset in range(days):
+        day = start_day + timedelta(days=offset)
+        masks[day] = weeks[week_start(day)].get(day, 0)
+    return masks
+
+
+def invalidate_week(doctor_id, day, using=DEFAULT_DB_ALIAS):
+    """Drops the cached week containing `day` once the current transaction commits."""
+    key = _week_cache_key(doctor_id, week_start(day))
+    transaction.on_commit(lambda: cache.delete(key), using=using)
+
+
+# --- Maintenance ---
+
+def occupy(slot, using=DEFAULT_DB_ALIAS):
+    doctor_id, day, slot_time = slot
+    bit = slot_bit(slot_time)
+    rows = DoctorDayAvailability.objects.using(using).filter(doctor_id=doctor_id, date=day)
+    invalidate_week(doctor_id, day, using)
+    if rows.update(booked=F('booked').bitor(bit)):
+        return
+    try:
+        with transaction.atomic(using=using):
+            DoctorDayAvailability.objects.using(using).create(doctor_id=doctor_id, date=day, booked=bit)
+    except IntegrityError:
+        # Another booking created the row first.
+        rows.update(booked=F('booked').bitor(bit))
+
+
+def release(slot, using=DEFAULT_DB_ALIAS):
+    doctor_id, day, slot_time = slot
+    invalidate_week(doctor_id, day, using)
+    DoctorDayAvailability.objects.using(using).filter(doctor_id=doctor_id, date=day).update(
+        booked=F('booked').bitand(~slot_bit(slot_time)),
+    )
+
+
+def rebuild_day(doctor_id, day, using=DEFAULT_DB_ALIAS):
+    """Recomputes one doctor-day bitmap from its appointments."""
+    booked = 0
+    for slot_time in (
+        Appointment.objects.using(using).filter(doctor_id=doctor_id, appointment_date=day)
+        .exclude(status='Cancelled').values_list('appointment_time', flat=True)
+    ):
+        booked |= slot_bit(slot_time)
+    DoctorDayAvailability.objects.using(using).update_or_create(doctor_id=doctor_id, date=day, defaults={'booked': booked})
+    invalidate_week(doctor_id, day, using)
+
+
+def rebuild(doctor_ids=None, using=DEFAULT_DB_ALIAS):
+    """
+    Recomputes every bitmap (or only those of `doctor_ids`) in the `using`
+    database from its appointments table. Returns the number of doctor-days written.
+    """
+    appointments = Appointment.objects.using(using).exclude(status='Cancelled')
+    bitmaps = DoctorDayAvailability.objects.using(using).all()
+    if doctor_ids is not None:
+        appointments = appointments.filter(doctor_id__in=doctor_ids)
+        bitmaps = bitmaps.filter(doctor_id__in=doctor_ids)
+
+    booked = {}
+    for doctor_id, day, slot_time in appointments.values_list('doctor_id', 'appointment_date', 'appointment_time').iterator():
+        booked[(doctor_id, day)] = booked.get((doctor_id, day), 0) | slot_bit(slot_time)
+
+    stale_weeks = {
+        _week_cache_key(doctor_id, week_start(day))
+        for doctor_id, day in bitmaps.values_list('doctor_id', 'date').iterator()
+    }
+    stale_weeks.update(_week_cache_key(doctor_id, week_start(day)) for doctor_id, day in booked)
+
+    with transaction.atomic(using=using):
+        bitmaps.delete()
+        DoctorDayAvailability.objects.using(using).bulk_create(
+            [DoctorDayAvailability(doctor_id=doctor_id, date=day, booked=mask) for (doctor_id, day), mask in booked.items()],
+            batch_size=1000,
+        )
+    cache.delete_many(list(stale_weeks))
+    return len(booked)
@@ -0,0 +1,64 @@
+"""
+Booking wizard state carried in a signed token instead of the session.
+
+The wizard collects the patient details and search terms on the booking
+form and needs them again when the appointment is created, two or three
+requests later. Storing them in the database-backed session cost a
+django_session UPDATE at the first and last step of every booking. Instead,
+book_appointment and reschedule_appointment sign the state into a compact
+token that the following pages send back in a hidden field of their forms.
+
+Tokens only travel in POST bodies, never in URLs, so the patient's name,
+age and mobile number stay out of browser history, server logs and Referer
+headers. They are bound to the user they were issued to and expire after
+BOOKING_TOKEN_MAX_AGE seconds. A token that is missing, tampered with,
+expired or issued to someone else reads as no booking in progress.
+
+Nothing is stored on the server, so a token stays valid until it expires.
+Each booking still needs a free slot, and create_appointment checks again
+that an appointment being rescheduled can be.
+"""
+from django.conf import settings
+from django.core import signing
+
+SALT = 'med.booking'
+PARAM = 'booking'
+
+# Short keys keep the token compact.
+FIELDS = {
+    'patient_name': 'n',
+    'age': 'a',
+    'mobile': 'm',
+    'disease': 'd',
+    'location': 'l',
+    'rescheduling_id': 'r',
+}
+
+
+def dumps(user, **state):
+    """Returns a token carrying `state` (keys from FIELDS) for `user`."""
+    data = {FIELDS[key]: value for key, value in state.items() if value not in (None, '')}
+    data['u'] = user.pk
+    return signing.dumps(data, salt=SALT, compress=True)
+
+
+def loads(user, token):
+    """Returns the state in `token` as a dict, or None if it is not valid for `user`."""
+    if not token:
+        return None
+    try:
+        data = signing.loads(token, salt=SALT, max_age=settings.BOOKING_TOKEN_MAX_AGE)
+    except signing.BadSignature:  # includes SignatureExpired
+        return None
+    if data.get('u') != user.pk:
+        return None
+    return {key: data.get(short) for key, short in FIELDS.items()}
+
+
+def token_from_request(request):
+    """Reads the token from the POST data; tokens are never accepted from the URL."""
+    return request.POST.get(PARAM)
+
+
+def from_request(request):
+    return loads(request.user, token_from_request(request))
@@ -0,0 +1,217 @@
+"""
+Doctor directory search over the Specialty and Location lookup tables.
+
+Locations are matched exactly against the indexed `normalized` column. If
+that finds nothing, every token of the term must appear in the entry's
+normalized name.
+
+Diseases and symptoms are resolved through the symptom catalog. It holds
+every specialty that has doctors, under its own name and the curated
+synonyms in SYNONYMS, and is indexed by character trigrams. A misspelt or
+colloquial term ('stomack pain', 'skin rash') resolves to specialty IDs in
+one in-memory lookup. The catalog is rebuilt when the 'doctors' data version
+changes (see med.versioning). It also feeds the disease autocomplete, which
+lists only the specialty names; typing a synonym offers its specialty.
+
+Doctors are then fetched with an indexed join on the matching IDs.
+"""
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Q
+
+from .versioning import data_version
+from .models import Doctor, Location, Specialty, normalize_term
+
+# The booking form offers 'Other' to mean "do not filter on this field".
+ANY = 'Other'
+
+# Everyday terms patients search for, keyed by the normalized specialty name
+# they map to. Entries for specialties without doctors are ignored.
+SYNONYMS = {
+    'fever': ["High Temperature"],
+    'cold cough': ["Cold", "Cough", "Sore Throat", "Runny Nose"],
+    'stomach ache': ["Stomach Pain", "Abdominal Pain", "Indigestion"],
+    'headache': ["Head Pain"],
+    'diabetes': ["High Blood Sugar", "Sugar"],
+    'heart problem': ["Chest Pain", "Palpitations", "Heart Disease"],
+    'skin related issues': ["Skin Rash", "Itching", "Acne", "Eczema"],
+    'allergies': ["Allergy", "Sneezing"],
+    'arthritis': ["Joint Pain", "Swollen Joints"],
+    'asthma': ["Wheezing", "Breathlessness"],
+    'back pain': ["Lower Back Pain", "Spine Pain"],
+    'bronchitis': ["Chest Congestion", "Persistent Cough"],
+    'cholesterol': ["High Cholesterol"],
+    'depression': ["Low Mood", "Anxiety"],
+    'dizziness': ["Vertigo", "Lightheadedness"],
+    'fatigue': ["Tiredness", "Weakness"],
+    'flu': ["Influenza", "Body Ache"],
+    'gastritis': ["Acidity", "Heartburn"],
+    'hypertension': ["High Blood Pressure", "BP"],
+    'insomnia': ["Sleeplessness", "Trouble Sleeping"],
+    'migraine': ["Severe Headache"],
+    'nausea': ["Vomiting"],
+    'sinusitis': ["Blocked Nose", "Sinus"],
+}
+
+
+def match_ids(model, term):
+    """Returns the IDs of `model` catalog entries matching `term`."""
+    normalized = normalize_term(term)
+    if not normalized:
+        return []
+    exact = list(model.objects.filter(normalized=normalized).values_list('id', flat=True))
+    if exact:
+        return exact
+    token_filter = Q()
+    for token in normalized.split():
+        token_filter &= Q(normalized__contains=token)
+    return list(model.objects.filter(token_filter).values_list('id', flat=True))
+
+
+def trigrams(normalized):
+    """Character trigrams of each word, padded like PostgreSQL's pg_trgm."""
+    grams = set()
+    for word in normalized.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SymptomCatalog:
+    """
+    Maps disease/symptom terms to specialty IDs.
+    `entries` is an iterable of (term, specialty ID) pairs naming the
+    specialties, and `synonyms` one of (term, specialty ID) pairs that are
+    searchable but resolve to the specialty's name when listed.
+    """
+
+    def __init__(self, entries, synonyms=()):
+        self.display = {}   # normalized term -> term as shown to patients
+        self.specialties = {}   # normalized term -> set of specialty IDs
+        self.canonical = {}   # specialty ID -> its name, as shown to patients
+        for term, specialty_id in entries:
+            normalized = normalize_term(term)
+            if normalized:
+                self.display.setdefault(normalized, term)
+                self.specialties.setdefault(normalized, set()).add(specialty_id)
+                self.canonical.setdefault(specialty_id, term)
+        self.synonyms = []
+        for term, specialty_id in synonyms:
+            normalized = normalize_term(term)
+            if normalized and specialty_id in self.canonical:
+                self.specialties.setdefault(normalized, set()).add(specialty_id)
+                self.synonyms.append((term, self.canonical[specialty_id]))
+
+        self.terms = list(self.specialties)
+        self.term_grams = [trigrams(term) for term in self.terms]
+        self.term_words = [set(term.split()) for term in self.terms]
+        self.postings = {}   # trigram -> indexes into self.terms
+        for i, grams in enumerate(self.term_grams):
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(i)
+        self._resolved = {}
+
+    def names(self):
+        """The specialty names, as shown to patients."""
+        return list(self.display.values())
+
+    def aliases(self):
+        """(synonym, specialty name) pairs, for autocomplete to search but not list."""
+        return list(self.synonyms)
+
+    def resolve(self, term, threshold=None):
+        """Returns the frozenset of specialty IDs `term` refers to (possibly empty)."""
+        normalized = normalize_term(term)
+        result = self._resolved.get(normalized)
+        if result is None:
+            result = self._resolve(normalized, threshold or match_threshold())
+            if len(self._resolved) >= 10000:
+                self._resolved.clear()
+            self._resolved[normalized] = result
+        return result
+
+    def _resolve(self, normalized, threshold):
+        if not normalized:
+            return frozenset()
+        if normalized in self.specialties:
+            return frozenset(self.specialties[normalized])
+
+        words = set(normalized.split())
+        grams = trigrams(normalized)
+        shared = Counter(i for gram in grams for i in self.postings.get(gram, ()))
+        scores = {}
+        for i, common in shared.items():
+            if words <= self.term_words[i]:
+                # The term contains every word of the query ('pain' -> 'back pain').
+                scores[i] = 1.0
+            else:
+                scores[i] = common / (len(grams) + len(self.term_grams[i]) - common)
+        if not scores:
+            return frozenset()
+        # Keep the terms close to the best match, so 'stomack pain' resolves to
+        # 'stomach pain' without also pulling in 'back pain'.
+        cutoff = max(threshold, max(scores.values()) * 0.8)
+        ids = set()
+        for i, score in scores.items():
+            if score >= cutoff:
+                ids |= self.specialties[self.terms[i]]
+        return frozenset(ids)
+
+
+def match_threshold():
+    return getattr(settings, 'SYMPTOM_MATCH_THRESHOLD', 0.3)
+
+
+def _load_symptom_catalog():
+    entries = []
+    synonyms = []
+    for specialty_id, name, normalized in (
+        Specialty.objects.filter(doctors__isnull=False).distinct()
+        .values_list('id', 'name', 'normalized')
+    ):
+        entries.append((name, specialty_id))
+        synonyms.extend((synonym, specialty_id) for synonym in SYNONYMS.get(normalized, ()))
+    return SymptomCatalog(entries, synonyms)
+
+
+_symptom_catalog = None
+_symptom_catalog_version = None
+_symptom_catalog_lock = threading.Lock()
+
+
+def get_symptom_catalog():
+    """Returns this process's symptom catalog, rebuilding it if the doctor directory changed."""
+    global _symptom_catalog, _symptom_catalog_version
+    version = data_version('doctors')
+    if _symptom_catalog is None or _symptom_catalog_version != version:
+        with _symptom_catalog_lock:
+            if _symptom_catalog is None or _symptom_catalog_version != version:
+                _symptom_catalog = _load_symptom_catalog()
+                _symptom_catalog_version = version
+    return _symptom_catalog
+
+
+def specialty_ids_for(term):
+    return get_symptom_catalog().resolve(term)
+
+
+def location_ids_for(term):
+    return match_ids(Location, term)
+
+
+def search_doctors(disease, location):
+    """
+    Returns a queryset of doctors treating `disease` in `location`, ordered by
+    name. Either argument may be 'Other' to skip that filter.
+    """
+    doctors = Doctor.objects.all()
+    if disease != ANY:
+        specialty_ids = specialty_ids_for(disease)
+        if not specialty_ids:
+            return Doctor.objects.none()
+        doctors = doctors.filter(specialty_id__in=specialty_ids)
+    if location != ANY:
+        doctors = doctors.filter(city_id__in=location_ids_for(location))
+    return doctors.order_by('name', 'id')
@@ -0,0 +1,6 @@
+from .roles import get_roles
+
+
+def roles(request):
+    """Makes the session-cached roles of the logged-in user available as {{ roles }}."""
+    return {'roles': get_roles(request)}
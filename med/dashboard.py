@@ -0,0 +1,83 @@
+"""
+Cached chart data for the doctor dashboard.
+
+The years list and each year's summary are stored in the Django cache under
+a key that includes the doctor's appointment version stamp. Every change to
+the doctor's DoctorMonthlyStats rows bumps the stamp once the transaction
+commits (see med.stats), so a reload after a booking, cancellation or status
+sweep misses the old entries and recomputes them. Entries are never
+invalidated by time; DASHBOARD_CACHE_TIMEOUT only lets the backend drop
+entries that are no longer read.
+
+The version stamps live in the Django cache too, so all processes must share
+one backend for a change in one of them to be seen by the others. The default
+local-memory cache is per process; see CACHES in settings.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from . import stats
+from .versioning import data_version
+
+
+class CacheCounters:
+    """Hit and miss counts for this process, reported by the metrics view."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0}
+
+    def increment(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_ratio'] = round(counters['hits'] / lookups, 3) if lookups else None
+        return counters
+
+    def reset(self):
+        with self._lock:
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+
+counters = CacheCounters()
+
+
+def _cached(doctor_id, part, compute):
+    key = f'med:dashboard:{doctor_id}:{part}:{data_version(stats.version_key(doctor_id))}'
+    value = cache.get(key)
+    if value is not None:
+        counters.increment('hits')
+        return value
+    counters.increment('misses')
+    value = compute()
+    cache.set(key, value, getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 24 * 3600))
+    return value
+
+
+def available_years(doctor_id, using=DEFAULT_DB_ALIAS):
+    return _cached(doctor_id, 'years', lambda: stats.available_years(doctor_id, using))
+
+
+def _summarize(doctor_id, year, using):
+    status_data = {}
+    monthly_counts = [0] * 12
+    for month, status, count in stats.year_buckets(doctor_id, year, using):
+        status_data[status] = status_data.get(status, 0) + count
+        monthly_counts[month - 1] += count
+    return {'status_data': status_data, 'monthly_counts': monthly_counts}
+
+
+def year_summary(doctor_id, year, using=DEFAULT_DB_ALIAS):
+    """
+    Returns {'status_data': {status: count}, 'monthly_counts': [12 counts]}
+    for the doctor's appointments in `year`, read from their `using` shard.
+    """
+    return _cached(doctor_id, year, lambda: _summarize(doctor_id, year, using))
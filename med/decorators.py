@@ -2,6 +2,7 @@ from functools import wraps
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect
+from .roles import get_roles
 
 def group_required(*group_names):
     """
@@ -14,12 +15,14 @@ def group_required(*group_names):
         def _wrapped_view(request, *args, **kwargs):
             # The check for `is_superuser` is removed to enforce strict application roles.
             # Superusers must belong to the required group to access the view.
-            if request.user.groups.filter(name__in=group_names).exists():
+            # Group names come from the session-cached roles (see med.roles), not a query.
+            roles = get_roles(request)
+            if roles.in_any(group_names):
                 return view_func(request, *args, **kwargs)
             else:
                 messages.error(request, "You don't have permission to access this page.")
                 # If the user is a doctor trying to access a non-doctor page, redirect to their dashboard.
-                if request.user.groups.filter(name='Doctors').exists():
+                if roles.is_doctor:
                     return redirect('doctor_dashboard')
                 return redirect('home')
         return _wrapped_view
@@ -0,0 +1,127 @@
+"""
+Rolling archival of EmailLog rows.
+
+Rows older than the retention window are written to gzip-compressed JSONL
+segment files and then deleted from the database, which keeps the hot table
+small while preserving the audit trail. Each segment holds one batch of rows
+in id order, and its file name records the date and id range it covers.
+"""
+import gzip
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import EmailBody, EmailLog
+
+
+def get_archive_dir(archive_dir=None):
+    return Path(archive_dir or settings.EMAIL_LOG_ARCHIVE_DIR)
+
+
+def _serialize(log):
+    return {
+        'id': log.pk,
+        'recipient': log.recipient,
+        'subject': log.subject,
+        'template': log.template,
+        'status': log.status,
+        'sent_at': log.sent_at.isoformat(),
+        'error_message': log.error_message,
+        'body': log.body,
+    }
+
+
+def _write_segment(archive_dir, logs):
+    first, last = logs[0], logs[-1]
+    name = (
+        f"email_logs_{first.sent_at:%Y%m%d}-{last.sent_at:%Y%m%d}"
+        f"_{first.pk}-{last.pk}.jsonl.gz"
+    )
+    path = archive_dir / name
+    tmp_path = path.with_suffix('.tmp')
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as segment:
+        for log in logs:
+            segment.write(json.dumps(_serialize(log)) + '\n')
+    # Make sure the segment is on disk before its rows are deleted.
+    with open(tmp_path, 'rb') as written:
+        os.fsync(written.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def archive_older_than(days, archive_dir=None, batch_size=5000):
+    """
+    Moves EmailLog rows older than `days` into segment files.
+    Returns a (rows archived, list of segment paths) tuple.
+    """
+    archive_dir = get_archive_dir(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    cutoff = timezone.now() - timedelta(days=days)
+
+    archived = 0
+    segments = []
+    while True:
+        logs = list(
+            EmailLog.objects.filter(sent_at__lt=cutoff)
+            .select_related('body_ref')
+            .order_by('id')[:batch_size]
+        )
+        if not logs:
+            break
+        segments.append(_write_segment(archive_dir, logs))
+        with transaction.atomic():
+            EmailLog.objects.filter(pk__in=[log.pk for log in logs]).delete()
+        archived += len(logs)
+
+    if archived:
+        prune_orphan_bodies()
+    return archived, segments
+
+
+def prune_orphan_bodies(grace=None):
+    """
+    Deletes stored bodies no EmailLog row refers to any more, except those
+    created in the last `grace` seconds (EMAIL_BODY_PRUNE_GRACE).
+
+    EmailLog rows are inserted in the same transaction as the lookup of
+    their bodies, and the prune runs in a transaction of its own, so the
+    write lock keeps it from deleting a body that is being reused. The grace
+    period covers bodies stored by intern_many() ahead of their rows.
+    """
+    if grace is None:
+        grace = getattr(settings, 'EMAIL_BODY_PRUNE_GRACE', 3600)
+    with transaction.atomic():
+        deleted, _ = EmailBody.objects.filter(
+            logs__isnull=True, created_at__lt=timezone.now() - timedelta(seconds=grace),
+        ).delete()
+    return deleted
+
+
+def iter_archived(archive_dir=None, paths=None, recipient=None, status=None, since=None, until=None):
+    """
+    Yields archived rows as dicts, oldest segment first, optionally filtered
+    by recipient, status and a [since, until) sent_at range.
+    """
+    if paths is None:
+        paths = sorted(get_archive_dir(archive_dir).glob('email_logs_*.jsonl.gz'))
+    for path in paths:
+        with gzip.open(path, 'rt', encoding='utf-8') as segment:
+            for line in segment:
+                row = json.loads(line)
+                if recipient and row['recipient'] != recipient:
+                    continue
+                if status and row['status'] != status:
+                    continue
+                if since or until:
+                    sent_at = parse_datetime(row['sent_at'])
+                    if since and sent_at < since:
+                        continue
+                    if until and sent_at >= until:
+                        continue
+                yield row
@@ -0,0 +1,161 @@
+"""
+Streaming CSV and JSON Lines exports.
+
+Each Export in EXPORTS names the rows it covers, the FilterSet that narrows
+them (the one the matching list page uses) and its columns. `stream()`
+yields the encoded rows while they are read: the queryset is iterated with
+.iterator(chunk_size=EXPORT_CHUNK_SIZE), so memory use does not grow with
+the number of rows, and the CSV header is yielded before the first query
+runs, so the response starts at once. The export views wrap it in a
+StreamingHttpResponse; the export_data command writes it to a file.
+
+Appointment exports are scoped to one doctor and read from the doctor's shard.
+"""
+import csv
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import prefetch_related_objects
+
+from .filters import AppointmentFilter, EmailLogFilter, LabTestFilter, UserFilter
+from .models import Appointment, EmailLog, LabTest
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+class Export:
+    """
+    `columns` is a sequence of (header, value) pairs, where value is an
+    attribute name or a function of the row. `prefetch` lookups are fetched
+    for each chunk of rows, since iterator() ignores prefetch_related().
+    """
+
+    def __init__(self, name, queryset, filterset_class, ordering, columns, prefetch=()):
+        self.name = name
+        self.queryset = queryset
+        self.filterset_class = filterset_class
+        self.ordering = ordering
+        self.columns = columns
+        self.prefetch = prefetch
+
+    @property
+    def headers(self):
+        return [header for header, _ in self.columns]
+
+    def rows(self, data=None, queryset=None):
+        """Returns the export's rows, filtered by `data` (e.g. request.GET) and ordered."""
+        queryset = self.queryset() if queryset is None else queryset
+        if data is not None:
+            queryset = self.filterset_class(data, queryset=queryset).qs
+        return queryset.order_by(*self.ordering)
+
+    def values(self, obj):
+        return [value(obj) if callable(value) else getattr(obj, value) for _, value in self.columns]
+
+
+def _profile(field):
+    def value(user):
+        try:
+            return getattr(user.profile, field)
+        except ObjectDoesNotExist:
+            return None
+    return value
+
+
+EXPORTS = {
+    export.name: export
+    for export in (
+        Export(
+            # Ordered by med_appt_doctor_slot_idx once scoped to a doctor.
+            'appointments', lambda: Appointment.objects.all(), AppointmentFilter,
+            ('appointment_date', 'appointment_time', 'id'),
+            [
+                ('id', 'id'), ('appointment_date', 'appointment_date'), ('appointment_time', 'appointment_time'),
+                ('patient_name', 'patient_name'), ('patient_age', 'patient_age'), ('patient_mobile', 'patient_mobile'),
+                ('disease', 'disease'), ('status', 'status'), ('created_at', 'created_at'),
+            ],
+        ),
+        Export(
+            'lab-tests', lambda: LabTest.objects.select_related('booked_by'), LabTestFilter, ('id',),
+            [
+                ('id', 'id'), ('test_type', 'test_type'), ('location', 'location'), ('status', 'status'),
+                ('booked_by', lambda lab_test: lab_test.booked_by.username), ('created_at', 'created_at'),
+            ],
+        ),
+        Export(
+            'email-logs', lambda: EmailLog.objects.all(), EmailLogFilter, ('id',),
+            [
+                ('id', 'id'), ('recipient', 'recipient'), ('subject', 'subject'), ('template', 'template'),
+                ('status', 'status'), ('sent_at', 'sent_at'), ('error_message', 'error_message'),
+            ],
+        ),
+        Export(
+            'users', lambda: User.objects.select_related('profile'), UserFilter, ('id',),
+            [
+                ('id', 'id'), ('username', 'username'), ('email', 'email'), ('first_name', 'first_name'),
+                ('last_name', 'last_name'), ('is_active', 'is_active'), ('date_joined', 'date_joined'),
+                ('last_login', 'last_login'),
+                ('groups', lambda user: ';'.join(sorted(group.name for group in user.groups.all()))),
+                ('age', _profile('age')), ('gender', _profile('gender')), ('mobile', _profile('mobile')),
+            ],
+            prefetch=('groups',),
+        ),
+    )
+}
+
+
+def appointments_for_doctor(doctor_id, using=DEFAULT_DB_ALIAS):
+    """The queryset for the appointments export of one doctor, from their shard."""
+    return Appointment.objects.using(using).filter(doctor_id=doctor_id)
+
+
+def _chunks(queryset, chunk_size):
+    chunk = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _Echo:
+    """A file-like object for csv.writer that returns each line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_safe(value):
+    # Spreadsheets run cells starting with these characters as formulas.
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def stream(export, queryset, fmt='csv', chunk_size=None):
+    """Yields `queryset` encoded as `fmt`, one string per chunk of rows."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'.")
+    chunk_size = chunk_size or getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    headers = export.headers
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(headers)
+    for chunk in _chunks(queryset, chunk_size):
+        if export.prefetch:
+            prefetch_related_objects(chunk, *export.prefetch)
+        if fmt == 'csv':
+            yield ''.join(writer.writerow([_csv_safe(value) for value in export.values(obj)]) for obj in chunk)
+        else:
+            yield ''.join(
+                json.dumps(dict(zip(headers, export.values(obj))), cls=DjangoJSONEncoder) + '\n' for obj in chunk
+            )
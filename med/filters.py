@@ -1,7 +1,10 @@
+from datetime import datetime, time, timedelta
+
 import django_filters
 from django import forms
+from django.utils import timezone
 from django.contrib.auth.models import User, Group
-from .models import Appointment, LabTest
+from .models import Appointment, EmailLog, LabTest
 
 class AppointmentFilter(django_filters.FilterSet):
     patient_name = django_filters.CharFilter(
@@ -79,14 +82,42 @@ class LabTestFilter(django_filters.FilterSet):
         model = LabTest
         fields = ['test_type', 'location', 'status']
 
+def start_of_day(day):
+    """Returns midnight at the start of `day` in the current time zone, as an aware datetime."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+class EmailLogFilter(django_filters.FilterSet):
+    # Exact lookups on recipient and status, and a bare range on sent_at, so
+    # each can use its index. A __date lookup would wrap sent_at in a function
+    # and scan the table, so the dates become local day boundaries instead.
+    recipient = django_filters.CharFilter(
+        label='',
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Recipient'})
+    )
+    sent_after = django_filters.DateFilter(field_name='sent_at', method='filter_sent_after', label='From')
+    sent_before = django_filters.DateFilter(field_name='sent_at', method='filter_sent_before', label='To')
+
+    def filter_sent_after(self, queryset, name, value):
+        return queryset.filter(**{f'{name}__gte': start_of_day(value)})
+
+    def filter_sent_before(self, queryset, name, value):
+        # Includes the whole of the last day.
+        return queryset.filter(**{f'{name}__lt': start_of_day(value + timedelta(days=1))})
+
+    class Meta:
+        model = EmailLog
+        fields = ['recipient', 'status', 'sent_after', 'sent_before']
+
 class UserFilter(django_filters.FilterSet):
+    # Prefix matches, so they can use the NOCASE indexes on auth_user
+    # (med migration 0018) instead of scanning every user.
     username = django_filters.CharFilter(
-        lookup_expr='icontains', 
+        lookup_expr='istartswith',
         label="",
         widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Username'})
     )
     email = django_filters.CharFilter(
-        lookup_expr='icontains', 
+        lookup_expr='istartswith',
         label="",
         widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Email'})
     )
@@ -0,0 +1,324 @@
+"""
+Bulk doctor imports.
+
+`import_doctors()` loads a directory of doctors from CSV or JSON Lines rows,
+IMPORT_CHUNK_SIZE rows at a time. Each chunk is validated, then upserted in
+one transaction with a few bulk queries per table:
+
+- the natural key is the doctor's login `username`. Rows for a username
+  that already has a doctor profile update it, leaving the optional
+  columns the row leaves out as they are; other rows create the User, its
+  Profile and the Doctor, and add the user to the Doctors group;
+- new rows are inserted with bulk_create() and read back by their natural
+  key (the username, or the user of a doctor) to learn their IDs. Changed
+  rows are updated with one executemany() per table (see _update_rows),
+  because bulk_update() takes longer to build its SQL than to run it.
+  Neither calls Doctor.save() or the signal handlers, so the catalog
+  lookups, the shard and the shard replicas are filled in here, and the
+  cached roles and directory versions are bumped once per chunk.
+
+New accounts get the password given, or an unusable one. It is hashed
+once and shared, since hashing a password per row takes longer than the
+rest of the import.
+
+Columns: username (required), email, mobile, and the Doctor fields in
+DOCTOR_FIELDS, of which name, expert, location and price are required.
+"""
+import csv
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from accounts.models import Profile
+
+from . import roles
+from .versioning import bump_data_version
+from .models import Doctor, Location, Specialty, normalize_term
+from .sharding import shard_for_location
+
+FORMATS = ('csv', 'jsonl')
+
+DOCTOR_FIELDS = ('name', 'expert', 'location', 'price', 'gender', 'rating', 'description', 'from_time', 'to_time')
+ACCOUNT_FIELDS = {
+    'username': User._meta.get_field('username'),
+    'email': User._meta.get_field('email'),
+    'mobile': Profile._meta.get_field('mobile'),
+}
+
+
+class ImportTotals:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """Rows per second so far."""
+        return self.rows / max(self.elapsed, 1e-6)
+
+
+def read_rows(lines, fmt='csv'):
+    """Yields (line number, row) for each row of a CSV or JSON Lines file."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown import format '{fmt}'.")
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def clean_row(row):
+    """
+    Validates one row. Returns (account values, unsaved Doctor, names of the
+    Doctor fields the row sets), or raises ValidationError.
+    """
+    if not isinstance(row, dict):
+        raise ValidationError('Not a JSON object.')
+    # CSV puts extra cells under the key None.
+    row = {key.strip(): value.strip() if isinstance(value, str) else value for key, value in row.items() if key}
+    given = {name: row[name] for name in DOCTOR_FIELDS if row.get(name) not in (None, '')}
+    errors = {}
+    account = {}
+    for name, field in ACCOUNT_FIELDS.items():
+        value = row.get(name)
+        if value in (None, '') and name != 'username':
+            continue
+        try:
+            account[name] = field.clean(value, None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+    doctor = Doctor(**given)
+    try:
+        doctor.full_clean(exclude=['user', 'specialty', 'city', 'shard'], validate_unique=False)
+    except ValidationError as exc:
+        errors.update(exc.message_dict)
+    if errors:
+        raise ValidationError(errors)
+    return account, doctor, set(given)
+
+
+def _split_name(name):
+    parts = name.replace('Dr. ', '', 1).split()
+    first_name = parts[0] if parts else ''
+    return first_name[:150], ' '.join(parts[1:])[:150]
+
+
+# Rows per INSERT; Django lowers it further to stay under SQLite's limit on query parameters.
+INSERT_BATCH_SIZE = 500
+
+
+def _update_rows(model, objs, fields, using=DEFAULT_DB_ALIAS):
+    """
+    UPDATEs `fields` of `objs` by primary key with a single executemany().
+    bulk_update() compiles a CASE expression per row and field, which takes
+    longer than the writes themselves; here the statement is built once.
+    auto_now fields are not filled in.
+    """
+    if not objs:
+        return
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    opts = model._meta
+    fields = [opts.get_field(name) for name in fields]
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        quote(opts.db_table), ', '.join('%s = %%s' % quote(field.column) for field in fields), quote(opts.pk.column),
+    )
+    fields = [*fields, opts.pk]
+    params = [[field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] for obj in objs]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def _resolve(doctors):
+    """Does what Doctor.save() does, for doctors written in bulk."""
+    specialties = Specialty.objects.for_names(doctor.expert for doctor in doctors)
+    cities = Location.objects.for_names(doctor.location for doctor in doctors)
+    for doctor in doctors:
+        doctor.specialty = specialties[normalize_term(doctor.expert)]
+        doctor.city = cities[normalize_term(doctor.location)]
+        if not doctor.shard:
+            doctor.shard = shard_for_location(doctor.location)
+
+
+def _insert(doctors):
+    """Bulk inserts resolved doctors with accounts and returns them as read back by user, with their IDs."""
+    Doctor.objects.bulk_create(doctors, batch_size=INSERT_BATCH_SIZE)
+    return list(Doctor.objects.filter(user_id__in=[doctor.user_id for doctor in doctors]).order_by('pk'))
+
+
+def replicate(doctors):
+    """Copies doctors to their shards in bulk, as med.signals.replicate_doctor does for one."""
+    by_shard = {}
+    for doctor in doctors:
+        if doctor.shard != DEFAULT_DB_ALIAS:
+            by_shard.setdefault(doctor.shard, []).append(doctor)
+    # Replicas keep the IDs from the default database.
+    columns = [field.name for field in Doctor._meta.concrete_fields]
+    fields = [name for name in columns if name != Doctor._meta.pk.name]
+    for alias, shard_doctors in by_shard.items():
+        copies = [
+            Doctor(**{field.attname: getattr(doctor, field.attname) for field in Doctor._meta.concrete_fields})
+            for doctor in shard_doctors
+        ]
+        with transaction.atomic(using=alias):
+            existing = set(
+                Doctor.objects.using(alias).filter(pk__in=[copy.pk for copy in copies]).values_list('pk', flat=True)
+            )
+            _update_rows(Doctor, [copy for copy in copies if copy.pk in existing], fields, using=alias)
+            Doctor.objects.using(alias).bulk_create(
+                [copy for copy in copies if copy.pk not in existing], batch_size=INSERT_BATCH_SIZE,
+            )
+
+
+def create_doctors(doctors):
+    """
+    Bulk inserts doctors without accounts, filling in what Doctor.save()
+    and the signal handlers would. Such doctors have no natural key to read
+    them back by, so the replicas of every doctor on the shards they went
+    to are refreshed instead.
+    """
+    with transaction.atomic():
+        _resolve(doctors)
+        Doctor.objects.bulk_create(doctors, batch_size=INSERT_BATCH_SIZE)
+    shards = {doctor.shard for doctor in doctors} - {DEFAULT_DB_ALIAS}
+    if shards:
+        replicate(list(Doctor.objects.filter(shard__in=shards)))
+    bump_data_version('doctors')
+
+
+def _upsert(entries, password, group):
+    """Writes one chunk of cleaned rows, keyed by username. Returns (created, updated)."""
+    users = {user.username: user for user in User.objects.filter(username__in=entries)}
+    existing_user_ids = {user.pk for user in users.values()}
+    new_users = []
+    for username, (account, doctor, given) in entries.items():
+        user = users.get(username) or User(username=username, password=password)
+        if 'email' in account:
+            user.email = account['email']
+        if 'name' in given:
+            user.first_name, user.last_name = _split_name(doctor.name)
+        if user.pk is None:
+            new_users.append(user)
+    _update_rows(User, list(users.values()), ['email', 'first_name', 'last_name'])
+    if new_users:
+        User.objects.bulk_create(new_users, batch_size=INSERT_BATCH_SIZE)
+        users.update(
+            (user.username, user)
+            for user in User.objects.filter(username__in=[user.username for user in new_users]).only('id', 'username')
+        )
+
+    UserGroup = User.groups.through
+    UserGroup.objects.bulk_create(
+        [UserGroup(user_id=user.pk, group_id=group.pk) for user in users.values()],
+        batch_size=INSERT_BATCH_SIZE, ignore_conflicts=True,
+    )
+
+    profiles = {profile.user_id: profile for profile in Profile.objects.filter(user_id__in=existing_user_ids)}
+    new_profiles, changed_profiles = [], []
+    for username, (account, doctor, given) in entries.items():
+        profile = profiles.get(users[username].pk)
+        if profile is None:
+            new_profiles.append(Profile(
+                user_id=users[username].pk, gender=doctor.gender,
+                **({'mobile': account['mobile']} if 'mobile' in account else {}),
+            ))
+        elif 'mobile' in account or 'gender' in given:
+            profile.mobile = account.get('mobile', profile.mobile)
+            profile.gender = doctor.gender if 'gender' in given else profile.gender
+            changed_profiles.append(profile)
+    Profile.objects.bulk_create(new_profiles, batch_size=INSERT_BATCH_SIZE)
+    _update_rows(Profile, changed_profiles, ['gender', 'mobile'])
+
+    current = {doctor.user_id: doctor for doctor in Doctor.objects.filter(user_id__in=existing_user_ids)}
+    new_doctors, changed_doctors = [], []
+    for username, (account, doctor, given) in entries.items():
+        user_id = users[username].pk
+        if user_id in current:
+            for name in given:
+                setattr(current[user_id], name, getattr(doctor, name))
+            changed_doctors.append(current[user_id])
+        else:
+            doctor.user_id = user_id
+            new_doctors.append(doctor)
+    _resolve(changed_doctors + new_doctors)
+    _update_rows(Doctor, changed_doctors, [*DOCTOR_FIELDS, 'specialty', 'city'])
+    created = _insert(new_doctors) if new_doctors else []
+
+    if new_users:
+        bump_data_version('users')
+    if existing_user_ids:
+        # Their doctor profile was linked or renamed.
+        roles.invalidate()
+    return created, changed_doctors
+
+
+def import_doctors(rows, chunk_size=None, password=None, progress=None):
+    """
+    Upserts doctors from (line number, row) pairs, as read_rows() yields
+    them, and returns the ImportTotals. Invalid rows are skipped. After each
+    chunk, progress(totals, errors) is called with the chunk's
+    [(line number, message)] errors.
+    """
+    chunk_size = chunk_size or getattr(settings, 'IMPORT_CHUNK_SIZE', 1000)
+    # make_password(None) is an unusable password.
+    password = make_password(password)
+    group, _ = Group.objects.get_or_create(name='Doctors')
+    totals = ImportTotals()
+    first_lines = {}
+    entries, errors = {}, []
+
+    def flush():
+        if entries:
+            with transaction.atomic():
+                created, updated = _upsert(entries, password, group)
+            replicate(created + updated)
+            bump_data_version('doctors')
+            totals.created += len(created)
+            totals.updated += len(updated)
+        totals.skipped += len(errors)
+        if progress is not None:
+            progress(totals, list(errors))
+        entries.clear()
+        errors.clear()
+
+    for number, row in rows:
+        totals.rows += 1
+        try:
+            account, doctor, given = clean_row(row)
+        except ValidationError as exc:
+            messages = exc.message_dict.items() if hasattr(exc, 'error_dict') else [(None, exc.messages)]
+            errors.append((number, '; '.join(
+                f'{field}: {" ".join(field_messages)}' if field else ' '.join(field_messages)
+                for field, field_messages in messages
+            )))
+        else:
+            username = account['username']
+            if username in first_lines:
+                errors.append((number, f"username: '{username}' is also on line {first_lines[username]}."))
+            else:
+                first_lines[username] = number
+                entries[username] = (account, doctor, given)
+        if len(entries) + len(errors) >= chunk_size:
+            flush()
+    flush()
+    return totals
@@ -0,0 +1,65 @@
+"""
+Periodic maintenance jobs, shared by the management commands that run them.
+"""
+from datetime import timedelta
+from time import perf_counter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from . import sharding, stats
+from .models import Appointment, Watermark
+
+STATUS_SWEEP_WATERMARK = 'appointment_status_sweep'
+
+
+def complete_past_appointments(now=None, full=False):
+    """
+    Marks Confirmed appointments whose slot has ended as Completed, using
+    one UPDATE over the (status, ends_at) index.
+
+    Only appointments that ended since the previous run's watermark are
+    considered. The window reaches back APPOINTMENT_SWEEP_LOOKBACK_DAYS
+    further to pick up appointments confirmed after they ended. Pass
+    `full=True` to sweep the whole history instead. Each appointment shard is
+    swept in turn, with its own watermark.
+    Returns a (rows changed, seconds taken) tuple.
+    """
+    started = perf_counter()
+    now = now or timezone.now()
+    changed = sum(_complete_past_appointments(alias, now, full) for alias in sharding.aliases())
+    return changed, perf_counter() - started
+
+
+def _complete_past_appointments(using, now, full):
+    lookback = timedelta(days=getattr(settings, 'APPOINTMENT_SWEEP_LOOKBACK_DAYS', 7))
+    name = STATUS_SWEEP_WATERMARK if using == DEFAULT_DB_ALIAS else f'{STATUS_SWEEP_WATERMARK}:{using}'
+
+    with sharding.atomic(using):
+        watermark = Watermark.objects.select_for_update().filter(name=name).first()
+        # Advance the watermark first: on SQLite the write takes the database
+        # lock, so no booking can change between counting and updating below.
+        if watermark is None:
+            Watermark.objects.create(name=name, value=now)
+        else:
+            Watermark.objects.filter(pk=watermark.pk).update(value=now)
+
+        due = Appointment.objects.using(using).filter(status='Confirmed', ends_at__lte=now)
+        if watermark is not None and not full:
+            due = due.filter(ends_at__gt=watermark.value - lookback)
+        # The UPDATE bypasses the signal handlers, so move the monthly stats
+        # counts for the affected buckets here.
+        buckets = stats.bucket_counts(due)
+        changed = due.update(status='Completed')
+        if changed == sum(buckets.values()):
+            deltas = {}
+            for (doctor_id, year, month, _), count in buckets.items():
+                deltas[(doctor_id, year, month, 'Confirmed')] = -count
+                deltas[(doctor_id, year, month, 'Completed')] = count
+            stats.apply_deltas(deltas, using)
+        else:
+            # Rows changed between the two statements (possible on databases
+            # without a global write lock); recount the doctors involved.
+            stats.rebuild({doctor_id for doctor_id, _, _, _ in buckets}, using)
+    return changed
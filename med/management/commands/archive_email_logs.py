@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from med.email_archive import archive_older_than
+
+class Command(BaseCommand):
+    """
+    Moves old EmailLog rows into compressed JSONL segment files.
+    Intended to run daily so the EmailLog table only holds recent history.
+    """
+    help = 'Archives EmailLog rows older than N days into gzip JSONL segments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.EMAIL_LOG_RETENTION_DAYS,
+                            help='Archive rows older than this many days.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per segment file.')
+        parser.add_argument('--dir', default=None, help='Archive directory (defaults to EMAIL_LOG_ARCHIVE_DIR).')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Archiving email logs older than {options['days']} day(s)...")
+        archived, segments = archive_older_than(
+            options['days'], archive_dir=options['dir'], batch_size=options['batch_size'],
+        )
+        for path in segments:
+            self.stdout.write(f'  wrote {path}')
+        self.stdout.write(self.style.SUCCESS(f'Successfully archived {archived} email log(s) into {len(segments)} segment(s).'))
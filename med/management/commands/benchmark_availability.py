@@ -0,0 +1,80 @@
+import random
+import timeit
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from med import availability
+from med.models import Appointment, Doctor
+
+def _legacy_time_slots(start_time, end_time, interval_minutes=30):
+    # The slot generation create_appointment used to run on every request.
+    slots = []
+    start_datetime = datetime.combine(datetime.today(), start_time)
+    end_datetime = datetime.combine(datetime.today(), end_time)
+    current_start = start_datetime
+    while current_start < end_datetime:
+        current_end = current_start + timedelta(minutes=interval_minutes)
+        if current_end > end_datetime:
+            break
+        slots.append((current_start.time(), current_end.time()))
+        current_start = current_end
+    return slots
+
+class Command(BaseCommand):
+    """
+    Micro-benchmark of the slot picker's availability checks: the previous
+    booked-slots query plus list scans against the bitmap lookup and bit
+    operations. Runs against the doctors and appointments already in the database.
+    """
+    help = 'Compares slot availability checks using the legacy query path and the availability bitmaps.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000, help='Lookups to time for each path.')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for picking doctor-days.')
+
+    def handle(self, *args, **options):
+        doctor_days = list(
+            Appointment.objects.exclude(status='Cancelled')
+            .values_list('doctor_id', 'appointment_date').distinct()[:500]
+        )
+        if not doctor_days:
+            raise CommandError('No appointments found. Create some bookings (or load test data) first.')
+        doctors = Doctor.objects.in_bulk({doctor_id for doctor_id, _ in doctor_days})
+        rng = random.Random(options['seed'])
+        samples = [rng.choice(doctor_days) for _ in range(options['iterations'])]
+
+        def legacy():
+            for doctor_id, day in samples:
+                doctor = doctors[doctor_id]
+                slots = _legacy_time_slots(doctor.from_time, doctor.to_time)
+                booked_slots = list(Appointment.objects.filter(
+                    doctor=doctor, appointment_date=day, appointment_time__isnull=False,
+                ).exclude(status='Cancelled').values_list('appointment_time', flat=True))
+                free = [start for start, _ in slots if start not in booked_slots]
+                if slots:
+                    slots[0][0] in booked_slots
+                not free
+
+        def bitmap():
+            for doctor_id, day in samples:
+                doctor = doctors[doctor_id]
+                booked = availability.booked_mask(doctor_id, day)
+                free = availability.free_mask(doctor, booked)
+                booked & availability.slot_bit(doctor.from_time)
+                free == 0
+
+        def bitmap_ops():
+            # The bit operations alone, for a bitmap the view already fetched.
+            for doctor_id, day in samples:
+                doctor = doctors[doctor_id]
+                free = availability.doctor_mask(doctor) & ~0b1010
+                free & availability.slot_bit(doctor.from_time)
+                free == 0
+
+        self.stdout.write(f"Timing {len(samples)} free-slot lookups, booking checks and fully-booked checks per path...")
+        results = {}
+        for name, func in (('legacy query + list scan', legacy), ('bitmap row + bit ops', bitmap), ('bit ops only', bitmap_ops)):
+            func()  # warm up
+            results[name] = min(timeit.repeat(func, number=1, repeat=3)) / len(samples)
+            self.stdout.write(f"  {name:<26} {results[name] * 1e6:10.1f} us per doctor-day")
+        speedup = results['legacy query + list scan'] / results['bitmap row + bit ops']
+        self.stdout.write(self.style.SUCCESS(f'Bitmap path is {speedup:.1f}x faster than the legacy path.'))
@@ -0,0 +1,197 @@
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import time as clock_time, timedelta
+
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from med import booking, sharding
+from med.models import Appointment, Doctor
+from med.notification_pool import notification_pool
+
+
+def _forget_connection(alias):
+    # Connections are per thread, and this one may not have opened it yet.
+    try:
+        del connections[alias]
+    except AttributeError:
+        pass
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    """
+    End-to-end booking benchmark: patient processes, forked like the worker
+    processes of an application server, POST the confirm step of
+    create_appointment through the test client. Each booking runs the real
+    view with its token check, slot checks, appointment insert, bitmap and
+    stats updates, outbox rows and notification drain. The doctors are
+    spread over --shards regions, and the run is repeated with every region
+    in the default database and with one shard database per region.
+    Each run migrates fresh database files in a temporary directory.
+    """
+    help = 'Measures booking throughput through the create_appointment view, unsharded and sharded.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8, help='Patient processes booking concurrently.')
+        parser.add_argument('--doctors', type=int, default=40, help='Doctors, spread evenly over the regions.')
+        parser.add_argument('--shards', type=int, default=4, help='Regions, each with its own shard in the sharded run.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run each configuration.')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the chosen doctors and slots.')
+
+    def handle(self, *args, **options):
+        regions = [f'Region {i}' for i in range(options['shards'])]
+        runs = [
+            ('1 database', {}),
+            (f"{len(regions)} shards", {
+                f'bench_{i}': {'id': i + 1, 'locations': [region]} for i, region in enumerate(regions)
+            }),
+        ]
+        original_default = connections.databases[DEFAULT_DB_ALIAS]
+        setup_test_environment()  # allows the test client's host and keeps email in memory
+        try:
+            for label, shards in runs:
+                directory = tempfile.mkdtemp(prefix='medeasy-bench-')
+                aliases = [DEFAULT_DB_ALIAS, *shards]
+                connections.close_all()
+                for alias in aliases:
+                    options_ = {**original_default.get('OPTIONS', {})}
+                    if alias != DEFAULT_DB_ALIAS:
+                        options_['foreign_keys'] = False
+                    connections.databases[alias] = {
+                        **original_default, 'NAME': os.path.join(directory, f'{alias}.sqlite3'), 'OPTIONS': options_,
+                    }
+                    _forget_connection(alias)
+                try:
+                    with override_settings(MED_SHARDS=shards):
+                        self._report(label, self._run(aliases, regions, options))
+                finally:
+                    notification_pool.shutdown()
+                    connections.close_all()
+                    for alias in shards:
+                        _forget_connection(alias)
+                        del connections.databases[alias]
+                    shutil.rmtree(directory, ignore_errors=True)
+        finally:
+            connections.databases[DEFAULT_DB_ALIAS] = original_default
+            _forget_connection(DEFAULT_DB_ALIAS)
+            teardown_test_environment()
+
+    def _run(self, aliases, regions, options):
+        call_command('migrate', database=DEFAULT_DB_ALIAS, verbosity=0, interactive=False)
+        for alias in aliases[1:]:
+            call_command('migrate', 'med', database=alias, verbosity=0, interactive=False)
+        cache.clear()
+
+        doctors = [
+            Doctor.objects.create(
+                name=f'Dr. {i}', expert='Fever', location=regions[i % len(regions)], price=500,
+                from_time=clock_time(9, 0), to_time=clock_time(17, 0),
+            ).pk
+            for i in range(options['doctors'])
+        ]
+        patients = Group.objects.get_or_create(name='Patients')[0]
+        clients = []
+        for i in range(options['processes']):
+            user = User.objects.create_user(f'patient{i}', f'patient{i}@example.com')
+            user.groups.add(patients)
+            client = Client()
+            client.force_login(user)
+            client.get('/book-appointment/')  # caches the roles in the session
+            token = booking.dumps(user, patient_name=f'Patient {i}', age=30, mobile='9999999999', disease='Fever')
+            clients.append((client, token))
+        # Forked processes must not share the parent's SQLite connections.
+        connections.close_all()
+
+        today = timezone.localdate()
+        outcomes = multiprocessing.get_context('fork').Queue()
+        started = time.time()
+        deadline = started + options['duration']
+
+        def worker(client, token, seed):
+            rng = random.Random(seed)
+            requests = errors = default_writes = 0
+            latency = []
+
+            def count_default_writes(execute, sql, params, many, context):
+                nonlocal default_writes
+                if sql == 'BEGIN IMMEDIATE':
+                    default_writes += 1
+                return execute(sql, params, many, context)
+
+            counters = getattr(connections[DEFAULT_DB_ALIAS], 'counters', None)
+            if counters is not None:
+                counters.reset()
+            with connections[DEFAULT_DB_ALIAS].execute_wrapper(count_default_writes):
+                while time.time() < deadline:
+                    slot = rng.randrange(16)
+                    data = {
+                        'booking': token, 'confirm': '1',
+                        'appointment_date': (today + timedelta(days=rng.randrange(1, 90))).isoformat(),
+                        'appointment_time': f'{9 + slot // 2:02}:{slot % 2 * 30:02}',
+                    }
+                    request_started = time.monotonic()
+                    try:
+                        client.post(f'/create-appointment/{rng.choice(doctors)}/', data)
+                    except OperationalError:
+                        errors += 1
+                        continue
+                    latency.append(time.monotonic() - request_started)
+                    requests += 1
+            connections.close_all()
+            # The backend's lock counters are process-wide, so they include the notification drains.
+            lock_wait = counters.stats()['lock_wait_seconds'] if counters is not None else 0.0
+            outcomes.put((requests, errors, latency, default_writes, lock_wait))
+
+        processes = [
+            multiprocessing.get_context('fork').Process(target=worker, args=(client, token, options['seed'] + i))
+            for i, (client, token) in enumerate(clients)
+        ]
+        for process in processes:
+            process.start()
+        results = {'requests': 0, 'errors': 0, 'latency': [], 'default_writes': 0, 'lock_wait': 0.0}
+        for _ in processes:
+            requests, errors, latency, default_writes, lock_wait = outcomes.get()
+            results['requests'] += requests
+            results['errors'] += errors
+            results['latency'] += latency
+            results['default_writes'] += default_writes
+            results['lock_wait'] += lock_wait
+        for process in processes:
+            process.join()
+        results['elapsed'] = time.time() - started
+        results['booked'] = sum(sharding.fan_out(lambda alias: Appointment.objects.using(alias).count()).values())
+        return results
+
+    def _report(self, label, results):
+        elapsed = results['elapsed']
+        self.stdout.write(f'{label}:')
+        self.stdout.write(
+            f"  bookings {results['booked'] / elapsed:8.0f}/s   requests {results['requests'] / elapsed:8.0f}/s"
+        )
+        self.stdout.write(
+            f"  latency  p50 {_percentile(results['latency'], 0.5) * 1000:7.1f} ms"
+            f"   p95 {_percentile(results['latency'], 0.95) * 1000:7.1f} ms"
+        )
+        self.stdout.write(
+            f"  default database write transactions per request: {results['default_writes'] / max(1, results['requests']):.2f}"
+        )
+        self.stdout.write(f"  seconds spent waiting for write locks: {results['lock_wait']:.1f}")
+        self.stdout.write(f"  failed requests (database is locked): {results['errors']}")
+        self.stdout.write(self.style.SUCCESS(f'Finished {label}.'))
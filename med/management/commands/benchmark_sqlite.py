@@ -0,0 +1,150 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections, transaction
+
+BACKENDS = (
+    ('stock sqlite3', 'django.db.backends.sqlite3'),
+    ('medeasy.sqlite', 'medeasy.sqlite'),
+)
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class Command(BaseCommand):
+    """
+    Concurrent read/write benchmark of the stock SQLite backend against
+    medeasy.sqlite. Each backend gets a fresh database file in a temporary
+    directory; writer threads run booking-like transactions (check for a
+    clash, then insert) while reader threads run lookups, for a fixed time.
+    With --shards N, medeasy.sqlite is also run with the doctors spread over N
+    database files, as med.sharding spreads them by region.
+    """
+    help = 'Compares throughput and "database is locked" errors of the stock and tuned SQLite backends under concurrency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Writer threads.')
+        parser.add_argument('--readers', type=int, default=8, help='Reader threads.')
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds to run each backend.')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the generated rows.')
+        parser.add_argument('--shards', type=int, default=0, help='Also run with the doctors spread over this many files.')
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='medeasy-bench-')
+        runs = [(label, engine, 1) for label, engine in BACKENDS]
+        if options['shards'] > 1:
+            runs.append((f"medeasy.sqlite, {options['shards']} shards", 'medeasy.sqlite', options['shards']))
+        try:
+            for run, (label, engine, shards) in enumerate(runs):
+                aliases = [f'bench_{run}_{shard}' for shard in range(shards)]
+                for alias in aliases:
+                    connections.databases[alias] = {
+                        'ENGINE': engine,
+                        'NAME': os.path.join(directory, f'{alias}.sqlite3'),
+                        # Stock sqlite3 waits 5 s for a lock by default; match it.
+                        'OPTIONS': {'timeout': 5} if engine == 'django.db.backends.sqlite3' else {},
+                    }
+                try:
+                    self._report(label, self._run(aliases, options))
+                finally:
+                    for alias in aliases:
+                        connections[alias].close()
+                        del connections[alias]
+                        del connections.databases[alias]
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _run(self, aliases, options):
+        for alias in aliases:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(
+                    'CREATE TABLE bench_booking (id INTEGER PRIMARY KEY, doctor INTEGER, day INTEGER, slot INTEGER)'
+                )
+                cursor.execute('CREATE INDEX bench_booking_slot ON bench_booking (doctor, day, slot)')
+            connections[alias].close()
+
+        counters = getattr(connections[aliases[0]], 'counters', None)
+        if counters is not None:
+            counters.reset()
+        lock = threading.Lock()
+        results = {'writes': 0, 'reads': 0, 'errors': 0, 'write_latency': [], 'read_latency': []}
+        deadline = time.monotonic() + options['duration']
+
+        def write(rng):
+            doctor, day, slot = rng.randrange(50), rng.randrange(30), rng.randrange(16)
+            alias = aliases[doctor % len(aliases)]
+            with transaction.atomic(using=alias):
+                with connections[alias].cursor() as cursor:
+                    cursor.execute(
+                        'SELECT COUNT(*) FROM bench_booking WHERE doctor = %s AND day = %s AND slot = %s',
+                        [doctor, day, slot],
+                    )
+                    cursor.fetchone()
+                    cursor.execute(
+                        'INSERT INTO bench_booking (doctor, day, slot) VALUES (%s, %s, %s)', [doctor, day, slot],
+                    )
+
+        def read(rng):
+            doctor = rng.randrange(50)
+            with connections[aliases[doctor % len(aliases)]].cursor() as cursor:
+                cursor.execute(
+                    'SELECT day, slot FROM bench_booking WHERE doctor = %s ORDER BY day, slot LIMIT 25',
+                    [doctor],
+                )
+                cursor.fetchall()
+
+        def worker(kind, operation, seed):
+            rng = random.Random(seed)
+            try:
+                while time.monotonic() < deadline:
+                    started = time.monotonic()
+                    try:
+                        operation(rng)
+                    except DatabaseError:
+                        with lock:
+                            results['errors'] += 1
+                        continue
+                    elapsed = time.monotonic() - started
+                    with lock:
+                        results[f'{kind}s'] += 1
+                        results[f'{kind}_latency'].append(elapsed)
+            finally:
+                for alias in aliases:
+                    connections[alias].close()
+
+        threads = [
+            threading.Thread(target=worker, args=('write', write, options['seed'] + i))
+            for i in range(options['writers'])
+        ] + [
+            threading.Thread(target=worker, args=('read', read, options['seed'] + 1000 + i))
+            for i in range(options['readers'])
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results['elapsed'] = time.monotonic() - started
+        results['counters'] = counters.stats() if counters is not None else None
+        return results
+
+    def _report(self, label, results):
+        elapsed = results['elapsed']
+        self.stdout.write(f'{label}:')
+        self.stdout.write(
+            f"  writes {results['writes'] / elapsed:8.0f}/s   p95 {_percentile(results['write_latency'], 0.95) * 1000:7.1f} ms"
+        )
+        self.stdout.write(
+            f"  reads  {results['reads'] / elapsed:8.0f}/s   p95 {_percentile(results['read_latency'], 0.95) * 1000:7.1f} ms"
+        )
+        self.stdout.write(f"  failed operations (database is locked): {results['errors']}")
+        if results['counters'] is not None:
+            self.stdout.write(f"  backend counters: {results['counters']}")
+        self.stdout.write(self.style.SUCCESS(f'Finished {label}.'))
@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from med.outbox import drain
+
+class Command(BaseCommand):
+    """
+    Delivers queued notification emails from the outbox.
+    Run it once (e.g. from cron) or with --loop as a long-lived daemon.
+    """
+    help = 'Sends pending outbox emails in batches over a reused mail connection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'OUTBOX_BATCH_SIZE', 50),
+                            help='Number of messages to claim and send per connection.')
+        parser.add_argument('--loop', action='store_true', help='Keep draining until interrupted.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to sleep between drains when running with --loop.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if not options['loop']:
+            sent, failed = drain(batch_size=batch_size)
+            self.stdout.write(self.style.SUCCESS(f'Sent {sent} email(s); {failed} failed or deferred for retry.'))
+            return
+
+        self.stdout.write(f"Draining the outbox every {options['interval']}s. Press Ctrl+C to stop.")
+        try:
+            while True:
+                sent, failed = drain(batch_size=batch_size)
+                if sent or failed:
+                    self.stdout.write(f'Sent {sent} email(s); {failed} failed or deferred for retry.')
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.SUCCESS('Outbox drainer stopped.'))
@@ -0,0 +1,320 @@
+import random
+import time as clock
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from itertools import accumulate
+from types import SimpleNamespace
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from accounts.models import Profile
+from med import availability, imports, sharding, stats
+from med.versioning import bump_data_version
+from med.models import Appointment, Doctor, EmailBody, EmailLog, LabTest
+from med.notifications import EVENTS
+
+# Generated usernames start with this, e.g. load.patient42 and load.doctor7.
+PREFIX = 'load.'
+
+FIRST_NAMES = [
+    ('Aarav', 'Male'), ('Vivaan', 'Male'), ('Aditya', 'Male'), ('Arjun', 'Male'), ('Sai', 'Male'),
+    ('Reyansh', 'Male'), ('Krishna', 'Male'), ('Ishaan', 'Male'), ('Rohan', 'Male'), ('Vikram', 'Male'),
+    ('Saanvi', 'Female'), ('Aanya', 'Female'), ('Aadhya', 'Female'), ('Ananya', 'Female'), ('Pari', 'Female'),
+    ('Anika', 'Female'), ('Navya', 'Female'), ('Diya', 'Female'), ('Priya', 'Female'), ('Meera', 'Female'),
+]
+LAST_NAMES = [
+    'Patel', 'Shah', 'Mehta', 'Desai', 'Joshi', 'Kulkarni', 'Sharma', 'Verma', 'Gupta', 'Singh',
+    'Kumar', 'Yadav', 'Reddy', 'Naidu', 'Rao', 'Nair', 'Rathore',
+]
+LOCATIONS = [
+    'Aurangabad', 'Beed', 'Latur', 'Osmanabad', 'Solapur', 'Pune', 'Mumbai', 'Nagpur', 'Nashik', 'Thane',
+    'Kolhapur', 'Sangli', 'Satara', 'Jalgaon', 'Amravati', 'Akola', 'Nanded', 'Kalyan',
+]
+SPECIALITIES = [
+    'Fever', 'Cold & Cough', 'Stomach Ache', 'Headache', 'Diabetes', 'Heart Problem', 'Skin-related issues',
+    'Allergies', 'Arthritis', 'Asthma', 'Back Pain', 'Migraine', 'Hypertension', 'Sinusitis',
+]
+LAB_TESTS = ['Blood Test', 'Urine Test', 'RTPCR Test', 'HIV Test', 'DNA Test']
+LAB_LOCATIONS = ['Aurangabad', 'Beed', 'Latur', 'Osmanabad', 'Solapur']
+
+# Relative number of bookings by weekday, Monday first.
+WEEKDAY_WEIGHTS = (1.0, 1.0, 0.95, 0.95, 0.9, 0.6, 0.25)
+# Morning and early-evening slots are booked more often.
+PEAK_HOURS = {10, 11, 12, 17, 18}
+# (status, weight) for appointments before the anchor date and from it on.
+PAST_STATUSES = (('Completed', 85), ('Cancelled', 15))
+UPCOMING_STATUSES = (('Pending', 30), ('Confirmed', 60), ('Cancelled', 10))
+EMAIL_ERRORS = ['Connection unexpectedly closed', '(421) Service not available', 'Recipient address rejected']
+
+
+def _pick(rng, weighted):
+    values, weights = zip(*weighted)
+    return rng.choices(values, weights=weights)[0]
+
+
+@contextmanager
+def _backdated(*fields):
+    """Lets bulk_create() write the values set on these auto_now_add fields instead of the current time."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    """
+    Fills a fresh database with a reproducible load-test dataset: patients,
+    doctors with accounts, appointments, lab tests and email logs.
+
+    Doctors draw bookings by a Zipf-like popularity, appointments fall on
+    weekdays more than weekends and inside each doctor's from_time/to_time,
+    with more in peak hours, and never double-book a slot (so when the
+    popular doctors' days fill up, fewer appointments than asked for are
+    written). Appointments before the anchor date are mostly Completed,
+    later ones Pending or Confirmed. The same --seed and --today give the
+    same rows.
+
+    Rows are written with bulk_create(), a batch per transaction, and
+    accounts share one password hash. Appointments go to
+    their doctor's shard; the availability bitmaps and monthly stats are
+    rebuilt at the end.
+    """
+    help = 'Generates a large, reproducible dataset for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1, help='Random seed.')
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplies every count below.')
+        parser.add_argument('--patients', type=int, default=1000)
+        parser.add_argument('--doctors', type=int, default=100)
+        parser.add_argument('--appointments', type=int, default=10000)
+        parser.add_argument('--lab-tests', type=int, default=2000)
+        parser.add_argument('--email-logs', type=int, default=5000)
+        parser.add_argument('--days-back', type=int, default=365, help='Days of history before the anchor date.')
+        parser.add_argument('--days-ahead', type=int, default=30, help='Days of upcoming appointments.')
+        parser.add_argument('--today', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                            help='Anchor date, YYYY-MM-DD (defaults to today).')
+        parser.add_argument('--password', default='password123', help='Password of every generated account.')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows written per transaction.')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError('Generated data already exists; run this against a fresh database.')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.password = make_password(options['password'])
+        self.today = options['today'] or timezone.localdate()
+        self.first_day = self.today - timedelta(days=options['days_back'])
+        self.days = [self.first_day + timedelta(days=n) for n in range(options['days_back'] + options['days_ahead'] + 1)]
+        self.day_weights = list(accumulate(WEEKDAY_WEIGHTS[day.weekday()] for day in self.days))
+        counts = {
+            name: int(options[name] * options['scale'])
+            for name in ('patients', 'doctors', 'appointments', 'lab_tests', 'email_logs')
+        }
+
+        self._step('patients', self._patients, counts['patients'])
+        self._step('doctors', self._doctors, counts['doctors'], options['password'])
+        self._step('appointments', self._appointments, counts['appointments'])
+        self._step('lab tests', self._lab_tests, counts['lab_tests'])
+        self._step('email logs', self._email_logs, counts['email_logs'])
+        self._step('availability bitmaps and monthly stats', self._rebuild)
+        self.stdout.write(self.style.SUCCESS('Load data generated.'))
+
+    def _step(self, label, func, *args):
+        started = clock.monotonic()
+        written = func(*args)
+        elapsed = clock.monotonic() - started
+        rate = f', {written / max(elapsed, 1e-6):.0f} rows/s' if written else ''
+        self.stdout.write(f'{label}: {written} rows in {elapsed:.1f}s{rate}')
+
+    def _batches(self, count):
+        for start in range(0, count, self.batch_size):
+            yield range(start, min(start + self.batch_size, count))
+
+    def _moment(self, day, earliest=time(7, 0), latest=time(22, 0)):
+        """A random aware datetime on `day` between `earliest` and `latest`."""
+        start = datetime.combine(day, earliest)
+        seconds = (datetime.combine(day, latest) - start).total_seconds()
+        return timezone.make_aware(start + timedelta(seconds=self.rng.uniform(0, seconds)))
+
+    def _random_day(self, before_today=False):
+        while True:
+            day = self.rng.choices(self.days, cum_weights=self.day_weights)[0]
+            if not before_today or day <= self.today:
+                return day
+
+    def _patients(self, count):
+        group, _ = Group.objects.get_or_create(name='Patients')
+        UserGroup = User.groups.through
+        self.patients = []
+        for batch in self._batches(count):
+            users, profiles = [], []
+            for number in batch:
+                first_name, gender = self.rng.choice(FIRST_NAMES)
+                last_name = self.rng.choice(LAST_NAMES)
+                username = f'{PREFIX}patient{number}'
+                users.append(User(
+                    username=username, email=f'{username}@example.com', first_name=first_name, last_name=last_name,
+                    password=self.password, date_joined=self._moment(self._random_day(before_today=True)),
+                ))
+                # Adults, skewed towards middle age.
+                age = min(90, max(18, int(self.rng.gauss(42, 15))))
+                profiles.append(Profile(age=age, gender=gender, mobile=f'9{self.rng.randrange(10 ** 9):09d}'))
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                # Read the new IDs back by username.
+                ids = dict(User.objects.filter(username__in=[user.username for user in users]).values_list('username', 'pk'))
+                user_ids = [ids[user.username] for user in users]
+                for user_id, profile in zip(user_ids, profiles):
+                    profile.user_id = user_id
+                Profile.objects.bulk_create(profiles)
+                UserGroup.objects.bulk_create([UserGroup(user_id=user_id, group_id=group.pk) for user_id in user_ids])
+            self.patients.extend(
+                (user_id, f'{user.first_name} {user.last_name}', profile.age, profile.mobile, user.email)
+                for user_id, user, profile in zip(user_ids, users, profiles)
+            )
+        bump_data_version('users')
+        return count
+
+    def _doctors(self, count, password):
+        rows = []
+        for number in range(count):
+            first_name, gender = self.rng.choice(FIRST_NAMES)
+            speciality = self.rng.choice(SPECIALITIES)
+            location = self.rng.choice(LOCATIONS)
+            rows.append((number + 1, {
+                'username': f'{PREFIX}doctor{number}',
+                'email': f'{PREFIX}doctor{number}@medeasy.com',
+                'mobile': f'8{self.rng.randrange(10 ** 9):09d}',
+                'name': f'Dr. {first_name} {self.rng.choice(LAST_NAMES)}',
+                'expert': speciality,
+                'location': location,
+                'price': self.rng.randrange(400, 2501, 100),
+                'gender': gender,
+                'rating': f'{self.rng.uniform(3.5, 5.0):.1f}',
+                'description': f'A specialist in {speciality} with {self.rng.randint(5, 25)} years of experience in {location}.',
+                'from_time': f'{self.rng.randint(8, 10):02d}:{self.rng.choice([0, 30]):02d}',
+                'to_time': f'{self.rng.randint(17, 20):02d}:{self.rng.choice([0, 30]):02d}',
+            }))
+        imports.import_doctors(rows, self.batch_size, password)
+        self.doctors = list(
+            Doctor.objects.filter(user__username__startswith=PREFIX)
+            .only('name', 'expert', 'shard', 'from_time', 'to_time').order_by('pk')
+        )
+        return count
+
+    def _appointments(self, count):
+        if not self.doctors:
+            return 0
+        popularity = list(range(1, len(self.doctors) + 1))
+        self.rng.shuffle(popularity)
+        doctor_weights = list(accumulate(1 / rank ** 0.8 for rank in popularity))
+        slot_tables = {}
+        booked = {}  # {(doctor ID, date): bitmask of live appointments}
+        now = timezone.make_aware(datetime.combine(self.today, time(0, 0)))
+        written = 0
+        for batch in self._batches(count):
+            by_shard = {}
+            for doctor in self.rng.choices(self.doctors, cum_weights=doctor_weights, k=len(batch)):
+                hours = (doctor.from_time, doctor.to_time)
+                if hours not in slot_tables:
+                    slots = availability.time_slots(*hours)
+                    slot_tables[hours] = (slots, list(accumulate(2 if start.hour in PEAK_HOURS else 1 for start, _ in slots)))
+                slots, slot_weights = slot_tables[hours]
+                if not slots:
+                    continue
+                # A few tries to find a free slot; busy doctors' days fill up.
+                for _ in range(10):
+                    day = self._random_day()
+                    start, end = self.rng.choices(slots, cum_weights=slot_weights)[0]
+                    status = _pick(self.rng, PAST_STATUSES if day < self.today else UPCOMING_STATUSES)
+                    bit = availability.slot_bit(start)
+                    if status == 'Cancelled' or not booked.get((doctor.pk, day), 0) & bit:
+                        break
+                else:
+                    continue
+                if status != 'Cancelled':
+                    booked[(doctor.pk, day)] = booked.get((doctor.pk, day), 0) | bit
+                begins = timezone.make_aware(datetime.combine(day, start))
+                ends_at = timezone.make_aware(datetime.combine(day, end))
+                if end < start:
+                    ends_at += timedelta(days=1)
+                # Booked hours to a few weeks ahead, and never after the anchor date.
+                created_at = min(begins - timedelta(hours=self.rng.expovariate(1 / 120)), now - timedelta(seconds=1))
+                if self.patients:
+                    patient_id, patient_name, age, mobile, _ = self.rng.choice(self.patients)
+                else:
+                    patient_id, patient_name, age, mobile = None, 'Walk-in Patient', 40, '9000000000'
+                by_shard.setdefault(doctor.shard, []).append(Appointment(
+                    doctor_id=doctor.pk, patient_name=patient_name, patient_age=age, patient_mobile=mobile,
+                    booked_by_id=patient_id, disease=doctor.expert, status=status, created_at=created_at,
+                    appointment_date=day, appointment_time=start, ends_at=ends_at,
+                ))
+            for alias, appointments in by_shard.items():
+                with transaction.atomic(using=alias), _backdated(Appointment._meta.get_field('created_at')):
+                    Appointment.objects.using(alias).bulk_create(appointments)
+                written += len(appointments)
+        return written
+
+    def _lab_tests(self, count):
+        if not self.patients:
+            return 0
+        recent = self.today - timedelta(days=7)
+        for batch in self._batches(count):
+            lab_tests = []
+            for _ in batch:
+                day = self._random_day(before_today=True)
+                if day < recent:
+                    status = _pick(self.rng, (('Completed', 85), ('Cancelled', 15)))
+                else:
+                    status = _pick(self.rng, (('Pending', 40), ('Scheduled', 45), ('Cancelled', 15)))
+                lab_tests.append(LabTest(
+                    test_type=self.rng.choice(LAB_TESTS), location=self.rng.choice(LAB_LOCATIONS),
+                    booked_by_id=self.rng.choice(self.patients)[0], status=status, created_at=self._moment(day),
+                ))
+            with transaction.atomic(), _backdated(LabTest._meta.get_field('created_at')):
+                LabTest.objects.bulk_create(lab_tests)
+        return count
+
+    def _email_logs(self, count):
+        if not self.patients:
+            return 0
+        events = list(EVENTS.values())
+        # A pool of bodies per template, stored once each, as EmailBody deduplicates them.
+        pool = {
+            event.name: [
+                (event.email_template, f'<p>Dear {first_name},</p><p>{event.label}: thank you for using MedEasy.</p>')
+                for first_name, _ in FIRST_NAMES
+            ]
+            for event in events
+        }
+        bodies = EmailBody.intern_many(body for texts in pool.values() for body in texts)
+        doctor_names = [doctor.name for doctor in self.doctors] or ['Dr. MedEasy']
+        for batch in self._batches(count):
+            logs = []
+            for _ in batch:
+                event = self.rng.choice(events)
+                failed = self.rng.random() < 0.03
+                subject = event.subject.format(
+                    doctor=SimpleNamespace(name=self.rng.choice(doctor_names)),
+                    lab_test=SimpleNamespace(test_type=self.rng.choice(LAB_TESTS)),
+                )
+                template, text = self.rng.choice(pool[event.name])
+                logs.append(EmailLog(
+                    recipient=self.rng.choice(self.patients)[4], subject=subject, template=template,
+                    body_ref=bodies[(template, text)], status='Failed' if failed else 'Sent',
+                    sent_at=self._moment(self._random_day(before_today=True)),
+                    error_message=self.rng.choice(EMAIL_ERRORS) if failed else None,
+                ))
+            with transaction.atomic(), _backdated(EmailLog._meta.get_field('sent_at')):
+                EmailLog.objects.bulk_create(logs)
+        return count
+
+    def _rebuild(self):
+        return sum(
+            availability.rebuild(using=alias) + stats.rebuild(using=alias) for alias in sharding.aliases()
+        )
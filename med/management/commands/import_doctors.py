@@ -0,0 +1,48 @@
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from med import imports
+
+class Command(BaseCommand):
+    """
+    Upserts doctors, with their user accounts and profiles, from a CSV or
+    JSON Lines file, keyed by username. Rows are read as a stream and
+    written in bulk, one transaction per chunk; invalid rows are reported
+    and skipped.
+    """
+    help = 'Imports (creates or updates) doctors and their accounts from a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to read, or '-' for standard input.")
+        parser.add_argument('--format', choices=imports.FORMATS,
+                            help='File format (defaults to the file extension, else csv).')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Rows written per transaction.')
+        parser.add_argument('--password', default=None,
+                            help='Password for new accounts (defaults to an unusable one).')
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        if fmt is None:
+            extension = os.path.splitext(options['path'])[1].lstrip('.').lower()
+            fmt = 'jsonl' if extension in ('jsonl', 'ndjson') else 'csv'
+
+        def progress(totals, errors):
+            for number, message in errors:
+                self.stderr.write(f'Line {number}: {message}')
+            self.stdout.write(
+                f'{totals.rows} rows ({totals.created} created, {totals.updated} updated, '
+                f'{totals.skipped} skipped), {totals.rate:.0f} rows/s'
+            )
+
+        try:
+            source = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(f"Cannot read {options['path']}: {exc}")
+        with source:
+            totals = imports.import_doctors(
+                imports.read_rows(source, fmt), options['chunk_size'], options['password'], progress,
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {totals.created + totals.updated} doctor(s) ({totals.created} created, '
+            f'{totals.updated} updated, {totals.skipped} skipped) in {totals.elapsed:.1f}s.'
+        ))
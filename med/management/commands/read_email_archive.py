@@ -0,0 +1,50 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from med.email_archive import iter_archived
+
+class Command(BaseCommand):
+    """
+    Reads archived EmailLog rows back from segment files and prints them as
+    JSON lines, e.g. to answer an audit question about an old message.
+    """
+    help = 'Prints archived email logs as JSON lines, with optional filters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('segments', nargs='*', help='Segment files to read (defaults to the whole archive).')
+        parser.add_argument('--dir', default=None, help='Archive directory (defaults to EMAIL_LOG_ARCHIVE_DIR).')
+        parser.add_argument('--recipient', help='Only rows sent to this address.')
+        parser.add_argument('--status', choices=['Sent', 'Failed'], help='Only rows with this status.')
+        parser.add_argument('--since', help='Only rows sent at or after this ISO date/time.')
+        parser.add_argument('--until', help='Only rows sent before this ISO date/time.')
+        parser.add_argument('--no-body', action='store_true', help='Omit message bodies from the output.')
+        parser.add_argument('--count', action='store_true', help='Only print the number of matching rows.')
+
+    def _parse(self, value, option):
+        if not value:
+            return None
+        parsed = parse_datetime(value) or parse_datetime(f'{value}T00:00:00')
+        if parsed is None:
+            raise CommandError(f'Invalid {option} value: {value}')
+        return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+    def handle(self, *args, **options):
+        rows = iter_archived(
+            archive_dir=options['dir'],
+            paths=options['segments'] or None,
+            recipient=options['recipient'],
+            status=options['status'],
+            since=self._parse(options['since'], '--since'),
+            until=self._parse(options['until'], '--until'),
+        )
+        count = 0
+        for row in rows:
+            count += 1
+            if options['count']:
+                continue
+            if options['no_body']:
+                row.pop('body')
+            self.stdout.write(json.dumps(row))
+        if options['count']:
+            self.stdout.write(str(count))
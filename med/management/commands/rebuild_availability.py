@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from med import sharding
+from med.availability import rebuild
+
+class Command(BaseCommand):
+    """
+    Recomputes the per doctor-day availability bitmaps from the appointments table.
+    Bitmaps are normally kept up to date as appointments are saved; run this
+    after changing appointments with raw SQL or queryset.update().
+    """
+    help = 'Rebuilds the doctor availability bitmaps from existing appointments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', type=int, action='append', dest='doctor_ids',
+                            help='Only rebuild this doctor ID (may be repeated).')
+
+    def handle(self, *args, **options):
+        written = sum(rebuild(options['doctor_ids'], using=alias) for alias in sharding.aliases())
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt availability for {written} doctor-day(s).'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from med import sharding
+from med.stats import rebuild
+
+class Command(BaseCommand):
+    """
+    Recomputes the per-doctor monthly appointment stats from the appointments table.
+    Stats are normally kept up to date as appointments change; run this if they
+    have drifted, e.g. after editing appointments with raw SQL.
+    """
+    help = 'Rebuilds the doctor dashboard monthly stats from existing appointments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', type=int, action='append', dest='doctor_ids',
+                            help='Only rebuild this doctor ID (may be repeated).')
+
+    def handle(self, *args, **options):
+        written = sum(rebuild(options['doctor_ids'], using=alias) for alias in sharding.aliases())
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} monthly stats bucket(s).'))
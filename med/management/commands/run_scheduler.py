@@ -0,0 +1,49 @@
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from med.scheduler import JOBS, Scheduler, release_lease
+
+class Command(BaseCommand):
+    """
+    Runs the periodic jobs in med.scheduler.JOBS in one long-lived process.
+    Start it on as many nodes as you like: a database lease makes sure only one
+    of them runs jobs at a time, and another takes over if the leader stops.
+    """
+    help = 'Runs periodic jobs (appointment status sweep, session cleanup) with single-leader election.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tick', type=float, default=getattr(settings, 'SCHEDULER_TICK', 5),
+                            help='Seconds between checks for due jobs.')
+        parser.add_argument('--once', action='store_true',
+                            help='Run whatever is due (if this process gets the lease) and exit.')
+        parser.add_argument('--list', action='store_true', help='List the registered jobs and exit.')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for job in JOBS.values():
+                self.stdout.write(f'{job.name}: every {job.interval}s (+ up to {job.jitter}s jitter)')
+            return
+        if options['tick'] <= 0:
+            raise CommandError('--tick must be positive.')
+
+        scheduler = Scheduler(tick=options['tick'])
+        if options['once']:
+            try:
+                ran = scheduler.run_pending()
+            finally:
+                if scheduler.is_leader:
+                    release_lease(scheduler.holder)
+            if not scheduler.is_leader and not ran:
+                self.stdout.write('Another scheduler holds the lease; nothing run.')
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Ran {len(ran)} job(s): {', '.join(ran) or 'none due'}."))
+            return
+
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        self.stdout.write(f"Scheduler {scheduler.holder} started; checking every {options['tick']}s. Press Ctrl+C to stop.")
+        try:
+            scheduler.run_forever(should_stop=lambda: bool(stopping))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS('Scheduler stopped.'))
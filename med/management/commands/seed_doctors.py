@@ -2,6 +2,7 @@ import random
 from decimal import Decimal
 from datetime import time
 from django.core.management.base import BaseCommand
+from med.imports import create_doctors
 from med.models import Doctor
 
 class Command(BaseCommand):
@@ -37,6 +38,7 @@ class Command(BaseCommand):
         self.stdout.write('Seeding the database with a doctor for each location/speciality combination...')
 
         # Create a doctor for every combination of location and speciality
+        doctors = []
         for loc in locations:
             for spec in specialities:
                 # Create 2 or 3 doctors for each combination
@@ -44,7 +46,7 @@ class Command(BaseCommand):
                     first_name, last_name, gender = random.choice(doctor_names)
                     name = f"Dr. {first_name} {last_name}"
 
-                    Doctor.objects.create(
+                    doctors.append(Doctor(
                         name=name,
                         expert=spec,
                         location=loc,
@@ -54,6 +56,9 @@ class Command(BaseCommand):
                         description=f"A highly-rated specialist in {spec} with over {random.randint(5, 25)} years of experience, serving the {loc} area.",
                         from_time=time(random.randint(8, 10), random.choice([0, 30])),
                         to_time=time(random.randint(17, 20), random.choice([0, 30]))
-                    )
+                    ))
+
+        # One bulk insert instead of a save() per doctor.
+        create_doctors(doctors)
 
         self.stdout.write(self.style.SUCCESS(f'Successfully created {Doctor.objects.count()} doctor records.'))
\ No newline at end of file
@@ -1,5 +1,6 @@
 import random
 from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User, Group
 from django.db import transaction
 from accounts.models import Profile
@@ -30,6 +31,8 @@ class Command(BaseCommand):
         user_count = random.randint(500, 1000)
         self.stdout.write(f'Preparing to create {user_count} new dummy users...')
 
+        # Hash the shared password once; PBKDF2 per user would dominate the run.
+        password = make_password('password123')
         users_to_create = []
         for i in range(user_count):
             first_name = random.choice(first_names)
@@ -43,9 +46,9 @@ class Command(BaseCommand):
                 username=username,
                 email=email,
                 first_name=first_name,
-                last_name=last_name
+                last_name=last_name,
+                password=password,
             )
-            user.set_password('password123')
             users_to_create.append(user)
 
         # Keep track of the usernames we are about to create
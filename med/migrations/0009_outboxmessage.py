@@ -0,0 +1,46 @@
+# Generated by Django 3.2.7 on 2026-10-18 00:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('med', '0008_emaillog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('appointment_confirmation', 'Appointment Confirmation'), ('reschedule_confirmation', 'Reschedule Confirmation'), ('lab_test_confirmation', 'Lab Test Confirmation'), ('appointment_cancellation', 'Appointment Cancellation'), ('lab_test_cancellation', 'Lab Test Cancellation'), ('doctor_confirmation', 'Doctor Confirmation')], max_length=50)),
+                ('object_id', models.PositiveBigIntegerField(help_text='ID of the Appointment or LabTest the message is about.')),
+                ('user_id', models.PositiveBigIntegerField(help_text='ID of the User who receives the message.')),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Sending', 'Sending'), ('Sent', 'Sent'), ('Failed', 'Failed')], default='Pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claim_token', models.CharField(blank=True, default='', max_length=32)),
+                ('claimed_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['next_attempt_at', 'id'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='doctor',
+            name='user',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='doctor_profile', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='med_outbox_due_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.7 on 2026-10-18 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0009_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='channel',
+            field=models.CharField(default='email', help_text="Delivery channel, e.g. 'email' or 'sms'.", max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='outboxmessage',
+            name='kind',
+            field=models.CharField(help_text='Notification event type, see med.notifications.EVENTS.', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='outboxmessage',
+            name='user_id',
+            field=models.PositiveBigIntegerField(blank=True, help_text='ID of the User who receives the message.', null=True),
+        ),
+    ]
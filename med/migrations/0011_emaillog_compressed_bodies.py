@@ -0,0 +1,91 @@
+# Generated by Django 3.2.7 on 2026-10-18 00:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+import hashlib
+import zlib
+
+
+def compress_bodies(apps, schema_editor):
+    """Moves every EmailLog.body into a deduplicated, compressed EmailBody row."""
+    EmailLog = apps.get_model('med', 'EmailLog')
+    EmailBody = apps.get_model('med', 'EmailBody')
+    db_alias = schema_editor.connection.alias
+    bodies = {}
+    last_id = 0
+    while True:
+        batch = list(EmailLog.objects.using(db_alias).filter(pk__gt=last_id).order_by('pk').only('pk', 'body')[:500])
+        if not batch:
+            break
+        for log in batch:
+            content_hash = hashlib.sha256(log.body.encode('utf-8')).hexdigest()
+            body_id = bodies.get(content_hash)
+            if body_id is None:
+                encoded = log.body.encode('utf-8')
+                body_id = bodies[content_hash] = EmailBody.objects.using(db_alias).create(
+                    template='', content_hash=content_hash, data=zlib.compress(encoded, 9), size=len(encoded),
+                ).pk
+            EmailLog.objects.using(db_alias).filter(pk=log.pk).update(body_ref_id=body_id)
+        last_id = batch[-1].pk
+
+
+def restore_bodies(apps, schema_editor):
+    EmailLog = apps.get_model('med', 'EmailLog')
+    db_alias = schema_editor.connection.alias
+    for log in EmailLog.objects.using(db_alias).exclude(body_ref=None).select_related('body_ref').iterator():
+        EmailLog.objects.using(db_alias).filter(pk=log.pk).update(body=zlib.decompress(bytes(log.body_ref.data)).decode('utf-8'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0010_outbox_channels'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailBody',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('template', models.CharField(blank=True, default='', max_length=100)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveIntegerField(help_text='Uncompressed size in bytes.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='template',
+            field=models.CharField(blank=True, default='', help_text='Template the body was rendered from.', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='emaillog',
+            name='recipient',
+            field=models.EmailField(db_index=True, max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='emaillog',
+            name='sent_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='emaillog',
+            name='status',
+            field=models.CharField(choices=[('Sent', 'Sent'), ('Failed', 'Failed')], db_index=True, max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='emailbody',
+            constraint=models.UniqueConstraint(fields=('template', 'content_hash'), name='med_emailbody_unique_content'),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='body_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='logs', to='med.emailbody'),
+        ),
+        migrations.RunPython(compress_bodies, restore_bodies),
+        migrations.RemoveField(
+            model_name='emaillog',
+            name='body',
+        ),
+    ]
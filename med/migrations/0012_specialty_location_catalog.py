@@ -0,0 +1,76 @@
+# Generated by Django 3.2.7 on 2026-10-18 00:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import re
+
+
+def normalize_term(value):
+    return ' '.join(re.findall(r'[a-z0-9]+', (value or '').lower()))
+
+
+def populate_catalog(apps, schema_editor):
+    """Builds Specialty and Location rows from the free-text Doctor fields and links every doctor."""
+    Doctor = apps.get_model('med', 'Doctor')
+    Specialty = apps.get_model('med', 'Specialty')
+    Location = apps.get_model('med', 'Location')
+    db_alias = schema_editor.connection.alias
+
+    for model, text_field, fk_field in ((Specialty, 'expert', 'specialty'), (Location, 'location', 'city')):
+        for value in Doctor.objects.using(db_alias).values_list(text_field, flat=True).distinct():
+            entry, _ = model.objects.using(db_alias).get_or_create(
+                normalized=normalize_term(value), defaults={'name': value.strip()}
+            )
+            Doctor.objects.using(db_alias).filter(**{text_field: value}).update(**{fk_field: entry})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0011_emaillog_compressed_bodies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('normalized', models.CharField(editable=False, max_length=100, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Specialty',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('normalized', models.CharField(editable=False, max_length=100, unique=True)),
+            ],
+            options={
+                'verbose_name_plural': 'specialties',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='city',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='doctors', to='med.location'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='specialty',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='doctors', to='med.specialty'),
+        ),
+        migrations.RunPython(populate_catalog, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['specialty', 'city', 'name'], name='med_doctor_spec_city_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['city', 'name'], name='med_doctor_city_name_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.7 on 2026-10-18 00:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_bitmaps(apps, schema_editor):
+    """Sets one bit per non-cancelled appointment, slot i starting i * 30 minutes after midnight."""
+    Appointment = apps.get_model('med', 'Appointment')
+    DoctorDayAvailability = apps.get_model('med', 'DoctorDayAvailability')
+    db_alias = schema_editor.connection.alias
+    booked = {}
+    for doctor_id, day, slot_time in (
+        Appointment.objects.using(db_alias).exclude(status='Cancelled')
+        .values_list('doctor_id', 'appointment_date', 'appointment_time').iterator()
+    ):
+        bit = 1 << ((slot_time.hour * 60 + slot_time.minute) // 30)
+        booked[(doctor_id, day)] = booked.get((doctor_id, day), 0) | bit
+    DoctorDayAvailability.objects.using(db_alias).bulk_create(
+        [DoctorDayAvailability(doctor_id=doctor_id, date=day, booked=mask) for (doctor_id, day), mask in booked.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0012_specialty_location_catalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorDayAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('booked', models.BigIntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='med.doctor')),
+            ],
+            options={
+                'verbose_name_plural': 'doctor day availability',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='doctordayavailability',
+            constraint=models.UniqueConstraint(fields=('doctor', 'date'), name='med_availability_doctor_date'),
+        ),
+        # The hint lets the router run it on the appointment shards too (see med.sharding).
+        migrations.RunPython(build_bitmaps, migrations.RunPython.noop, hints={'model_name': 'doctordayavailability'}),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.7 on 2026-10-18 00:49
+
+from django.db import migrations, models
+
+
+def cancel_duplicate_bookings(apps, schema_editor):
+    """
+    Keeps the earliest live booking of each slot and cancels any later ones,
+    which the check-then-insert booking flow could let through under load.
+    The cancelled bookings' slot bits stay set because the kept booking holds them.
+    """
+    Appointment = apps.get_model('med', 'Appointment')
+    db_alias = schema_editor.connection.alias
+    duplicates = (
+        Appointment.objects.using(db_alias).exclude(status='Cancelled')
+        .values('doctor_id', 'appointment_date', 'appointment_time')
+        .annotate(count=models.Count('id'), first_id=models.Min('id'))
+        .filter(count__gt=1)
+    )
+    for slot in duplicates:
+        Appointment.objects.using(db_alias).filter(
+            doctor_id=slot['doctor_id'], appointment_date=slot['appointment_date'],
+            appointment_time=slot['appointment_time'],
+        ).exclude(status='Cancelled').exclude(pk=slot['first_id']).update(status='Cancelled')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0013_doctordayavailability'),
+    ]
+
+    operations = [
+        # The hint lets the router run it on the appointment shards too (see med.sharding).
+        migrations.RunPython(cancel_duplicate_bookings, migrations.RunPython.noop, hints={'model_name': 'appointment'}),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'Cancelled'), _negated=True), fields=('doctor', 'appointment_date', 'appointment_time'), name='med_appointment_unique_live_slot'),
+        ),
+    ]
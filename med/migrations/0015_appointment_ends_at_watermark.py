@@ -0,0 +1,50 @@
+# Generated by Django 3.2.7 on 2026-10-18 00:51
+
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_ends_at(apps, schema_editor):
+    Appointment = apps.get_model('med', 'Appointment')
+    db_alias = schema_editor.connection.alias
+    batch = []
+    for appointment in Appointment.objects.using(db_alias).only('appointment_date', 'appointment_time').iterator(chunk_size=2000):
+        start = timezone.make_aware(datetime.combine(appointment.appointment_date, appointment.appointment_time))
+        appointment.ends_at = start + timedelta(minutes=30)
+        batch.append(appointment)
+        if len(batch) == 2000:
+            Appointment.objects.using(db_alias).bulk_update(batch, ['ends_at'])
+            batch = []
+    Appointment.objects.using(db_alias).bulk_update(batch, ['ends_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0014_appointment_unique_live_slot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('value', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='ends_at',
+            field=models.DateTimeField(editable=False, help_text='When the appointment slot ends; set on save.', null=True),
+        ),
+        # The hint lets the router run it on the appointment shards too (see med.sharding).
+        migrations.RunPython(fill_ends_at, migrations.RunPython.noop, hints={'model_name': 'appointment'}),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'ends_at'], name='med_appt_status_ends_at_idx'),
+        ),
+    ]
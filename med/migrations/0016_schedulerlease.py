@@ -0,0 +1,23 @@
+# Generated by Django 3.2.7 on 2026-10-18 00:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0015_appointment_ends_at_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('holder', models.CharField(blank=True, default='', max_length=200)),
+                ('expires_at', models.DateTimeField()),
+                ('acquired_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
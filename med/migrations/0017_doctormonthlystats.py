@@ -0,0 +1,49 @@
+# Generated by Django 3.2.7 on 2026-10-18 00:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def build_stats(apps, schema_editor):
+    Appointment = apps.get_model('med', 'Appointment')
+    DoctorMonthlyStats = apps.get_model('med', 'DoctorMonthlyStats')
+    db_alias = schema_editor.connection.alias
+    rows = (
+        Appointment.objects.using(db_alias).order_by()
+        .annotate(year=ExtractYear('appointment_date'), month=ExtractMonth('appointment_date'))
+        .values('doctor_id', 'year', 'month', 'status')
+        .annotate(count=Count('id'))
+    )
+    DoctorMonthlyStats.objects.using(db_alias).bulk_create([DoctorMonthlyStats(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0016_schedulerlease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorMonthlyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Confirmed', 'Confirmed'), ('Cancelled', 'Cancelled'), ('Completed', 'Completed')], max_length=10)),
+                ('count', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to='med.doctor')),
+            ],
+            options={
+                'verbose_name_plural': 'doctor monthly stats',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='doctormonthlystats',
+            constraint=models.UniqueConstraint(fields=('doctor', 'year', 'month', 'status'), name='med_monthly_stats_bucket'),
+        ),
+        # The hint lets the router run it on the appointment shards too (see med.sharding).
+        migrations.RunPython(build_stats, migrations.RunPython.noop, hints={'model_name': 'doctormonthlystats'}),
+    ]
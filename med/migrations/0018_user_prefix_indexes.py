@@ -0,0 +1,25 @@
+from django.db import migrations
+
+# The admin dashboard filters users by username and email prefix. Django
+# runs istartswith as LIKE 'term%', which SQLite answers with an index range
+# scan when the column has an index with the NOCASE collation.
+INDEXES = [
+    ('med_user_username_nocase_idx', 'username'),
+    ('med_user_email_nocase_idx', 'email'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('med', '0017_doctormonthlystats'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE INDEX {name} ON auth_user ({column} COLLATE NOCASE)',
+            f'DROP INDEX {name}',
+        )
+        for name, column in INDEXES
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-18 01:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0018_user_prefix_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'appointment_date', 'appointment_time'], name='med_appt_doctor_slot_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.7 on 2026-10-18 01:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('med', '0019_appointment_doctor_slot_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='med_appt_status_ends_at_idx',
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='booked_by',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='booked_appointments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='doctor',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='appointments', to='med.doctor'),
+        ),
+        migrations.AlterField(
+            model_name='labtest',
+            name='booked_by',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='lab_tests', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('status', 'Confirmed')), fields=['ends_at'], name='med_appt_confirmed_ends_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['booked_by', 'appointment_date', 'appointment_time'], name='med_appt_patient_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labtest',
+            index=models.Index(fields=['booked_by', 'created_at'], name='med_labtest_patient_idx'),
+        ),
+    ]
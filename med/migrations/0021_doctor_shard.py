@@ -0,0 +1,20 @@
+# Generated by Django 3.2.7 on 2026-10-18 01:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0020_appointment_labtest_composite_indexes'),
+    ]
+
+    operations = [
+        # Existing doctors' appointments are in the default database.
+        migrations.AddField(
+            model_name='doctor',
+            name='shard',
+            field=models.CharField(blank=True, default='default', editable=False, max_length=30),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.7 on 2026-10-18 03:12
+
+from django.db import migrations
+
+
+def create_shard_outbox(apps, schema_editor):
+    """
+    Creates the outbox table in shards migrated before notifications were
+    written next to their appointments. Other databases already have it.
+    """
+    OutboxMessage = apps.get_model('med', 'OutboxMessage')
+    if OutboxMessage._meta.db_table not in schema_editor.connection.introspection.table_names():
+        schema_editor.create_model(OutboxMessage)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0022_dataversion'),
+    ]
+
+    operations = [
+        # The hint lets the router run it on the appointment shards too (see med.sharding).
+        migrations.RunPython(create_shard_outbox, migrations.RunPython.noop, hints={'model_name': 'outboxmessage'}),
+    ]
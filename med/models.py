@@ -1,10 +1,79 @@
-from django.db import models
+import hashlib
+import re
+import zlib
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from datetime import time, datetime, timedelta
 from decimal import Decimal
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .sharding import shard_for_location
+
+def normalize_term(value):
+    """
+    Lower-cases `value` and reduces it to space-separated alphanumeric tokens,
+    e.g. 'Skin-related issues' -> 'skin related issues'.
+    """
+    return ' '.join(re.findall(r'[a-z0-9]+', (value or '').lower()))
+
+class CatalogManager(models.Manager):
+    def for_name(self, name):
+        """Returns the entry for `name`, matching on its normalized form, creating it if needed."""
+        entry, _ = self.get_or_create(normalized=normalize_term(name), defaults={'name': name.strip()})
+        return entry
+
+    def for_names(self, names):
+        """
+        Returns {normalized name: entry} for `names`, creating missing entries
+        with one bulk insert. Names that normalize alike share an entry.
+        """
+        wanted = {}
+        for name in names:
+            wanted.setdefault(normalize_term(name), name.strip())
+        entries = {entry.normalized: entry for entry in self.filter(normalized__in=wanted)}
+        missing = [self.model(name=name, normalized=normalized) for normalized, name in wanted.items() if normalized not in entries]
+        if missing:
+            # bulk_create skips save(), so `normalized` is set above.
+            self.bulk_create(missing, ignore_conflicts=True)
+            entries.update((entry.normalized, entry) for entry in self.filter(normalized__in=[entry.normalized for entry in missing]))
+        return entries
+
+class Specialty(models.Model):
+    """A medical speciality doctors can be searched by."""
+    name = models.CharField(max_length=100, unique=True)
+    normalized = models.CharField(max_length=100, unique=True, editable=False)
+
+    objects = CatalogManager()
+
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = 'specialties'
+
+    def save(self, *args, **kwargs):
+        self.normalized = normalize_term(self.name)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+class Location(models.Model):
+    """A city or district doctors practise in."""
+    name = models.CharField(max_length=100, unique=True)
+    normalized = models.CharField(max_length=100, unique=True, editable=False)
+
+    objects = CatalogManager()
+
+    class Meta:
+        ordering = ['name']
+
+    def save(self, *args, **kwargs):
+        self.normalized = normalize_term(self.name)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
 class Doctor(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True, related_name='doctor_profile')
     GENDER_CHOICES = [
@@ -15,12 +84,50 @@ class Doctor(models.Model):
     name = models.CharField(max_length=100)
     expert = models.CharField(max_length=100)
     location = models.CharField(max_length=100)
+    # Indexed lookups kept in sync with the free-text `expert` and `location`
+    # fields on save; doctor search joins on these instead of scanning text.
+    specialty = models.ForeignKey(Specialty, on_delete=models.PROTECT, null=True, blank=True, editable=False, related_name='doctors')
+    city = models.ForeignKey(Location, on_delete=models.PROTECT, null=True, blank=True, editable=False, related_name='doctors')
     price = models.DecimalField(max_digits=8, decimal_places=2)
     gender= models.CharField(max_length=10, choices=GENDER_CHOICES, default='Male')
     rating= models.DecimalField(max_digits=2, decimal_places=1, validators=[MinValueValidator(0), MaxValueValidator(5)], default=Decimal('0.0'))
     description = models.TextField(help_text="A brief description or biography of the doctor.", default='No description provided.')
     from_time = models.TimeField(help_text="Available from time in 24hr format.", default=time(9, 0))
     to_time = models.TimeField(help_text="Available until time in 24hr format.", default=time(17, 0))
+    # The database holding the doctor's appointments, chosen from the location
+    # when the doctor is created (see med.sharding).
+    shard = models.CharField(max_length=30, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Serve "speciality in location, ordered by name" and
+            # "any speciality in location, ordered by name" from an index.
+            models.Index(fields=['specialty', 'city', 'name'], name='med_doctor_spec_city_name_idx'),
+            models.Index(fields=['city', 'name'], name='med_doctor_city_name_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded text so save() only re-resolves lookups that changed.
+        instance._loaded_catalog = (instance.__dict__.get('expert'), instance.__dict__.get('location'))
+        # And the linked user, whose cached roles change if it does (see med.roles).
+        instance._loaded_user_id = instance.__dict__.get('user_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self.shard:
+            self.shard = shard_for_location(self.location)
+        loaded_expert, loaded_location = getattr(self, '_loaded_catalog', (None, None))
+        if self.specialty_id is None or self.expert != loaded_expert:
+            self.specialty = Specialty.objects.for_name(self.expert)
+        if self.city_id is None or self.location != loaded_location:
+            self.city = Location.objects.for_name(self.location)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'specialty', 'city'}
+        super().save(*args, **kwargs)
+        self._loaded_catalog = (self.expert, self.location)
 
     def __str__(self):
         return self.name
@@ -32,16 +139,39 @@ class Appointment(models.Model):
         ('Cancelled', 'Cancelled'),
         ('Completed', 'Completed'),
     ]
-    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='appointments')
+    # The composite indexes in Meta lead with doctor and booked_by, so the
+    # foreign keys do not need indexes of their own.
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='appointments', db_index=False)
     patient_name = models.CharField(max_length=100)
     patient_age = models.PositiveIntegerField()
     patient_mobile = models.CharField(max_length=15)
-    booked_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='booked_appointments')
+    booked_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='booked_appointments', db_index=False)
     disease = models.CharField(max_length=100)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
     created_at = models.DateTimeField(auto_now_add=True)
     appointment_date = models.DateField(default=timezone.now)
     appointment_time = models.TimeField(default=time(0, 0))
+    ends_at = models.DateTimeField(null=True, editable=False, help_text="When the appointment slot ends; set on save.")
+
+    class Meta:
+        indexes = [
+            # Serves the status sweep: Confirmed appointments whose end has passed.
+            # Partial, so it holds only the appointments the sweep can still change.
+            models.Index(fields=['ends_at'], name='med_appt_confirmed_ends_idx', condition=models.Q(status='Confirmed')),
+            # Serves a doctor's appointment list, keyset-paginated on
+            # (appointment_date, appointment_time, id) in either direction.
+            models.Index(fields=['doctor', 'appointment_date', 'appointment_time'], name='med_appt_doctor_slot_idx'),
+            # Serves the patient's appointments tab, most recent first.
+            models.Index(fields=['booked_by', 'appointment_date', 'appointment_time'], name='med_appt_patient_slot_idx'),
+        ]
+        constraints = [
+            # A slot can be held by only one live appointment; cancelled ones free it.
+            models.UniqueConstraint(
+                fields=['doctor', 'appointment_date', 'appointment_time'],
+                condition=~models.Q(status='Cancelled'),
+                name='med_appointment_unique_live_slot',
+            ),
+        ]
 
     @property
     def appointment_end_time(self):
@@ -52,9 +182,126 @@ class Appointment(models.Model):
             return end_datetime.time()
         return None
 
+    # The fields tracked_state() reads, in its order.
+    TRACKED_FIELDS = ('doctor_id', 'appointment_date', 'appointment_time', 'status')
+    # The previous state of an instance that was not loaded from the database,
+    # or that was changed in a field loaded as deferred.
+    UNKNOWN_STATE = object()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the tracked values loaded, so saves can update the
+        # availability bitmaps and monthly stats incrementally (see med.signals).
+        instance._loaded_values = {name: instance.__dict__[name] for name in cls.TRACKED_FIELDS if name in instance.__dict__}
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        # Reading a deferred field also reads its stored value.
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is not None:
+            loaded.update((name, self.__dict__[name]) for name in self.TRACKED_FIELDS if fields is None or name in fields)
+
+    def save(self, *args, **kwargs):
+        end_time = self.appointment_end_time
+        self.ends_at = timezone.make_aware(datetime.combine(self.slot_date(), end_time)) if end_time else None
+        if end_time and end_time < self.appointment_time:
+            # A slot starting at 23:30 ends the next day.
+            self.ends_at += timedelta(days=1)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'ends_at'}
+        super().save(*args, **kwargs)
+
+    def tracked_state(self):
+        """The (doctor ID, date, time, status) values derived data depends on."""
+        return (self.doctor_id, self.slot_date(), self.appointment_time, self.status)
+
+    def loaded_state(self):
+        """
+        The tracked_state() the row had when this instance was loaded or last
+        saved, or UNKNOWN_STATE. A field that was deferred and still is has
+        not been written since, so its current value (one query) is the old one.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return self.UNKNOWN_STATE
+        deferred = self.get_deferred_fields()
+        if not all(name in loaded or name in deferred for name in self.TRACKED_FIELDS):
+            # Assigned after being loaded as deferred: the old value was never read.
+            return self.UNKNOWN_STATE
+        for name in deferred.intersection(self.TRACKED_FIELDS):
+            getattr(self, name)  # refresh_from_db() records it in _loaded_values
+        return tuple(loaded[name] for name in self.TRACKED_FIELDS)
+
+    def remember_state(self, state):
+        """Records `state`, a tracked_state(), as the row's current state."""
+        self._loaded_values = dict(zip(self.TRACKED_FIELDS, state))
+
+    @staticmethod
+    def slot_key(state):
+        """Returns the (doctor ID, date, time) slot held in `state`, or None if cancelled."""
+        doctor_id, appointment_date, appointment_time, status = state
+        if status == 'Cancelled' or appointment_time is None:
+            return None
+        return (doctor_id, appointment_date, appointment_time)
+
+    @staticmethod
+    def stats_key(state):
+        """Returns the DoctorMonthlyStats (doctor ID, year, month, status) bucket `state` counts in."""
+        doctor_id, appointment_date, _, status = state
+        return (doctor_id, appointment_date.year, appointment_date.month, status)
+
+    def slot_date(self):
+        # The field default is timezone.now, a datetime, until the row is reloaded.
+        if isinstance(self.appointment_date, datetime):
+            return self.appointment_date.date()
+        return self.appointment_date
+
     def __str__(self):
         return f"Appointment for {self.patient_name} with {self.doctor.name}"
 
+class DoctorDayAvailability(models.Model):
+    """
+    The slots booked for one doctor on one day, as a bitmask: bit i is set
+    when the 30-minute slot starting i * 30 minutes after midnight is taken.
+    Kept up to date from Appointment saves and deletes by med.signals.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='availability')
+    date = models.DateField()
+    booked = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'doctor day availability'
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'date'], name='med_availability_doctor_date'),
+        ]
+
+    def __str__(self):
+        return f"Availability for {self.doctor_id} on {self.date}"
+
+class DoctorMonthlyStats(models.Model):
+    """
+    Number of a doctor's appointments per month and status, by appointment
+    date. Kept up to date by med.signals and the status sweep and read by
+    the doctor dashboard instead of aggregating over every appointment.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='monthly_stats')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    status = models.CharField(max_length=10, choices=Appointment.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'doctor monthly stats'
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'year', 'month', 'status'], name='med_monthly_stats_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor_id} {self.year}-{self.month:02d} {self.status}: {self.count}"
+
 class LabTest(models.Model):
     STATUS_CHOICES = [
         ('Pending', 'Pending'),
@@ -64,24 +311,202 @@ class LabTest(models.Model):
     ]
     test_type = models.CharField(max_length=100)
     location = models.CharField(max_length=100)
-    booked_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lab_tests')
+    # Indexed by med_labtest_patient_idx below.
+    booked_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lab_tests', db_index=False)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Serves the patient's lab tests tab, most recent first.
+            models.Index(fields=['booked_by', 'created_at'], name='med_labtest_patient_idx'),
+        ]
+
     def __str__(self):
         return f"Lab test for {self.booked_by.username} - {self.test_type}"
 
+class EmailBody(models.Model):
+    """
+    A zlib-compressed email body. Bodies are deduplicated by template and
+    content hash, so identical messages are stored only once however many
+    EmailLog rows refer to them.
+    """
+    template = models.CharField(max_length=100, blank=True, default='')
+    content_hash = models.CharField(max_length=64)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField(help_text="Uncompressed size in bytes.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['template', 'content_hash'], name='med_emailbody_unique_content'),
+        ]
+
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    @property
+    def text(self):
+        return zlib.decompress(bytes(self.data)).decode('utf-8')
+
+    @classmethod
+    def intern_many(cls, items):
+        """
+        Returns a {(template, text): EmailBody} dict for an iterable of
+        (template, text) pairs, creating only the bodies not stored yet.
+        """
+        wanted = {}
+        for template, text in items:
+            wanted[(template, cls.hash_text(text))] = (template, text)
+        if not wanted:
+            return {}
+
+        def fetch():
+            hashes = {content_hash for _, content_hash in wanted}
+            return {
+                (body.template, body.content_hash): body
+                for body in cls.objects.filter(content_hash__in=hashes).defer('data')
+            }
+
+        found = fetch()
+        missing = [key for key in wanted if key not in found]
+        if missing:
+            cls.objects.bulk_create([
+                cls(template=template, content_hash=content_hash,
+                    data=zlib.compress(wanted[(template, content_hash)][1].encode('utf-8'), 9),
+                    size=len(wanted[(template, content_hash)][1].encode('utf-8')))
+                for template, content_hash in missing
+            ], ignore_conflicts=True)
+            found = fetch()
+        return {wanted[key]: body for key, body in found.items() if key in wanted}
+
+    def __str__(self):
+        return f"{self.template or 'untemplated'} {self.content_hash[:12]} ({self.size} bytes)"
+
+class EmailLogManager(models.Manager):
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Stores the bodies of all `objs` with one lookup before inserting them.
+        Both happen in one transaction, so prune_orphan_bodies() cannot
+        delete a body between its lookup and the rows that refer to it.
+        """
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            pending = [log for log in objs if log._pending_body is not None]
+            bodies = EmailBody.intern_many((log.template, log._pending_body) for log in pending)
+            for log in pending:
+                log.body_ref = bodies[(log.template, log._pending_body)]
+                log._pending_body = None
+            return super().bulk_create(objs, *args, **kwargs)
+
 class EmailLog(models.Model):
-    """Model to log all outgoing emails."""
-    recipient = models.EmailField()
+    """
+    Model to log all outgoing emails. The rendered body lives in a shared,
+    compressed EmailBody row; `body` reads and writes it transparently.
+    """
+    recipient = models.EmailField(db_index=True)
     subject = models.CharField(max_length=255)
-    body = models.TextField()
-    status = models.CharField(max_length=20, choices=[('Sent', 'Sent'), ('Failed', 'Failed')])
-    sent_at = models.DateTimeField(auto_now_add=True)
+    template = models.CharField(max_length=100, blank=True, default='', help_text="Template the body was rendered from.")
+    body_ref = models.ForeignKey(EmailBody, on_delete=models.PROTECT, null=True, blank=True, related_name='logs')
+    status = models.CharField(max_length=20, choices=[('Sent', 'Sent'), ('Failed', 'Failed')], db_index=True)
+    sent_at = models.DateTimeField(auto_now_add=True, db_index=True)
     error_message = models.TextField(blank=True, null=True, help_text="Error message if sending failed.")
 
+    objects = EmailLogManager()
+
+    _pending_body = None
+
     class Meta:
         ordering = ['-sent_at']
 
+    @property
+    def body(self):
+        if self._pending_body is not None:
+            return self._pending_body
+        return self.body_ref.text if self.body_ref_id else ''
+
+    @body.setter
+    def body(self, value):
+        self._pending_body = value
+
+    def save(self, *args, **kwargs):
+        if self._pending_body is None:
+            return super().save(*args, **kwargs)
+        # In one transaction with the lookup, as in EmailLogManager.bulk_create().
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            self.body_ref = EmailBody.intern_many([(self.template, self._pending_body)])[(self.template, self._pending_body)]
+            self._pending_body = None
+            super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Email to {self.recipient} - {self.subject} [{self.status}]"
+
+class Watermark(models.Model):
+    """The point up to which an incremental job has processed its rows."""
+    name = models.CharField(max_length=100, unique=True)
+    value = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
+
+class DataVersion(models.Model):
+    """
+    A change counter kept in the database, so every process reads the same
+    value (see med.versioning). Used for stamps stored outside the process,
+    such as the roles version saved in each session.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.value}"
+
+class SchedulerLease(models.Model):
+    """
+    Leader lease for `run_scheduler`. The process whose `holder` is stored
+    here runs the periodic jobs until `expires_at`. It renews the lease
+    while running; others take over once it expires.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    holder = models.CharField(max_length=200, blank=True, default='')
+    expires_at = models.DateTimeField()
+    acquired_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder or 'nobody'} until {self.expires_at}"
+
+class OutboxMessage(models.Model):
+    """
+    A notification waiting to be delivered. Rows are written in the same
+    transaction as the booking change that triggers them and are sent later
+    by the outbox drainer, which gives at-least-once delivery.
+    """
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Sending', 'Sending'),
+        ('Sent', 'Sent'),
+        ('Failed', 'Failed'),
+    ]
+    kind = models.CharField(max_length=50, help_text="Notification event type, see med.notifications.EVENTS.")
+    channel = models.CharField(max_length=20, default='email', help_text="Delivery channel, e.g. 'email' or 'sms'.")
+    object_id = models.PositiveBigIntegerField(help_text="ID of the Appointment or LabTest the message is about.")
+    user_id = models.PositiveBigIntegerField(null=True, blank=True, help_text="ID of the User who receives the message.")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True, default='')
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='med_outbox_due_idx'),
+        ]
+
     def __str__(self):
-        return f"Email to {self.recipient} - {self.subject} [{self.status}]"
\ No newline at end of file
+        return f"{self.kind} ({self.channel}) #{self.object_id} [{self.status}]"
\ No newline at end of file
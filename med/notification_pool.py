@@ -0,0 +1,298 @@
+"""
+A shared, bounded worker pool for background notification work.
+
+Views used to start one thread per email. The pool keeps a fixed number of
+worker threads and a bounded queue in front of them, so a burst of bookings
+or cancellations cannot grow the thread count or memory use. What happens
+when the queue is full is controlled by NOTIFICATION_QUEUE_FULL_POLICY:
+
+* 'block' - wait up to NOTIFICATION_BLOCK_TIMEOUT seconds for a free slot,
+  then drop the job.
+* 'drop'  - drop the job immediately.
+* 'spill' - write the job to NOTIFICATION_SPILL_DIR; workers load spilled
+  jobs back once the queue has room again.
+
+Jobs are referenced by the dotted path of a module-level function plus
+JSON-serialisable arguments, which is what makes spilling to disk possible.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 'block'
+DROP = 'drop'
+SPILL = 'spill'
+FULL_POLICIES = (BLOCK, DROP, SPILL)
+
+_STOP = object()
+
+
+class NotificationPool:
+    """A fixed-size thread pool with a bounded queue and an overflow policy."""
+
+    def __init__(self, workers=None, queue_size=None, full_policy=None, spill_dir=None, block_timeout=None):
+        self._workers_setting = workers
+        self._queue_size_setting = queue_size
+        self._full_policy_setting = full_policy
+        self._spill_dir_setting = spill_dir
+        self._block_timeout_setting = block_timeout
+
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._queue = None
+        self._threads = []
+        self._accepting = True
+        self._in_flight = 0
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'dropped': 0, 'spilled': 0}
+
+    # --- Configuration (read lazily so settings overrides are honoured) ---
+
+    @property
+    def workers(self):
+        if self._workers_setting is not None:
+            return self._workers_setting
+        return getattr(settings, 'NOTIFICATION_WORKERS', 2)
+
+    @property
+    def queue_size(self):
+        if self._queue_size_setting is not None:
+            return self._queue_size_setting
+        return getattr(settings, 'NOTIFICATION_QUEUE_SIZE', 500)
+
+    @property
+    def full_policy(self):
+        policy = self._full_policy_setting or getattr(settings, 'NOTIFICATION_QUEUE_FULL_POLICY', BLOCK)
+        if policy not in FULL_POLICIES:
+            raise ValueError(f"Unknown notification queue policy '{policy}'. Use one of {FULL_POLICIES}.")
+        return policy
+
+    @property
+    def spill_dir(self):
+        spill_dir = self._spill_dir_setting or getattr(settings, 'NOTIFICATION_SPILL_DIR', None)
+        return Path(spill_dir) if spill_dir else None
+
+    @property
+    def block_timeout(self):
+        if self._block_timeout_setting is not None:
+            return self._block_timeout_setting
+        return getattr(settings, 'NOTIFICATION_BLOCK_TIMEOUT', 5)
+
+    # --- Gauges ---
+
+    @property
+    def queue_length(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def spilled_backlog(self):
+        """Number of jobs currently waiting on disk."""
+        spill_dir = self.spill_dir
+        if not spill_dir or not spill_dir.is_dir():
+            return 0
+        return sum(1 for _ in spill_dir.glob('*.json'))
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            'workers': len(self._threads),
+            'queue_length': self.queue_length,
+            'queue_capacity': self.queue_size,
+            'in_flight': self.in_flight,
+            'spilled_backlog': self.spilled_backlog(),
+            'full_policy': self.full_policy,
+            **counters,
+        }
+
+    # --- Public API ---
+
+    def submit(self, func, *args):
+        """
+        Queues `func(*args)` for execution on a worker thread.
+        `func` must be a module-level function and `args` JSON-serialisable.
+        Returns True if the job was accepted (queued, spilled or run inline).
+        """
+        job = {'func': f'{func.__module__}.{func.__qualname__}', 'args': list(args)}
+        self._increment('submitted')
+
+        # With no workers configured the job runs inline, which keeps tests
+        # and management commands deterministic.
+        if self.workers <= 0:
+            self._run(job)
+            return True
+
+        if not self._accepting:
+            logger.warning("Notification pool is shutting down; spilling job %s.", job['func'])
+            return self._spill(job)
+
+        self._ensure_started()
+        policy = self.full_policy
+        try:
+            if policy == BLOCK:
+                self._queue.put(job, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            if policy == SPILL:
+                return self._spill(job)
+            self._increment('dropped')
+            logger.error("Notification queue is full; dropped job %s%s.", job['func'], tuple(job['args']))
+            return False
+
+    def shutdown(self, timeout=30):
+        """
+        Stops accepting new work and waits up to `timeout` seconds for queued
+        jobs to finish. Anything still queued after that is spilled to disk
+        (when a spill directory is configured) instead of being lost.
+        """
+        with self._lock:
+            if not self._threads:
+                return
+            self._accepting = False
+            threads = list(self._threads)
+
+        # Workers keep reloading spilled jobs while we wait, so a clean
+        # shutdown also works through the on-disk backlog.
+        deadline = time.monotonic() + timeout
+        while (self._queue.unfinished_tasks or self.spilled_backlog()) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        # Whatever is left did not finish in time; preserve it if we can.
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            if job is not _STOP:
+                self._spill(job)
+
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+
+        with self._lock:
+            self._threads = []
+            self._queue = None
+            self._accepting = True
+
+    # --- Internals ---
+
+    def _increment(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, args=(self._queue,), name=f'notification-worker-{index}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self, jobs):
+        while True:
+            try:
+                job = jobs.get(timeout=1)
+            except queue.Empty:
+                self._reload_spilled(jobs)
+                continue
+            try:
+                if job is _STOP:
+                    return
+                self._run(job)
+            finally:
+                jobs.task_done()
+            if jobs.empty():
+                self._reload_spilled(jobs)
+
+    def _run(self, job):
+        with self._lock:
+            self._in_flight += 1
+        close_old_connections()
+        try:
+            import_string(job['func'])(*job['args'])
+            self._increment('completed')
+        except Exception:
+            self._increment('failed')
+            logger.exception("Notification job %s failed.", job['func'])
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._in_flight -= 1
+
+    def _spill(self, job):
+        spill_dir = self.spill_dir
+        if not spill_dir:
+            self._increment('dropped')
+            logger.error("No NOTIFICATION_SPILL_DIR configured; dropped job %s.", job['func'])
+            return False
+        spill_dir.mkdir(parents=True, exist_ok=True)
+        # Names sort by creation time so spilled jobs are replayed in order.
+        name = f'{time.time_ns():020d}-{uuid.uuid4().hex}'
+        tmp_path = spill_dir / f'{name}.tmp'
+        tmp_path.write_text(json.dumps(job))
+        os.replace(tmp_path, spill_dir / f'{name}.json')
+        self._increment('spilled')
+        return True
+
+    def _reload_spilled(self, jobs):
+        """Moves spilled jobs back onto the queue while there is room."""
+        spill_dir = self.spill_dir
+        if not spill_dir or not spill_dir.is_dir():
+            return
+        if not self._spill_lock.acquire(blocking=False):
+            return
+        try:
+            for path in sorted(spill_dir.glob('*.json')):
+                if jobs.full():
+                    break
+                try:
+                    job = json.loads(path.read_text())
+                    path.unlink()
+                except (OSError, ValueError):
+                    logger.exception("Could not reload spilled notification job %s.", path)
+                    continue
+                try:
+                    jobs.put_nowait(job)
+                except queue.Full:
+                    # Lost the race for the last slot; put the job back on disk.
+                    self._spill(job)
+                    break
+        finally:
+            self._spill_lock.release()
+
+
+notification_pool = NotificationPool()
+
+
+def _shutdown_at_exit():
+    # Bounded, so a stuck SMTP server cannot hold up process exit; what is
+    # left is spilled to disk.
+    notification_pool.shutdown(timeout=getattr(settings, 'NOTIFICATION_SHUTDOWN_TIMEOUT', 5))
+
+
+atexit.register(_shutdown_at_exit)
@@ -0,0 +1,284 @@
+"""
+Notification dispatcher.
+
+Every notification is an event type (see EVENTS) about one Appointment or
+LabTest. `notify()` writes one outbox row per enabled channel inside the
+caller's transaction. When the outbox is drained, `load_entities()` fetches
+all the entities a batch refers to with one query per entity kind (and
+appointment shard, see med.sharding), and each
+channel renders and sends its rows.
+
+Adding a notification type means adding an Event to EVENTS; it does not add
+threads, queries or another copy of the fetch/render/send/log code.
+"""
+import json
+import threading
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.template.loader import get_template
+from django.utils import timezone
+
+from . import sharding
+from .models import Appointment, LabTest, EmailLog, OutboxMessage
+
+
+class Event:
+    """A notification type: which entity it is about and how each channel renders it."""
+
+    def __init__(self, name, label, entity, email_template, subject, sms_text):
+        self.name = name
+        self.label = label
+        self.entity = entity
+        self.email_template = email_template
+        self.subject = subject
+        self.sms_text = sms_text
+
+
+EVENTS = {event.name: event for event in [
+    Event(
+        'appointment_confirmation', 'Appointment Confirmation', 'appointment',
+        email_template='emails/appointment_confirmation.html',
+        subject="Your Appointment Request with Dr. {doctor.name}",
+        sms_text="MedEasy: Your appointment request with Dr. {doctor.name} on "
+                 "{appointment.appointment_date:%d %b %Y} at {appointment.appointment_time:%I:%M %p} has been received.",
+    ),
+    Event(
+        'reschedule_confirmation', 'Reschedule Confirmation', 'appointment',
+        email_template='emails/reschedule_confirmation.html',
+        subject="Your Appointment with Dr. {doctor.name} has been Rescheduled",
+        sms_text="MedEasy: Your appointment with Dr. {doctor.name} has been moved to "
+                 "{appointment.appointment_date:%d %b %Y} at {appointment.appointment_time:%I:%M %p}.",
+    ),
+    Event(
+        'lab_test_confirmation', 'Lab Test Confirmation', 'lab_test',
+        email_template='emails/lab_test_confirmation.html',
+        subject="Your Lab Test Request for a {lab_test.test_type}",
+        sms_text="MedEasy: Your {lab_test.test_type} request in {lab_test.location} has been received.",
+    ),
+    Event(
+        'appointment_cancellation', 'Appointment Cancellation', 'appointment',
+        email_template='emails/appointment_cancellation.html',
+        subject="Your Appointment with Dr. {doctor.name} has been Cancelled",
+        sms_text="MedEasy: Your appointment with Dr. {doctor.name} on "
+                 "{appointment.appointment_date:%d %b %Y} has been cancelled.",
+    ),
+    Event(
+        'lab_test_cancellation', 'Lab Test Cancellation', 'lab_test',
+        email_template='emails/lab_test_cancellation.html',
+        subject="Your Lab Test Request for a {lab_test.test_type} has been Cancelled",
+        sms_text="MedEasy: Your {lab_test.test_type} request has been cancelled.",
+    ),
+    Event(
+        'doctor_confirmation', 'Doctor Confirmation', 'appointment',
+        email_template='emails/doctor_confirmation.html',
+        subject="Your Appointment with Dr. {doctor.name} is Confirmed!",
+        sms_text="MedEasy: Dr. {doctor.name} has confirmed your appointment on "
+                 "{appointment.appointment_date:%d %b %Y} at {appointment.appointment_time:%I:%M %p}.",
+    ),
+]}
+
+
+# --- Entities ---
+
+def _appointment_context(appointment):
+    return {'appointment': appointment, 'doctor': appointment.doctor, 'user': appointment.booked_by}
+
+def _lab_test_context(lab_test):
+    return {'lab_test': lab_test, 'user': lab_test.booked_by}
+
+# entity kind -> (queryset used to load a batch, context builder)
+ENTITIES = {
+    'appointment': (
+        lambda: Appointment.objects.select_related('doctor', 'booked_by__profile'),
+        _appointment_context,
+    ),
+    'lab_test': (
+        lambda: LabTest.objects.select_related('booked_by__profile'),
+        _lab_test_context,
+    ),
+}
+
+
+def _entity_batches(kind, ids):
+    """Yields a (queryset, IDs) pair per database holding entities of `kind`."""
+    queryset, _ = ENTITIES[kind]
+    if kind != 'appointment':
+        yield queryset(), ids
+        return
+    for using, shard_ids in sharding.group_by_shard(ids).items():
+        if using == DEFAULT_DB_ALIAS:
+            yield queryset(), shard_ids
+        else:
+            # Users are not in the shard, so they cannot be joined there.
+            yield Appointment.objects.using(using).select_related('doctor').prefetch_related('booked_by__profile'), shard_ids
+
+
+def load_entities(messages):
+    """
+    Loads every entity referenced by `messages` with one query per entity kind.
+    Returns a dict keyed by (entity kind, object id).
+    """
+    ids_by_kind = {}
+    for message in messages:
+        event = EVENTS.get(message.kind)
+        if event:
+            ids_by_kind.setdefault(event.entity, set()).add(message.object_id)
+
+    entities = {}
+    for kind, ids in ids_by_kind.items():
+        for queryset, batch_ids in _entity_batches(kind, ids):
+            for pk, entity in queryset.in_bulk(batch_ids).items():
+                entities[(kind, pk)] = entity
+    return entities
+
+
+def build_context(event, entity):
+    _, context_builder = ENTITIES[event.entity]
+    return context_builder(entity)
+
+
+# --- Templates ---
+
+_template_cache = {}
+
+def get_cached_template(name):
+    """Compiles each email template once per process, whatever the template loader settings."""
+    template = _template_cache.get(name)
+    if template is None:
+        template = _template_cache[name] = get_template(name)
+    return template
+
+
+# --- Channels ---
+
+class Channel:
+    """
+    Base class for delivery channels. The outbox drainer opens a channel once
+    per batch, calls send() for each row and closes it afterwards.
+    """
+    name = None
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def render(self, event, context):
+        """Returns a (recipient, subject, body) tuple."""
+        raise NotImplementedError
+
+    def send(self, recipient, subject, body):
+        raise NotImplementedError
+
+    def log_entry(self, recipient, subject, body, status, error_message=None, template=''):
+        """Returns an unsaved audit record for the outcome, or None."""
+        return None
+
+
+class EmailChannel(Channel):
+    """Sends HTML email over a single connection per batch and audits it in EmailLog."""
+    name = 'email'
+
+    def __init__(self):
+        self.connection = None
+
+    def open(self):
+        self.connection = get_connection(fail_silently=False)
+        self.connection.open()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def render(self, event, context):
+        subject = event.subject.format(**context)
+        body = get_cached_template(event.email_template).render(context)
+        return context['user'].email, subject, body
+
+    def send(self, recipient, subject, body):
+        email = EmailMultiAlternatives(
+            subject=subject, body='', from_email=settings.EMAIL_HOST_USER,
+            to=[recipient], connection=self.connection,
+        )
+        email.attach_alternative(body, 'text/html')
+        self.connection.send_messages([email])
+
+    def log_entry(self, recipient, subject, body, status, error_message=None, template=''):
+        return EmailLog(
+            recipient=recipient, subject=subject, body=body, status=status,
+            error_message=error_message, template=template,
+        )
+
+
+class SmsChannel(Channel):
+    """
+    Stub SMS channel. Appends one JSON line per message to SMS_OUTBOX_FILE
+    until a real SMS gateway is wired in.
+    """
+    name = 'sms'
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.file = None
+
+    def open(self):
+        path = settings.SMS_OUTBOX_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def render(self, event, context):
+        if 'appointment' in context:
+            mobile = context['appointment'].patient_mobile
+        else:
+            profile = getattr(context['user'], 'profile', None)
+            mobile = profile.mobile if profile else ''
+        if not mobile:
+            raise ValueError("No mobile number on record.")
+        return mobile, '', event.sms_text.format(**context)
+
+    def send(self, recipient, subject, body):
+        line = json.dumps({'to': recipient, 'body': body, 'sent_at': timezone.now().isoformat()})
+        with self._lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+
+CHANNELS = {channel.name: channel for channel in (EmailChannel, SmsChannel)}
+
+
+def get_channel(name):
+    return CHANNELS[name]()
+
+
+def enabled_channels():
+    return getattr(settings, 'NOTIFICATION_CHANNELS', ['email'])
+
+
+# --- Public API ---
+
+def notify(event_name, entity):
+    """
+    Queues the `event_name` notification about `entity` (an Appointment or
+    LabTest) on every enabled channel. The outbox rows are written to the
+    entity's database (an appointment's shard, see med.sharding), so call it
+    inside the same transaction.atomic() block as the change it notifies about.
+    """
+    from .outbox import schedule_drain
+
+    if event_name not in EVENTS:
+        raise ValueError(f"Unknown notification event '{event_name}'.")
+    using = entity._state.db or DEFAULT_DB_ALIAS
+    OutboxMessage.objects.using(using).bulk_create([
+        OutboxMessage(kind=event_name, channel=channel, object_id=entity.pk, user_id=entity.booked_by_id)
+        for channel in enabled_channels()
+    ])
+    transaction.on_commit(schedule_drain, using=using)
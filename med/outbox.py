@@ -0,0 +1,240 @@
+"""
+Durable email outbox.
+
+Notifications are written as OutboxMessage rows (see notifications.notify)
+inside the same transaction as the Appointment or LabTest change, so a crash
+or restart never loses them. Delivery claims due rows in batches, renders
+them and sends each batch over a single reused channel connection. Failed messages are retried with exponential
+backoff until OUTBOX_MAX_ATTEMPTS is reached.
+
+Rows are drained by the `drain_outbox` management command, and after each
+commit a job is also handed to the notification pool so messages usually
+go out within a second without waiting for the next drain.
+
+With appointment shards (see med.sharding), each database has its own
+outbox holding the notifications about its rows. A drain visits them all;
+the EmailLog audit records are all written to the default database.
+"""
+import logging
+import threading
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import sharding
+from .models import EmailLog, OutboxMessage
+from .notification_pool import notification_pool
+from .notifications import EVENTS, build_context, get_channel, load_entities
+
+logger = logging.getLogger(__name__)
+
+# Set while a drain job is waiting on the notification pool, so a burst of
+# bookings schedules one drain instead of one job per message.
+_drain_scheduled = threading.Event()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def schedule_drain():
+    """Hands a drain job to the notification pool unless one is already waiting."""
+    if _drain_scheduled.is_set():
+        return
+    _drain_scheduled.set()
+    if not notification_pool.submit(deliver_pending):
+        # The pool refused the job; the drain_outbox command will pick it up.
+        _drain_scheduled.clear()
+
+
+def deliver_pending():
+    """Notification pool job: drains everything that is currently due."""
+    _drain_scheduled.clear()
+    drain()
+
+
+def retry_delay(attempts):
+    """Exponential backoff: base, 2 x base, 4 x base, ... capped at OUTBOX_RETRY_MAX_DELAY."""
+    base = _setting('OUTBOX_RETRY_BASE_DELAY', 30)
+    cap = _setting('OUTBOX_RETRY_MAX_DELAY', 3600)
+    return timedelta(seconds=min(cap, base * 2 ** max(0, attempts - 1)))
+
+
+def _due_filter(now):
+    # Pending rows whose retry time has come, plus rows claimed by a drainer
+    # that died before finishing them.
+    return Q(status='Pending', next_attempt_at__lte=now) | Q(status='Sending', claimed_until__lt=now)
+
+
+def claim_batch(batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    Claims up to `batch_size` due messages in the `using` database's outbox
+    and returns them. The claim is a conditional UPDATE, so concurrent
+    drainers never get the same row while its claim is live.
+    """
+    outbox = OutboxMessage.objects.using(using)
+    now = timezone.now()
+    due_ids = list(
+        outbox.filter(_due_filter(now))
+        .order_by('next_attempt_at', 'id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not due_ids:
+        return []
+
+    token = uuid.uuid4().hex
+    claimed_until = now + timedelta(seconds=_setting('OUTBOX_CLAIM_TIMEOUT', 300))
+    outbox.filter(_due_filter(now), pk__in=due_ids).update(
+        status='Sending', claim_token=token, claimed_until=claimed_until,
+    )
+    return list(outbox.filter(pk__in=due_ids, claim_token=token, status='Sending'))
+
+
+def _record_failure(message, error, now, max_attempts, permanent=False):
+    message.last_error = str(error)
+    if permanent or message.attempts >= max_attempts:
+        message.status = 'Failed'
+        return True
+    message.status = 'Pending'
+    message.next_attempt_at = now + retry_delay(message.attempts)
+    return False
+
+
+def deliver_batch(messages, using=DEFAULT_DB_ALIAS):
+    """
+    Delivers a batch claimed from the `using` database's outbox and records
+    the outcome of each message. Entities are loaded once for the whole
+    batch, and each channel is opened once (for email, one mail connection).
+    Returns a (sent, failed) tuple.
+    """
+    now = timezone.now()
+    max_attempts = _setting('OUTBOX_MAX_ATTEMPTS', 6)
+    entities = load_entities(messages)
+    logs = []
+    sent = failed = 0
+
+    by_channel = {}
+    for message in messages:
+        by_channel.setdefault(message.channel, []).append(message)
+
+    for channel_name, channel_messages in by_channel.items():
+        for message in channel_messages:
+            message.attempts += 1
+            message.claim_token = ''
+            message.claimed_until = None
+
+        channel = get_channel(channel_name)
+        try:
+            channel.open()
+        except Exception as e:
+            # e.g. the SMTP server is unreachable; retry the whole group later.
+            logger.exception("Could not open the %s channel.", channel_name)
+            for message in channel_messages:
+                _record_failure(message, e, now, max_attempts)
+            failed += len(channel_messages)
+            continue
+
+        try:
+            for message in channel_messages:
+                event = EVENTS.get(message.kind)
+                if event is None:
+                    # A retired or misspelt kind; fail this message, not the batch.
+                    error = f"Unknown notification kind '{message.kind}'"
+                    logger.error("%s in outbox message %s.", error, message.pk)
+                    _record_failure(message, error, now, max_attempts, permanent=True)
+                    logs.append(channel.log_entry("unknown", f"{message.kind} Failed", error, 'Failed', error))
+                    failed += 1
+                    continue
+                entity = entities.get((event.entity, message.object_id))
+                if entity is None or entity.booked_by is None:
+                    # The booking or user is gone; retrying will not help.
+                    _record_failure(message, "Object Does Not Exist", now, max_attempts, permanent=True)
+                    logs.append(channel.log_entry(
+                        "unknown", f"{event.label} Failed",
+                        f"Could not find objects for IDs {message.object_id}, {message.user_id}",
+                        'Failed', "Object Does Not Exist",
+                    ))
+                    failed += 1
+                    continue
+
+                recipient, subject = "unknown", event.label
+                try:
+                    recipient, subject, body = channel.render(event, build_context(event, entity))
+                    channel.send(recipient, subject, body)
+                except Exception as e:
+                    if _record_failure(message, e, now, max_attempts):
+                        logs.append(channel.log_entry(
+                            recipient, subject,
+                            f"Failed to render or send {event.label.lower()} after {message.attempts} attempts. Error: {e}",
+                            'Failed', str(e),
+                        ))
+                    failed += 1
+                    continue
+
+                message.status = 'Sent'
+                message.sent_at = timezone.now()
+                message.last_error = ''
+                logs.append(channel.log_entry(recipient, subject, body, 'Sent', template=event.email_template))
+                sent += 1
+        finally:
+            channel.close()
+
+    # The outbox commits first: if the email log then fails to commit, the
+    # audit records are lost rather than the messages being sent again.
+    with transaction.atomic(), transaction.atomic(using=using, savepoint=False):
+        OutboxMessage.objects.using(using).bulk_update(
+            messages,
+            ['status', 'attempts', 'next_attempt_at', 'claim_token', 'claimed_until', 'last_error', 'sent_at'],
+        )
+        EmailLog.objects.bulk_create([log for log in logs if log is not None])
+    return sent, failed
+
+
+def drain(batch_size=None, max_batches=None):
+    """
+    Claims and delivers batches from the outbox of every database until
+    nothing is due (or `max_batches` is hit in a database). Returns a
+    (sent, failed) tuple for the whole run.
+    """
+    batch_size = batch_size or _setting('OUTBOX_BATCH_SIZE', 50)
+    total_sent = total_failed = 0
+    for using in sharding.aliases():
+        sent, failed = _drain_database(using, batch_size, max_batches)
+        total_sent += sent
+        total_failed += failed
+    return total_sent, total_failed
+
+
+def _drain_database(using, batch_size, max_batches):
+    total_sent = total_failed = batches = 0
+    while max_batches is None or batches < max_batches:
+        messages = claim_batch(batch_size, using)
+        if not messages:
+            break
+        try:
+            sent, failed = deliver_batch(messages, using)
+        except Exception:
+            # Most likely the database itself. Leave the claim to expire so
+            # the batch is retried once OUTBOX_CLAIM_TIMEOUT has passed.
+            logger.exception("Outbox delivery failed for a batch of %d message(s).", len(messages))
+            total_failed += len(messages)
+            break
+        total_sent += sent
+        total_failed += failed
+        batches += 1
+    return total_sent, total_failed
+
+
+def status_counts():
+    """Returns {status: count} over the outboxes of every database."""
+    counts = Counter()
+    for rows in sharding.fan_out(
+        lambda alias: list(OutboxMessage.objects.using(alias).values_list('status').annotate(count=Count('id')).order_by())
+    ).values():
+        counts.update(dict(rows))
+    return dict(counts)
@@ -0,0 +1,169 @@
+"""
+Keyset (cursor) pagination for long listings.
+
+Paginator runs a COUNT(*) on every request and fetches page n with
+OFFSET (n - 1) * per_page, so deep pages get slower as the table grows.
+KeysetPaginator instead orders on a unique key, e.g. ('username', 'id'),
+and fetches the rows after (or before) the last row of the page the user
+came from. With an index on the key, every page costs one index range
+scan of per_page + 1 rows, however deep it is.
+
+Pages are addressed by opaque cursors, which encode the key of a row. An
+invalid cursor yields the first page. Total counts are cached separately
+by `cached_count()`, because they are only shown as an indication.
+
+ShardedKeysetPaginator pages through the same query on every appointment
+shard (see med.sharding) and merges the results.
+"""
+import base64
+import hashlib
+import json
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .versioning import data_version
+from .sharding import fan_out
+
+
+def encode_cursor(values):
+    data = json.dumps(list(values), cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """Returns the key values encoded in `cursor`, or None if it is not a valid cursor."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous, paginator):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.paginator = paginator
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        return self.paginator.cursor_for(self.object_list[-1]) if self.has_next else None
+
+    @property
+    def previous_cursor(self):
+        return self.paginator.cursor_for(self.object_list[0]) if self.has_previous else None
+
+
+class KeysetPaginator:
+    """
+    Paginates `queryset` on `ordering`, a sequence of non-null field names
+    (prefixed with '-' for descending order) that is unique per row. Names
+    may refer to annotations, e.g. a Collate() matching an index's collation.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.per_page = per_page
+
+    def cursor_for(self, obj):
+        return encode_cursor(getattr(obj, field) for field, _ in self.fields)
+
+    def _order_by(self, reverse):
+        return [('-' if descending != reverse else '') + field for field, descending in self.fields]
+
+    def _beyond(self, values, reverse):
+        """Q for the rows after `values` in the ordering (before them if `reverse`)."""
+        beyond = Q()
+        for i, (field, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition = Q(**{f'{field}__{lookup}': values[i]})
+            for j, (previous, _) in enumerate(self.fields[:i]):
+                condition &= Q(**{previous: values[j]})
+            beyond |= condition
+        # Repeat the leading field as a plain range so the index can seek to it.
+        field, descending = self.fields[0]
+        lookup = 'lte' if descending != reverse else 'gte'
+        return Q(**{f'{field}__{lookup}': values[0]}) & beyond
+
+    def _fetch(self, queryset, after, before, reverse):
+        """The first per_page + 1 rows of `queryset` beyond the cursor, in page order (reversed if `reverse`)."""
+        rows = queryset.order_by(*self._order_by(reverse))
+        if after:
+            rows = rows.filter(self._beyond(after, reverse=False))
+        elif before:
+            rows = rows.filter(self._beyond(before, reverse=True))
+        return list(rows[:self.per_page + 1])
+
+    def _rows(self, after, before, reverse):
+        return self._fetch(self.queryset, after, before, reverse)
+
+    def page(self, after=None, before=None, last=False):
+        """
+        Returns the page following the `after` cursor, the page preceding the
+        `before` cursor, the last page if `last`, or else the first page.
+        """
+        length = len(self.fields)
+        after = decode_cursor(after, length) if after else None
+        before = decode_cursor(before, length) if before and not after else None
+        reverse = bool(before) or (last and not after)
+
+        rows = self._rows(after, before, reverse)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            rows.reverse()
+            return KeysetPage(rows, has_next=bool(before), has_previous=has_more, paginator=self)
+        return KeysetPage(rows, has_next=has_more, has_previous=bool(after), paginator=self)
+
+
+class ShardedKeysetPaginator(KeysetPaginator):
+    """
+    Paginates the union of `querysets`, a {database alias: queryset} dict.
+    Each page fetches per_page + 1 rows beyond the cursor from every
+    database concurrently and keeps the first per_page of them in order.
+    """
+
+    def __init__(self, querysets, ordering, per_page):
+        super().__init__(None, ordering, per_page)
+        self.querysets = querysets
+
+    def _rows(self, after, before, reverse):
+        results = fan_out(lambda alias: self._fetch(self.querysets[alias], after, before, reverse), using=self.querysets)
+        rows = [row for shard_rows in results.values() for row in shard_rows]
+        # Stable sorts from the last key to the first give the full ordering.
+        for field, descending in reversed(self.fields):
+            rows.sort(key=attrgetter(field), reverse=descending != reverse)
+        return rows[:self.per_page + 1]
+
+
+def cached_count(queryset, version_key):
+    """
+    Returns queryset.count(), cached per query until `version_key` is bumped
+    or LIST_COUNT_CACHE_TIMEOUT seconds pass, whichever comes first.
+    """
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(repr((sql, params)).encode()).hexdigest()
+    key = f'med:count:{version_key}:{data_version(version_key)}:{digest}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.LIST_COUNT_CACHE_TIMEOUT)
+    return count
@@ -0,0 +1,127 @@
+"""
+The logged-in user's roles, cached in their session.
+
+`group_required`, the doctor views and the navigation bar need the user's
+group names and doctor profile. `get_roles()` loads both, plus the user's
+Profile ID, with a single query the first time it is called in a session.
+It then keeps them in the session, so later requests authorize without
+querying.
+
+A cached entry is used only while the user's roles version stamp (and the
+global one) is unchanged and it is younger than ROLE_CACHE_TIMEOUT seconds.
+The signal handlers in med.signals bump the stamps when group memberships
+change, from the admin or anywhere else, and when a doctor or patient
+profile is linked or unlinked. The timeout bounds staleness after changes
+that send no signals, such as raw SQL.
+
+The stamps are saved in sessions, which any worker process may serve, so
+they are DataVersion rows rather than cache counters (see med.versioning):
+checking them costs one query per request whatever the cache backend, and
+never disagrees between processes.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+
+from .versioning import bump_shared_version, shared_versions
+
+SESSION_KEY = '_med_roles'
+
+# Bumped when the affected users are not known, e.g. a group is deleted.
+ALL_USERS = 'roles'
+
+
+def version_key(user_id):
+    return f'roles:{user_id}'
+
+
+def invalidate(user_ids=None):
+    """Drops the cached roles of `user_ids`, or of every user if None."""
+    if user_ids is None:
+        bump_shared_version(ALL_USERS)
+        return
+    for user_id in set(user_ids):
+        if user_id is not None:
+            bump_shared_version(version_key(user_id))
+
+
+class Roles:
+    def __init__(self, groups=(), doctor_id=None, doctor_name='', profile_id=None, doctor_shard=DEFAULT_DB_ALIAS):
+        self.groups = frozenset(groups)
+        self.doctor_id = doctor_id
+        self.doctor_name = doctor_name
+        self.profile_id = profile_id
+        # The database holding the doctor's appointments (see med.sharding).
+        self.doctor_shard = doctor_shard
+
+    def in_any(self, group_names):
+        return not self.groups.isdisjoint(group_names)
+
+    @property
+    def is_doctor(self):
+        return 'Doctors' in self.groups
+
+    def as_dict(self):
+        return {
+            'groups': sorted(self.groups),
+            'doctor_id': self.doctor_id,
+            'doctor_name': self.doctor_name,
+            'profile_id': self.profile_id,
+            'doctor_shard': self.doctor_shard,
+        }
+
+
+def load_roles(user):
+    """Reads the user's groups, doctor and profile in one query."""
+    rows = User.objects.filter(pk=user.pk).values_list(
+        'groups__name', 'doctor_profile__id', 'doctor_profile__name', 'profile__id', 'doctor_profile__shard',
+    )
+    groups = set()
+    doctor = None
+    profile_id = None
+    # One row per group, each repeating the doctor and profile columns.
+    for group, row_doctor_id, row_doctor_name, row_profile_id, row_doctor_shard in rows:
+        if group:
+            groups.add(group)
+        if row_doctor_id is not None:
+            doctor = (row_doctor_id, row_doctor_name, row_doctor_shard)
+        if row_profile_id is not None:
+            profile_id = row_profile_id
+    doctor_id, doctor_name, doctor_shard = doctor or (None, '', None)
+    return Roles(groups, doctor_id, doctor_name or '', profile_id, doctor_shard or DEFAULT_DB_ALIAS)
+
+
+def _version(user_id):
+    return shared_versions([ALL_USERS, version_key(user_id)])
+
+
+def get_roles(request):
+    """Returns the roles of request.user, from the session when still valid."""
+    roles = getattr(request, '_med_roles', None)
+    if roles is not None:
+        return roles
+    user = request.user
+    if not user.is_authenticated:
+        roles = Roles()
+    else:
+        version = _version(user.pk)
+        cached = request.session.get(SESSION_KEY)
+        if (
+            cached and cached['user_id'] == user.pk and cached['version'] == version
+            and cached['expires'] > time.time() and 'doctor_shard' in cached
+        ):
+            roles = Roles(
+                cached['groups'], cached['doctor_id'], cached['doctor_name'], cached['profile_id'], cached['doctor_shard'],
+            )
+        else:
+            roles = load_roles(user)
+            request.session[SESSION_KEY] = {
+                **roles.as_dict(),
+                'user_id': user.pk,
+                'version': version,
+                'expires': time.time() + getattr(settings, 'ROLE_CACHE_TIMEOUT', 300),
+            }
+    request._med_roles = roles
+    return roles
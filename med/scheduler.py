@@ -0,0 +1,230 @@
+"""
+In-process scheduler for periodic jobs, run by `manage.py run_scheduler`.
+
+Several scheduler processes may be started, e.g. one per web node. Only the
+holder of the SchedulerLease row runs jobs. The lease is taken and renewed
+with conditional UPDATEs, and a standby takes over when the leader stops
+renewing it. While a job runs, a heartbeat thread keeps renewing the lease,
+so a job that outlasts SCHEDULER_LEASE_TTL does not let a standby start
+running jobs alongside it.
+
+Each job's last run is stored as a Watermark row, so a restarted or newly
+elected leader knows which jobs are overdue. A job that missed one or more
+runs is run once to catch up rather than once per missed interval. Each
+next run is offset by a random jitter so jobs do not all fire on the same tick.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .jobs import complete_past_appointments
+from .models import SchedulerLease, Watermark
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'scheduler'
+
+
+def clear_expired_sessions():
+    """Same as `manage.py clearsessions`, without a separate process."""
+    engine = import_module(settings.SESSION_ENGINE)
+    engine.SessionStore.clear_expired()
+
+
+class Job:
+    """A function to run every `interval` seconds, plus up to `jitter` seconds."""
+
+    def __init__(self, name, func, interval, jitter=0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+
+    @property
+    def watermark_name(self):
+        return f'scheduler:{self.name}'
+
+
+JOBS = {job.name: job for job in [
+    Job('appointment_status_sweep', complete_past_appointments, interval=300, jitter=30),
+    Job('clear_expired_sessions', clear_expired_sessions, interval=24 * 3600, jitter=600),
+]}
+
+
+# --- Leader lease ---
+
+def default_holder():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def acquire_lease(holder, ttl, name=LEASE_NAME):
+    """
+    Takes or renews the lease for `ttl` seconds. Returns True if `holder`
+    now holds it. The UPDATE only matches a lease that is ours or has expired,
+    so two processes can never both succeed.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl)
+    renewed = SchedulerLease.objects.filter(name=name, holder=holder).update(expires_at=expires_at)
+    if renewed:
+        return True
+    taken = SchedulerLease.objects.filter(name=name, expires_at__lt=now).update(
+        holder=holder, expires_at=expires_at, acquired_at=now,
+    )
+    if taken:
+        return True
+    try:
+        with transaction.atomic():
+            SchedulerLease.objects.create(name=name, holder=holder, expires_at=expires_at, acquired_at=now)
+        return True
+    except IntegrityError:
+        # The lease exists and is held by a live process.
+        return False
+
+
+def release_lease(holder, name=LEASE_NAME):
+    """Gives up the lease so a standby can take over without waiting for it to expire."""
+    SchedulerLease.objects.filter(name=name, holder=holder).update(holder='', expires_at=timezone.now())
+
+
+class LeaseHeartbeat:
+    """
+    Renews the lease every `interval` seconds from a background thread for
+    as long as the `with` block runs. Sets `lost` if another node holds the
+    lease by then (e.g. after renewals failed for a whole TTL); the job itself
+    cannot be interrupted, but the scheduler stops running jobs after it.
+    """
+
+    def __init__(self, holder, ttl, interval):
+        self.holder = holder
+        self.ttl = ttl
+        self.interval = interval
+        self.lost = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    if not acquire_lease(self.holder, self.ttl):
+                        self.lost = True
+                        return
+                except Exception:
+                    # E.g. the job holding the write lock; try again next beat.
+                    logger.exception("Scheduler lease heartbeat failed.")
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name='scheduler-heartbeat', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+
+# --- Scheduler ---
+
+class Scheduler:
+    def __init__(self, jobs=None, holder=None, lease_ttl=None, tick=None):
+        self.jobs = list((jobs or JOBS).values())
+        self.holder = holder or default_holder()
+        self.lease_ttl = lease_ttl or getattr(settings, 'SCHEDULER_LEASE_TTL', 60)
+        self.tick = tick or getattr(settings, 'SCHEDULER_TICK', 5)
+        # Renew a few times per TTL, so one failed renewal does not lose the lease.
+        self.heartbeat = self.lease_ttl / 3
+        self.is_leader = False
+        self._next_run = {}
+
+    def _load_schedule(self):
+        """Works out each job's next run from when it last ran, on any node."""
+        last_runs = dict(
+            Watermark.objects.filter(name__in=[job.watermark_name for job in self.jobs])
+            .values_list('name', 'value')
+        )
+        now = timezone.now()
+        for job in self.jobs:
+            last_run = last_runs.get(job.watermark_name)
+            self._next_run[job.name] = (last_run + timedelta(seconds=job.interval)) if last_run else now
+
+    def _schedule_next(self, job, now):
+        self._next_run[job.name] = now + timedelta(seconds=job.interval + random.uniform(0, job.jitter))
+
+    def run_job(self, job, now):
+        missed = int((now - self._next_run[job.name]).total_seconds() // job.interval)
+        if missed:
+            logger.info("Catching up on job %s after %d missed run(s).", job.name, missed)
+        started = time.monotonic()
+        with LeaseHeartbeat(self.holder, self.lease_ttl, self.heartbeat) as heartbeat:
+            try:
+                job.func()
+            except Exception:
+                logger.exception("Scheduled job %s failed.", job.name)
+            else:
+                logger.info("Scheduled job %s finished in %.3fs.", job.name, time.monotonic() - started)
+        Watermark.objects.update_or_create(name=job.watermark_name, defaults={'value': now})
+        self._schedule_next(job, now)
+        if heartbeat.lost:
+            self.is_leader = False
+            logger.warning("Scheduler lease lost by %s while running job %s.", self.holder, job.name)
+
+    def run_pending(self):
+        """
+        Renews (or tries to take) the lease and, as leader, runs every due job.
+        Returns the names of the jobs that ran.
+        """
+        was_leader = self.is_leader
+        self.is_leader = acquire_lease(self.holder, self.lease_ttl)
+        if not self.is_leader:
+            if was_leader:
+                logger.warning("Scheduler lease lost by %s.", self.holder)
+            return []
+        if not was_leader:
+            logger.info("Scheduler lease acquired by %s.", self.holder)
+            # Another node may have run jobs while we were on standby.
+            self._load_schedule()
+
+        ran = []
+        for job in self.jobs:
+            now = timezone.now()
+            if self._next_run[job.name] <= now:
+                if ran and not acquire_lease(self.holder, self.lease_ttl):
+                    # Another node took over, e.g. while renewals failed during the previous job.
+                    self.is_leader = False
+                    logger.warning("Scheduler lease lost by %s.", self.holder)
+                    break
+                self.run_job(job, now)
+                ran.append(job.name)
+                if not self.is_leader:
+                    break
+        return ran
+
+    def run_forever(self, should_stop=lambda: False):
+        try:
+            while not should_stop():
+                close_old_connections()
+                try:
+                    self.run_pending()
+                except Exception:
+                    # Usually the database being unavailable; try again next tick.
+                    logger.exception("Scheduler tick failed.")
+                    self.is_leader = False
+                close_old_connections()
+                time.sleep(self.tick)
+        finally:
+            if self.is_leader:
+                release_lease(self.holder)
+                self.is_leader = False
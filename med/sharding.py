@@ -0,0 +1,211 @@
+"""
+Appointment shards: per-region SQLite files keyed by doctor location.
+
+SQLite allows one writer per database file, so every booking in the country
+queues for the same lock. With MED_SHARDS configured, the appointments of
+the doctors in a region, with their availability bitmaps and monthly stats,
+live in that region's own database, and bookings in different regions
+commit in parallel:
+
+    MED_SHARDS = {
+        'north': {'id': 1, 'locations': ['Kalyan', 'Bhiwandi', 'Shahapur']},
+        'south': {'id': 2, 'locations': ['Pune', 'Satara']},
+    }
+
+Each alias is also a DATABASES entry (see settings). Doctors in locations
+that no shard lists stay in the default database, as does everything else:
+users, lab tests, the email log, the doctor directory.
+
+- A doctor's shard is chosen from their location when they are created and
+  stored on Doctor.shard. Moving a doctor to another region later does not
+  move their appointments, so the field is not changed with the location.
+- Every shard holds a read-only replica of its doctors (kept in step by
+  med.signals), so appointments can join their doctor and keep a foreign
+  key to it. Users are not replicated; shard connections run without
+  SQLite foreign key enforcement because of that.
+- Appointment IDs are allocated from a separate range per shard (shard id
+  times ID_SPAN), so an appointment ID alone identifies its shard and stays
+  unique in URLs and outbox messages.
+- Every database has an outbox table. Notifications about an appointment
+  are written to its database, in the transaction that changes it, and
+  the outbox drainer visits every database (see med.outbox).
+- Queries on sharded models go to the shard given with .using();
+  `ShardRouter` only routes related-object access and saves of instances.
+  A patient's bookings span shards and are read with `fan_out()`.
+
+A shard's database is created with `python manage.py migrate --database <alias>`.
+The Django admin lists the default database's appointments only.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+
+# Appointment IDs per shard; shard n allocates from n * ID_SPAN upwards.
+ID_SPAN = 10 ** 12
+
+SHARDED_MODELS = {'med.appointment', 'med.doctordayavailability', 'med.doctormonthlystats'}
+REPLICATED_MODELS = {'med.doctor'}
+# Models with a table in every database, always queried with .using().
+LOCAL_MODELS = {'med.outboxmessage'}
+# Models whose tables are created in the shards; 'doctors' is Doctor's name before migration 0003.
+SHARD_MODELS = SHARDED_MODELS | REPLICATED_MODELS | LOCAL_MODELS | {'med.doctors'}
+
+
+def shard_map():
+    return getattr(settings, 'MED_SHARDS', {})
+
+
+def aliases():
+    """Every database that holds appointments, the default one first."""
+    return [DEFAULT_DB_ALIAS, *shard_map()]
+
+
+def shard_ids():
+    """Returns {alias: shard id}, with the default database as shard 0."""
+    ids = {DEFAULT_DB_ALIAS: 0}
+    for alias, shard in shard_map().items():
+        if not isinstance(shard.get('id'), int) or shard['id'] <= 0 or shard['id'] in ids.values():
+            raise ImproperlyConfigured(f"MED_SHARDS['{alias}'] needs a unique positive integer 'id'.")
+        ids[alias] = shard['id']
+    return ids
+
+
+def shard_for_location(location):
+    normalized = (location or '').strip().lower()
+    for alias, shard in shard_map().items():
+        if normalized in (name.strip().lower() for name in shard.get('locations', ())):
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+def shard_for_id(appointment_id):
+    """The database holding the appointment with this ID (the default one if unknown)."""
+    index = int(appointment_id) // ID_SPAN
+    for alias, shard_id in shard_ids().items():
+        if shard_id == index:
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+def group_by_shard(appointment_ids):
+    """Returns {alias: [IDs]} for appointment IDs."""
+    groups = {}
+    for appointment_id in appointment_ids:
+        groups.setdefault(shard_for_id(appointment_id), []).append(appointment_id)
+    return groups
+
+
+def id_range_start(alias):
+    return shard_ids().get(alias, 0) * ID_SPAN
+
+
+def start_id_range(using):
+    """Moves the shard's appointment ID sequence to the start of its range. Run after migrating it."""
+    start = id_range_start(using)
+    if not start:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'med_appointment'")
+        if cursor.fetchone()[0] >= start:
+            return
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'med_appointment'")
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('med_appointment', %s)", [start])
+
+
+@contextmanager
+def atomic(using):
+    """
+    transaction.atomic() on the shard and on the default database, for jobs
+    that change appointments and record their progress in the default
+    database (e.g. a Watermark). The shard commits first. Requests that only
+    change appointments, with their outbox rows, use transaction.atomic() on
+    the shard alone, so bookings in different regions never queue for the
+    default database's write lock.
+    """
+    if using == DEFAULT_DB_ALIAS:
+        with transaction.atomic(using=using):
+            yield
+        return
+    with transaction.atomic(using=DEFAULT_DB_ALIAS), transaction.atomic(using=using):
+        yield
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'SHARD_FANOUT_WORKERS', 8), thread_name_prefix='med-shard',
+            )
+        return _executor
+
+
+def fan_out(func, using=None):
+    """
+    Calls func(alias) for every shard (or for the aliases in `using`) in
+    the fan-out thread pool and returns {alias: result}. A single shard is
+    queried in the calling thread, inside its transaction if it has one.
+    """
+    using = list(aliases() if using is None else using)
+    if len(using) == 1:
+        return {using[0]: func(using[0])}
+
+    def call(alias):
+        try:
+            return func(alias)
+        finally:
+            # Pool threads keep their connections for CONN_MAX_AGE, like request threads.
+            close_old_connections()
+
+    futures = {alias: _get_executor().submit(call, alias) for alias in using}
+    return {alias: future.result() for alias, future in futures.items()}
+
+
+class ShardRouter:
+    """
+    Routes sharded rows reached through an instance to the instance's shard,
+    and everything else to the default database.
+    """
+
+    def _shard_of(self, instance):
+        if instance is None:
+            return None
+        label = instance._meta.label_lower
+        if label in REPLICATED_MODELS:
+            return instance.shard or DEFAULT_DB_ALIAS
+        if label in SHARDED_MODELS:
+            return instance._state.db or instance.doctor.shard or DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        label = model._meta.label_lower
+        instance = hints.get('instance')
+        if label in SHARDED_MODELS:
+            return self._shard_of(instance)
+        if label in REPLICATED_MODELS and instance is not None and instance._meta.label_lower in SHARDED_MODELS:
+            # A sharded row's doctor, from the replica next to it.
+            return instance._state.db
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if model._meta.label_lower in SHARDED_MODELS:
+            return self._shard_of(hints.get('instance'))
+        # Doctors are written to the default database and copied to their shard.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Sharded rows refer to users and doctors in the default database.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in shard_map():
+            return None
+        return f'{app_label}.{model_name}' in SHARD_MODELS
@@ -0,0 +1,138 @@
+"""
+Signal handlers that keep derived data in step with the database.
+Connected in MedConfig.ready().
+"""
+from django.contrib.auth.models import Group, User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from accounts.models import Profile
+
+from . import availability, roles, sharding, stats
+from .versioning import bump_data_version
+from .models import Appointment, Doctor, Location
+
+
+@receiver([post_save, post_delete], sender=Doctor)
+@receiver([post_save, post_delete], sender=Location)
+def doctor_directory_changed(sender, **kwargs):
+    bump_data_version('doctors')
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # Logins save last_login; only new accounts change the user counts.
+    if created:
+        bump_data_version('users')
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    bump_data_version('users')
+    # booked_by is SET_NULL, which the delete only applies in the default database.
+    for alias in sharding.aliases()[1:]:
+        Appointment.objects.using(alias).filter(booked_by_id=instance.pk).update(booked_by=None)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    bump_data_version('users')
+    if not reverse:
+        roles.invalidate([instance.pk])
+    elif pk_set is not None:
+        # Changed from the group's side: pk_set holds the users.
+        roles.invalidate(pk_set)
+    else:
+        # group.user_set.clear(); the former members are no longer known.
+        roles.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Group)
+def group_changed(sender, **kwargs):
+    # A rename or delete changes the roles of every member.
+    roles.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Doctor)
+def doctor_profile_changed(sender, instance, **kwargs):
+    # The doctor may have been linked to a different user (or renamed).
+    loaded_user_id = getattr(instance, '_loaded_user_id', None)
+    roles.invalidate([instance.user_id, loaded_user_id])
+    instance._loaded_user_id = instance.user_id
+
+
+@receiver(post_save, sender=Doctor)
+def replicate_doctor(sender, instance, using, **kwargs):
+    """Copies the doctor to the shard holding their appointments (see med.sharding)."""
+    if using != DEFAULT_DB_ALIAS or instance.shard == DEFAULT_DB_ALIAS:
+        return
+    values = {field.attname: getattr(instance, field.attname) for field in Doctor._meta.concrete_fields}
+    # Queryset writes, so the copy sends no signals of its own.
+    replicas = Doctor.objects.using(instance.shard)
+    if not replicas.filter(pk=instance.pk).update(**values):
+        replicas.bulk_create([Doctor(**values)])
+
+
+@receiver(post_delete, sender=Doctor)
+def drop_doctor_replica(sender, instance, using, **kwargs):
+    # Deletes the doctor's appointments in the shard along with the replica.
+    if using == DEFAULT_DB_ALIAS and instance.shard != DEFAULT_DB_ALIAS:
+        Doctor.objects.using(instance.shard).filter(pk=instance.pk).delete()
+
+
+@receiver(post_migrate)
+def shard_migrated(sender, using, **kwargs):
+    if sender.name == 'med':
+        sharding.start_id_range(using)
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def patient_profile_changed(sender, instance, **kwargs):
+    roles.invalidate([instance.user_id])
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, created, using, **kwargs):
+    """
+    Moves the appointment's bit in the availability bitmaps when its slot
+    changes, and its count between monthly stats buckets when its month or
+    status changes.
+    """
+    old = None if created else instance.loaded_state()
+    new = instance.tracked_state()
+    if old is Appointment.UNKNOWN_STATE:
+        # Not loaded from the database, or changed in a field that was
+        # deferred when it was: recompute what the previous state fed.
+        availability.rebuild_day(instance.doctor_id, instance.slot_date(), using)
+        stats.rebuild([instance.doctor_id], using)
+    elif old != new:
+        old_slot = Appointment.slot_key(old) if old else None
+        new_slot = Appointment.slot_key(new)
+        if old_slot != new_slot:
+            if old_slot is not None:
+                availability.release(old_slot, using)
+            if new_slot is not None:
+                availability.occupy(new_slot, using)
+        stats.record_change(old, new, using)
+    instance.remember_state(new)
+
+
+@receiver(pre_delete, sender=Appointment)
+def appointment_deleting(sender, instance, **kwargs):
+    # Deferred fields can only be read while the row still exists.
+    state = instance.loaded_state()
+    if state is Appointment.UNKNOWN_STATE:
+        state = instance.tracked_state()
+    instance.remember_state(state)
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, using, **kwargs):
+    state = instance.loaded_state()
+    slot = Appointment.slot_key(state)
+    if slot is not None:
+        availability.release(slot, using)
+    stats.record_change(state, None, using)
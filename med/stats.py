@@ -0,0 +1,124 @@
+"""
+Per-doctor monthly appointment counts (DoctorMonthlyStats).
+
+Each appointment counts once in the (doctor, year, month, status) bucket of
+its appointment date and status. Saves and deletes move it between buckets
+through the signal handlers in med.signals, and the bulk status sweep
+applies its changes per bucket, all inside the transaction that changes the
+appointments. `rebuild()` recomputes the table when it has drifted, e.g.
+after raw SQL. Functions take the `using` database of the doctors involved
+when appointments are sharded (see med.sharding).
+
+Each change also bumps the doctor's version stamp once it commits, which
+retires the dashboard data cached from the old counts (see med.dashboard).
+"""
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .versioning import bump_data_version
+from .models import Appointment, DoctorMonthlyStats
+
+
+def version_key(doctor_id):
+    return f'appointments:{doctor_id}'
+
+
+def bump_versions(doctor_ids, using=DEFAULT_DB_ALIAS):
+    """Bumps the doctors' version stamps once the current transaction commits."""
+    doctor_ids = set(doctor_ids)
+
+    def bump():
+        for doctor_id in doctor_ids:
+            bump_data_version(version_key(doctor_id))
+
+    if doctor_ids:
+        transaction.on_commit(bump, using=using)
+
+
+def apply_deltas(deltas, using=DEFAULT_DB_ALIAS):
+    """Adds each count in `deltas`, a {(doctor ID, year, month, status): change} dict."""
+    bump_versions((doctor_id for (doctor_id, _, _, _), change in deltas.items() if change), using)
+    for (doctor_id, year, month, status), change in deltas.items():
+        if not change:
+            continue
+        bucket = DoctorMonthlyStats.objects.using(using).filter(doctor_id=doctor_id, year=year, month=month, status=status)
+        if bucket.update(count=F('count') + change):
+            continue
+        try:
+            with transaction.atomic(using=using):
+                DoctorMonthlyStats.objects.using(using).create(
+                    doctor_id=doctor_id, year=year, month=month, status=status, count=change,
+                )
+        except IntegrityError:
+            # Created concurrently by another change to the same bucket.
+            bucket.update(count=F('count') + change)
+
+
+def record_change(old_state, new_state, using=DEFAULT_DB_ALIAS):
+    """Moves one appointment from the bucket of `old_state` to that of `new_state` (either may be None)."""
+    old = Appointment.stats_key(old_state) if old_state else None
+    new = Appointment.stats_key(new_state) if new_state else None
+    if old == new:
+        return
+    deltas = {}
+    if old:
+        deltas[old] = -1
+    if new:
+        deltas[new] = 1
+    apply_deltas(deltas, using)
+
+
+def bucket_counts(appointments):
+    """Returns {(doctor ID, year, month, status): count} for an Appointment queryset, in one query."""
+    rows = (
+        appointments.order_by()
+        .annotate(year=ExtractYear('appointment_date'), month=ExtractMonth('appointment_date'))
+        .values('doctor_id', 'year', 'month', 'status')
+        .annotate(count=Count('id'))
+    )
+    return {(row['doctor_id'], row['year'], row['month'], row['status']): row['count'] for row in rows}
+
+
+def rebuild(doctor_ids=None, using=DEFAULT_DB_ALIAS):
+    """
+    Recomputes the stats of every doctor (or of `doctor_ids`) in the `using`
+    database from its appointments table. Returns the number of buckets written.
+    """
+    appointments = Appointment.objects.using(using).all()
+    stats = DoctorMonthlyStats.objects.using(using).all()
+    if doctor_ids is not None:
+        appointments = appointments.filter(doctor_id__in=doctor_ids)
+        stats = stats.filter(doctor_id__in=doctor_ids)
+
+    with transaction.atomic(using=using):
+        counts = bucket_counts(appointments)
+        if doctor_ids is None:
+            bump_versions(set(stats.values_list('doctor_id', flat=True).distinct()) | {key[0] for key in counts}, using)
+        else:
+            bump_versions(doctor_ids, using)
+        stats.delete()
+        DoctorMonthlyStats.objects.using(using).bulk_create(
+            [
+                DoctorMonthlyStats(doctor_id=doctor_id, year=year, month=month, status=status, count=count)
+                for (doctor_id, year, month, status), count in counts.items()
+            ],
+            batch_size=1000,
+        )
+    return len(counts)
+
+
+def available_years(doctor_id, using=DEFAULT_DB_ALIAS):
+    """The years the doctor has appointments in, most recent first."""
+    return list(
+        DoctorMonthlyStats.objects.using(using).filter(doctor_id=doctor_id, count__gt=0)
+        .order_by('-year').values_list('year', flat=True).distinct()
+    )
+
+
+def year_buckets(doctor_id, year, using=DEFAULT_DB_ALIAS):
+    """Returns the doctor's (month, status, count) rows for `year`: at most 12 x 4 of them."""
+    return list(
+        DoctorMonthlyStats.objects.using(using).filter(doctor_id=doctor_id, year=year, count__gt=0)
+        .order_by('status', 'month').values_list('month', 'status', 'count')
+    )
@@ -1,3 +1,1582 @@
-from django.test import TestCase
+import io
+import json
+import re
+import sqlite3
+import tempfile
+import threading
+import time as clock
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth.models import User, Group
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db.models import Q
+from django.db import connection, connections, IntegrityError, OperationalError, close_old_connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import Profile
+from medeasy.sqlite import base as sqlite_backend
+
+from . import availability, booking, dashboard, email_archive, exports, imports, roles, sharding, stats
+from .jobs import complete_past_appointments
+from .scheduler import Job, Scheduler, acquire_lease, release_lease
+from .autocomplete import PrefixIndex
+from .catalog import SymptomCatalog, search_doctors
+from .filters import EmailLogFilter
+from .notification_pool import NotificationPool
+from .models import Doctor, Appointment, DoctorDayAvailability, DoctorMonthlyStats, LabTest, EmailBody, EmailLog, OutboxMessage, SchedulerLease, Watermark
+from .notifications import load_entities, notify
+from .outbox import drain
 
 # Create your tests here.
+
+# Jobs run by NotificationPoolTests; the pool imports them by dotted path.
+pool_gate = threading.Event()
+pool_runs = []
+
+
+def pool_job(name):
+    pool_gate.wait(5)
+    pool_runs.append(name)
+
+
+class NotificationPoolTests(TestCase):
+    def setUp(self):
+        pool_gate.clear()
+        pool_runs.clear()
+        self.addCleanup(pool_gate.set)
+
+    def make_pool(self, policy, **kwargs):
+        pool = NotificationPool(workers=1, queue_size=1, full_policy=policy, **kwargs)
+        self.addCleanup(pool.shutdown, timeout=5)
+        self.addCleanup(pool_gate.set)  # runs first
+        # One job running, one queued: the queue is full.
+        pool.submit(pool_job, 'running')
+        deadline = clock.monotonic() + 5
+        while pool.in_flight != 1 and clock.monotonic() < deadline:
+            clock.sleep(0.01)
+        pool.submit(pool_job, 'queued')
+        return pool
+
+    def test_drop_policy_drops_when_full(self):
+        pool = self.make_pool('drop')
+        with self.assertLogs('med.notification_pool', 'ERROR'):
+            self.assertFalse(pool.submit(pool_job, 'dropped'))
+        self.assertEqual(
+            {key: pool.stats()[key] for key in ('in_flight', 'queue_length', 'submitted', 'dropped')},
+            {'in_flight': 1, 'queue_length': 1, 'submitted': 3, 'dropped': 1},
+        )
+        pool_gate.set()
+        pool.shutdown(timeout=5)
+        self.assertEqual(pool_runs, ['running', 'queued'])
+        self.assertEqual(pool.stats()['completed'], 2)
+
+    def test_block_policy_waits_then_drops(self):
+        pool = self.make_pool('block', block_timeout=0.1)
+        started = clock.monotonic()
+        with self.assertLogs('med.notification_pool', 'ERROR'):
+            self.assertFalse(pool.submit(pool_job, 'late'))
+        self.assertGreaterEqual(clock.monotonic() - started, 0.1)
+        self.assertEqual(pool.stats()['dropped'], 1)
+
+    def test_spill_policy_replays_spilled_jobs_on_shutdown(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        pool = self.make_pool('spill', spill_dir=directory.name)
+        self.assertTrue(pool.submit(pool_job, 'spilled'))
+        self.assertEqual((pool.stats()['spilled'], pool.stats()['spilled_backlog']), (1, 1))
+        pool_gate.set()
+        pool.shutdown(timeout=5)
+        self.assertEqual(pool_runs, ['running', 'queued', 'spilled'])
+        self.assertEqual(pool.spilled_backlog(), 0)
+
+    def test_shutdown_is_bounded_and_spills_what_is_left(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        pool = self.make_pool('spill', spill_dir=directory.name)
+        started = clock.monotonic()
+        pool.shutdown(timeout=0.2)
+        self.assertLess(clock.monotonic() - started, 2)
+        # The queued job was not lost.
+        self.assertEqual(pool.spilled_backlog(), 1)
+        # Let the abandoned worker finish before the next test.
+        pool_gate.set()
+        deadline = clock.monotonic() + 5
+        while 'running' not in pool_runs and clock.monotonic() < deadline:
+            clock.sleep(0.01)
+
+    def test_metrics_reports_pool_gauges(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password123'))
+        notifications = self.client.get('/admin-dashboard/metrics/').json()['notifications']
+        self.assertLessEqual(
+            {'workers', 'queue_length', 'queue_capacity', 'in_flight', 'spilled_backlog', 'dropped'}, notifications.keys(),
+        )
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', 'patient@example.com', 'password123', first_name='Pat')
+        self.doctor = Doctor.objects.create(name='Dr. Test', expert='Fever', location='Pune', price=500)
+        self.appointment = Appointment.objects.create(
+            doctor=self.doctor, patient_name='Pat', patient_age=30, patient_mobile='9999999999',
+            booked_by=self.user, disease='Fever', appointment_date=date.today() + timedelta(days=1),
+            appointment_time=time(10, 0),
+        )
+
+    def test_drain_sends_batch_and_logs(self):
+        for _ in range(3):
+            notify('appointment_confirmation', self.appointment)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as mock_open:
+            sent, failed = drain(batch_size=10)
+
+        self.assertEqual((sent, failed), (3, 0))
+        mock_open.assert_called_once()  # one connection for the whole batch
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ['patient@example.com'])
+        self.assertFalse(OutboxMessage.objects.exclude(status='Sent').exists())
+        self.assertEqual(EmailLog.objects.filter(status='Sent').count(), 3)
+
+    def test_failed_send_is_retried_with_backoff(self):
+        notify('appointment_confirmation', self.appointment)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            self.assertEqual(drain(), (0, 1))
+
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.status, 'Pending')
+        self.assertEqual(message.attempts, 1)
+        self.assertGreater(message.next_attempt_at, timezone.now())
+        # Not due yet, so a second drain does nothing.
+        self.assertEqual(drain(), (0, 0))
+
+        message.next_attempt_at = timezone.now()
+        message.save()
+        self.assertEqual(drain(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_missing_object_fails_permanently(self):
+        notify('appointment_confirmation', self.appointment)
+        self.appointment.delete()
+
+        self.assertEqual(drain(), (0, 1))
+        self.assertEqual(OutboxMessage.objects.get().status, 'Failed')
+        self.assertEqual(EmailLog.objects.get().error_message, 'Object Does Not Exist')
+
+    def test_unknown_kind_fails_only_its_message(self):
+        OutboxMessage.objects.create(kind='retired_event', object_id=self.appointment.pk, user_id=self.user.pk)
+        notify('appointment_confirmation', self.appointment)
+
+        with self.assertLogs('med.outbox', 'ERROR'):
+            self.assertEqual(drain(), (1, 1))
+        retired = OutboxMessage.objects.get(kind='retired_event')
+        self.assertEqual((retired.status, retired.claim_token), ('Failed', ''))
+        self.assertEqual(retired.last_error, "Unknown notification kind 'retired_event'")
+        self.assertEqual(OutboxMessage.objects.get(kind='appointment_confirmation').status, 'Sent')
+
+    def test_batch_loads_each_entity_kind_once(self):
+        lab_test = LabTest.objects.create(test_type='Blood Test', location='Pune', booked_by=self.user)
+        notify('appointment_confirmation', self.appointment)
+        notify('doctor_confirmation', self.appointment)
+        notify('lab_test_confirmation', lab_test)
+        drain()  # warm the template cache
+
+        for event in ('appointment_confirmation', 'reschedule_confirmation', 'doctor_confirmation'):
+            notify(event, self.appointment)
+        for event in ('lab_test_confirmation', 'lab_test_cancellation'):
+            notify(event, lab_test)
+        # Claim (3) + one load per entity kind (2) + status update, body interning
+        # and log insert, whatever the batch size.
+        with self.assertNumQueries(13):
+            self.assertEqual(drain(batch_size=10), (5, 0))
+
+    @override_settings(NOTIFICATION_CHANNELS=['email', 'sms'])
+    def test_sms_channel_writes_to_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sms_file = Path(tmp) / 'sms.jsonl'
+            with override_settings(SMS_OUTBOX_FILE=sms_file):
+                notify('appointment_confirmation', self.appointment)
+                self.assertEqual(drain(), (2, 0))
+                lines = sms_file.read_text().splitlines()
+
+        self.assertEqual(len(lines), 1)
+        self.assertIn('9999999999', lines[0])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(EmailLog.objects.count(), 1)
+
+
+class EmailArchiveTests(TestCase):
+    def log(self, recipient, body, days_ago=0, status='Sent'):
+        log = EmailLog(recipient=recipient, subject='Reminder', template='reminder', status=status)
+        log.body = body
+        log.save()
+        if days_ago:
+            EmailLog.objects.filter(pk=log.pk).update(sent_at=timezone.now() - timedelta(days=days_ago))
+        return log
+
+    def test_identical_bodies_are_stored_once(self):
+        self.log('a@example.com', 'See you tomorrow.')
+        self.log('b@example.com', 'See you tomorrow.')
+        EmailLog.objects.bulk_create([
+            EmailLog(recipient='c@example.com', subject='Reminder', template='reminder', status='Sent', body='See you tomorrow.'),
+            EmailLog(recipient='d@example.com', subject='Reminder', template='reminder', status='Sent', body='See you later.'),
+        ])
+
+        self.assertEqual(EmailBody.objects.count(), 2)
+        self.assertEqual(
+            sorted(log.body for log in EmailLog.objects.select_related('body_ref')),
+            ['See you later.'] + ['See you tomorrow.'] * 3,
+        )
+
+    def test_archived_logs_can_be_read_back(self):
+        self.log('a@example.com', 'Old one.', days_ago=100)
+        self.log('b@example.com', 'Old two.', days_ago=100, status='Failed')
+        self.log('a@example.com', 'Old three.', days_ago=95)
+        recent = self.log('a@example.com', 'Recent.')
+
+        with tempfile.TemporaryDirectory() as archive_dir, override_settings(EMAIL_BODY_PRUNE_GRACE=0):
+            call_command('archive_email_logs', '--days', '90', '--dir', archive_dir, '--batch-size', '2', stdout=io.StringIO())
+
+            self.assertEqual(list(EmailLog.objects.values_list('pk', flat=True)), [recent.pk])
+            self.assertEqual(len(list(Path(archive_dir).glob('email_logs_*.jsonl.gz'))), 2)
+            # The bodies only the archived rows used are gone.
+            self.assertEqual(EmailBody.objects.count(), 1)
+
+            out = io.StringIO()
+            call_command('read_email_archive', '--dir', archive_dir, '--recipient', 'a@example.com', stdout=out)
+            rows = [json.loads(line) for line in out.getvalue().splitlines()]
+            self.assertEqual([row['body'] for row in rows], ['Old one.', 'Old three.'])
+
+            out = io.StringIO()
+            call_command('read_email_archive', '--dir', archive_dir, '--status', 'Failed', '--count', stdout=out)
+            self.assertEqual(out.getvalue().strip(), '1')
+
+    def test_prune_keeps_used_and_recent_bodies(self):
+        used = self.log('a@example.com', 'Still logged.').body_ref
+        bodies = EmailBody.intern_many([('reminder', 'Old orphan.'), ('reminder', 'New orphan.')])
+        old, new = bodies[('reminder', 'Old orphan.')], bodies[('reminder', 'New orphan.')]
+        EmailBody.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(hours=2))
+
+        with override_settings(EMAIL_BODY_PRUNE_GRACE=3600):
+            self.assertEqual(email_archive.prune_orphan_bodies(), 1)
+
+        self.assertEqual(set(EmailBody.objects.values_list('pk', flat=True)), {used.pk, new.pk})
+        self.assertEqual(email_archive.prune_orphan_bodies(grace=0), 1)
+        self.assertEqual(list(EmailBody.objects.values_list('pk', flat=True)), [used.pk])
+
+    def test_date_filters_cover_whole_local_days_with_the_index(self):
+        with timezone.override('Asia/Kolkata'):
+            logs = {}
+            for label, moment in [
+                ('before', datetime(2026, 3, 9, 23, 59)), ('first', datetime(2026, 3, 10, 0, 0)),
+                ('last', datetime(2026, 3, 11, 23, 59, 59)), ('after', datetime(2026, 3, 12, 0, 0)),
+            ]:
+                logs[label] = self.log(f'{label}@example.com', 'Hello.')
+                EmailLog.objects.filter(pk=logs[label].pk).update(sent_at=timezone.make_aware(moment))
+
+            queryset = EmailLogFilter({'sent_after': '2026-03-10', 'sent_before': '2026-03-11'}, EmailLog.objects.all()).qs
+
+            self.assertEqual(set(queryset.values_list('pk', flat=True)), {logs['first'].pk, logs['last'].pk})
+            with connection.cursor() as cursor:
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = ' '.join(row[-1] for row in cursor.fetchall())
+            # A range search on the index, not a scan of it in sent_at order.
+            self.assertRegex(plan, r'SEARCH med_emaillog USING INDEX med_emaillog_sent_at\w* \(sent_at>\? AND sent_at<\?\)')
+
+
+class CatalogSearchTests(TestCase):
+    def test_search_doctors_matches_icontains_search(self):
+        for name, expert, location in [
+            ('Dr. A', 'Fever', 'Pune'), ('Dr. B', 'fever ', 'pune'), ('Dr. C', 'Back Pain', 'Navi Mumbai'),
+            ('Dr. D', 'Diabetes', 'Thane'), ('Dr. E', 'Back Pain', 'Pune'), ('Dr. F', 'Migraine', 'Navi Mumbai'),
+        ]:
+            Doctor.objects.create(name=name, expert=expert, location=location, price=500)
+        # Every disease and location the booking form offers, as listed and as typed.
+        diseases = ['Fever', 'FEVER', 'Back Pain', 'back pain', 'Diabetes', 'Migraine', 'Other']
+        locations = ['Pune', 'pune', 'Navi Mumbai', 'Thane', 'Kalyan', 'Other']
+        for disease in diseases:
+            for location in locations:
+                old = Doctor.objects.all()
+                if disease != 'Other':
+                    old = old.filter(expert__icontains=disease.strip())
+                if location != 'Other':
+                    old = old.filter(location__icontains=location.strip())
+                with self.subTest(disease=disease, location=location):
+                    self.assertEqual(
+                        list(search_doctors(disease, location)), list(old.order_by('name', 'id')),
+                    )
+
+
+class ScratchMigrationTestCase(TestCase):
+    """Migrates a scratch SQLite database, the 'migrations' alias, to chosen migrations."""
+    DATABASE_OPTIONS = {}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases['migrations'] = {
+            **connection.settings_dict, 'NAME': str(Path(directory.name) / 'migrations.sqlite3'),
+            'OPTIONS': {**connection.settings_dict['OPTIONS'], **self.DATABASE_OPTIONS},
+        }
+        self.addCleanup(self.remove_database)
+
+    def remove_database(self):
+        connections['migrations'].close()
+        del connections['migrations']
+        del connections.databases['migrations']
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connections['migrations'])
+        executor.migrate([target])
+        executor.loader.build_graph()
+        return executor.loader.project_state(target).apps
+
+
+class CatalogMigrationTests(ScratchMigrationTestCase):
+    MIGRATE_FROM = ('med', '0011_emaillog_compressed_bodies')
+    MIGRATE_TO = ('med', '0012_specialty_location_catalog')
+
+    def test_migration_builds_catalog_from_doctors(self):
+        apps = self.migrate(self.MIGRATE_FROM)
+        OldDoctor = apps.get_model('med', 'Doctor')
+        for name, expert, location in [
+            ('Dr. A', 'Fever', 'Pune'), ('Dr. B', ' fever', 'PUNE '), ('Dr. C', 'Back Pain', 'Navi Mumbai'),
+        ]:
+            OldDoctor.objects.using('migrations').create(name=name, expert=expert, location=location, price=500)
+
+        apps = self.migrate(self.MIGRATE_TO)
+        Doctor_, Specialty, Location = (apps.get_model('med', name) for name in ('Doctor', 'Specialty', 'Location'))
+        self.assertEqual(
+            sorted(Specialty.objects.using('migrations').values_list('normalized', flat=True)), ['back pain', 'fever'],
+        )
+        self.assertEqual(
+            sorted(Location.objects.using('migrations').values_list('normalized', flat=True)), ['navi mumbai', 'pune'],
+        )
+        self.assertEqual(
+            sorted(Doctor_.objects.using('migrations').values_list('name', 'specialty__normalized', 'city__normalized')),
+            [('Dr. A', 'fever', 'pune'), ('Dr. B', 'fever', 'pune'), ('Dr. C', 'back pain', 'navi mumbai')],
+        )
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('patient', 'patient@example.com', 'password123')
+        self.user.groups.add(Group.objects.get_or_create(name='Patients')[0])
+        self.client.force_login(self.user)
+        Doctor.objects.create(name='Dr. A', expert='Fever', location='Pune', price=500)
+
+    def test_prefix_matches_rank_before_substring_matches(self):
+        index = PrefixIndex(['Navi Mumbai', 'Mumbai', 'Mumbra', 'Pune'])
+        self.assertEqual(index.search('mum', 10), ['Mumbai', 'Mumbra', 'Navi Mumbai'])
+        self.assertEqual(index.search('MU', 2), ['Mumbai', 'Mumbra'])
+        self.assertEqual(index.search('', 2), ['Mumbai', 'Mumbra', 'Navi Mumbai', 'Pune'])
+        pinned = PrefixIndex(['Mumbai', 'Other', 'Pune'], pinned=['Other'])
+        self.assertEqual(pinned.search('', 1), ['Other', 'Mumbai', 'Pune'])
+        self.assertEqual(pinned.search('o', 1), ['Other'])
+
+    @override_settings(AUTOCOMPLETE_MAX_RESULTS=2)
+    def test_opening_the_disease_list_shows_any_first_and_every_specialty(self):
+        Doctor.objects.create(name='Dr. B', expert='Migraine', location='Pune', price=500)
+        Doctor.objects.create(name='Dr. C', expert='Asthma', location='Pune', price=500)
+        names = [r['id'] for r in self.client.get('/api/search-diseases/?term=').json()['results']]
+        self.assertEqual(names[0], 'Other')
+        self.assertLessEqual({'Fever', 'Migraine', 'Asthma'}, set(names))
+        # A typed term is still capped.
+        self.assertEqual(len(self.client.get('/api/search-diseases/?term=a').json()['results']), 2)
+
+    def test_aliases_find_their_value_once(self):
+        index = PrefixIndex(['Diabetes', 'Headache'], aliases=[('Sugar', 'Diabetes'), ('Head Pain', 'Headache')])
+        self.assertEqual(index.search('sug', 10), ['Diabetes'])
+        self.assertEqual(index.search('head', 10), ['Headache'])
+        self.assertEqual(index.search('', 10), ['Diabetes', 'Headache'])
+
+    def test_disease_synonyms_offer_their_specialty(self):
+        Doctor.objects.create(name='Dr. B', expert='Diabetes', location='Pune', price=500)
+
+        def search(term):
+            return [r['id'] for r in self.client.get(f'/api/search-diseases/?term={term}').json()['results']]
+
+        self.assertEqual(search('sugar'), ['Diabetes'])
+        self.assertEqual(search('high'), ['Diabetes', 'Fever'])
+        self.assertNotIn('High Blood Sugar', search(''))
+
+    def test_locations_are_served_from_memory_and_refreshed_on_change(self):
+        url = '/api/locations/?term=pu'
+        self.client.get(url)  # builds the index
+        with self.assertNumQueries(3):  # session, user and roles version; roles come from the session
+            response = self.client.get(url)
+        self.assertEqual(response.json()['results'], [{'id': 'Pune', 'text': 'Pune'}])
+
+        Doctor.objects.create(name='Dr. B', expert='Fever', location='Purna', price=500)
+        response = self.client.get(url)
+        self.assertEqual([r['id'] for r in response.json()['results']], ['Pune', 'Purna'])
+
+    def test_unchanged_results_revalidate_with_304(self):
+        url = '/api/locations/?term=pu'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Doctor.objects.create(name='Dr. B', expert='Fever', location='Purna', price=500)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class SymptomCatalogTests(TestCase):
+    def test_resolves_synonyms_and_typos(self):
+        catalog = SymptomCatalog([
+            ('Stomach Ache', 1), ('Stomach Pain', 1), ('Back Pain', 2), ('Skin-related issues', 3), ('Skin Rash', 3),
+        ])
+        self.assertEqual(catalog.resolve('skin rash'), {3})
+        self.assertEqual(catalog.resolve('Stomack pain'), {1})
+        self.assertEqual(catalog.resolve('pain'), {1, 2})
+        self.assertEqual(catalog.resolve('xyzzy'), set())
+
+    def test_search_doctors_maps_symptoms_to_specialties(self):
+        doctor = Doctor.objects.create(name='Dr. A', expert='Stomach Ache', location='Pune', price=500)
+        Doctor.objects.create(name='Dr. B', expert='Fever', location='Pune', price=500)
+        self.assertEqual(list(search_doctors('Stomach Pain', 'Pune')), [doctor])
+        with self.assertNumQueries(0):
+            self.assertEqual(list(search_doctors('Nothing Like It', 'Pune')), [])
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('patient', 'patient@example.com', 'password123')
+        self.doctor = Doctor.objects.create(
+            name='Dr. A', expert='Fever', location='Pune', price=500, from_time=time(9, 0), to_time=time(10, 0),
+        )
+        self.day = date.today() + timedelta(days=1)
+
+    def book(self, slot_time, day=None):
+        return Appointment.objects.create(
+            doctor=self.doctor, patient_name='Pat', patient_age=30, patient_mobile='9999999999',
+            booked_by=self.user, disease='Fever', appointment_date=day or self.day, appointment_time=slot_time,
+        )
+
+    def test_bitmap_follows_book_cancel_and_reschedule(self):
+        appointment = self.book(time(9, 0))
+        booked = availability.booked_mask(self.doctor.pk, self.day)
+        self.assertFalse(availability.is_free(self.doctor, booked, time(9, 0)))
+        self.assertTrue(availability.is_free(self.doctor, booked, time(9, 30)))
+
+        appointment = Appointment.objects.get(pk=appointment.pk)
+        appointment.appointment_time = time(9, 30)
+        appointment.save()
+        booked = availability.booked_mask(self.doctor.pk, self.day)
+        self.assertEqual(booked, availability.slot_bit(time(9, 30)))
+
+        self.book(time(9, 0))
+        self.assertTrue(availability.is_fully_booked(self.doctor, availability.booked_mask(self.doctor.pk, self.day)))
+
+        appointment.status = 'Cancelled'
+        appointment.save(update_fields=['status'])
+        self.assertEqual(availability.booked_mask(self.doctor.pk, self.day), availability.slot_bit(time(9, 0)))
+
+        # The incremental updates agree with a full rebuild.
+        availability.rebuild()
+        self.assertEqual(availability.booked_mask(self.doctor.pk, self.day), availability.slot_bit(time(9, 0)))
+
+    def test_availability_api_caches_weeks_until_a_booking_changes(self):
+        self.user.groups.add(Group.objects.get_or_create(name='Patients')[0])
+        self.client.force_login(self.user)
+        self.book(time(9, 30))
+        url = f'/api/doctors/{self.doctor.pk}/availability/?start={self.day}&days=14'
+
+        with self.captureOnCommitCallbacks(execute=True):
+            days = self.client.get(url).json()['days']
+        self.assertEqual(len(days), 14)
+        self.assertEqual(days[0]['date'], self.day.isoformat())
+        self.assertEqual([slot['booked'] for slot in days[0]['slots']], [False, True])
+
+        with self.assertNumQueries(4):  # session, user, roles version and doctor; weeks come from the cache
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(time(9, 0))
+        self.assertTrue(self.client.get(url).json()['days'][0]['fully_booked'])
+
+
+class SlotUniquenessTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', 'patient@example.com', 'password123')
+        self.user.groups.add(Group.objects.get_or_create(name='Patients')[0])
+        self.client.force_login(self.user)
+        self.token = booking.dumps(self.user, patient_name='Pat', age=30, mobile='9999999999', disease='Fever')
+        self.doctor = Doctor.objects.create(
+            name='Dr. A', expert='Fever', location='Pune', price=500, from_time=time(9, 0), to_time=time(10, 0),
+        )
+        self.day = date.today() + timedelta(days=1)
+        Appointment.objects.create(
+            doctor=self.doctor, patient_name='Other', patient_age=40, patient_mobile='8888888888',
+            disease='Fever', appointment_date=self.day, appointment_time=time(9, 0),
+        )
+
+    def test_conflicting_insert_shows_just_booked_message(self):
+        # Simulate a request that passed the bitmap check just before another booking committed.
+        DoctorDayAvailability.objects.update(booked=0)
+        response = self.client.post(
+            f'/create-appointment/{self.doctor.pk}/',
+            {'appointment_date': self.day.isoformat(), 'appointment_time': '09:00', 'booking': self.token, 'confirm': '1'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('just booked by someone else', str(list(response.context['messages'])[0]))
+        self.assertEqual(Appointment.objects.exclude(status='Cancelled').count(), 1)
+
+    def test_other_integrity_errors_are_not_reported_as_a_taken_slot(self):
+        with mock.patch('med.views.notify', side_effect=IntegrityError('NOT NULL constraint failed: med_outboxmessage.user_id')):
+            with self.assertRaises(IntegrityError):
+                self.client.post(
+                    f'/create-appointment/{self.doctor.pk}/',
+                    {'appointment_date': self.day.isoformat(), 'appointment_time': '09:30', 'booking': self.token, 'confirm': '1'},
+                )
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_times_between_slot_starts_are_rejected(self):
+        # 09:50 falls in the free 09:30 slot, but would run past the doctor's hours;
+        # 10:00 is where the last slot ends.
+        for submitted in ('09:50', '10:00'):
+            with self.subTest(time=submitted):
+                response = self.client.post(
+                    f'/create-appointment/{self.doctor.pk}/',
+                    {'appointment_date': self.day.isoformat(), 'appointment_time': submitted, 'booking': self.token, 'confirm': '1'},
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Please select one of the available time slots', str(list(response.context['messages'])[0]))
+                self.assertEqual(Appointment.objects.count(), 1)
+        self.assertTrue(availability.is_slot_start(self.doctor, time(9, 30)))
+        self.assertFalse(availability.is_slot_start(self.doctor, time(9, 50)))
+
+    def test_cancelled_appointment_frees_the_slot(self):
+        Appointment.objects.update(status='Cancelled')
+        Appointment.objects.create(
+            doctor=self.doctor, patient_name='Pat', patient_age=30, patient_mobile='9999999999',
+            disease='Fever', appointment_date=self.day, appointment_time=time(9, 0),
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Appointment.objects.create(
+                doctor=self.doctor, patient_name='Pat', patient_age=30, patient_mobile='9999999999',
+                disease='Fever', appointment_date=self.day, appointment_time=time(9, 0),
+            )
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    """Many threads racing for a handful of slots on SQLite."""
+
+    THREADS = 8
+    ATTEMPTS_PER_THREAD = 25
+
+    def test_no_double_booking_under_contention(self):
+        doctor = Doctor.objects.create(
+            name='Dr. A', expert='Fever', location='Pune', price=500, from_time=time(9, 0), to_time=time(17, 0),
+        )
+        day = date.today() + timedelta(days=1)
+        slots = [slot_start for slot_start, _ in availability.time_slots(doctor.from_time, doctor.to_time)]
+        outcomes = {'booked': 0, 'conflicts': 0, 'retries': 0}
+        lock = threading.Lock()
+        start_line = threading.Barrier(self.THREADS)
+
+        def book(worker):
+            start_line.wait()
+            try:
+                for attempt in range(self.ATTEMPTS_PER_THREAD):
+                    slot_time = slots[(worker + attempt) % len(slots)]
+                    while True:
+                        try:
+                            with transaction.atomic():
+                                Appointment.objects.create(
+                                    doctor=doctor, patient_name=f'P{worker}', patient_age=30, patient_mobile='9999999999',
+                                    disease='Fever', appointment_date=day, appointment_time=slot_time,
+                                )
+                            result = 'booked'
+                        except IntegrityError:
+                            result = 'conflicts'
+                        except OperationalError:
+                            # SQLite allows one writer at a time; try again.
+                            with lock:
+                                outcomes['retries'] += 1
+                            clock.sleep(0.001)
+                            continue
+                        break
+                    with lock:
+                        outcomes[result] += 1
+            finally:
+                close_old_connections()
+
+        started = clock.perf_counter()
+        threads = [threading.Thread(target=book, args=(worker,)) for worker in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = clock.perf_counter() - started
+
+        attempts = self.THREADS * self.ATTEMPTS_PER_THREAD
+        self.assertEqual(outcomes['booked'] + outcomes['conflicts'], attempts)
+        # Every slot was taken exactly once, and every losing attempt got a clean conflict.
+        self.assertEqual(outcomes['booked'], len(slots))
+        self.assertEqual(
+            sorted(Appointment.objects.filter(doctor=doctor).values_list('appointment_time', flat=True)), slots,
+        )
+        self.assertEqual(availability.booked_mask(doctor.pk, day), availability.doctor_mask(doctor))
+        # Conflicts are rejected by the index without blocking other writers for long.
+        self.assertGreater(attempts / elapsed, 100, f'{attempts / elapsed:.0f} booking attempts/s with {outcomes}')
+
+
+class StatusSweepTests(TestCase):
+    def setUp(self):
+        self.doctor = Doctor.objects.create(name='Dr. A', expert='Fever', location='Pune', price=500)
+
+    def appointment(self, day, slot_time, status='Confirmed'):
+        return Appointment.objects.create(
+            doctor=self.doctor, patient_name='Pat', patient_age=30, patient_mobile='9999999999',
+            disease='Fever', appointment_date=day, appointment_time=slot_time, status=status,
+        )
+
+    def test_sweep_completes_ended_appointments_since_the_watermark(self):
+        now = timezone.now()
+        ended = self.appointment(now.date() - timedelta(days=1), time(9, 0))
+        upcoming = self.appointment(now.date() + timedelta(days=1), time(9, 0))
+        pending = self.appointment(now.date() - timedelta(days=1), time(10, 0), status='Pending')
+        self.assertEqual(ended.ends_at, timezone.make_aware(datetime.combine(ended.appointment_date, time(9, 30))))
+
+        with CaptureQueriesContext(connection) as queries:
+            changed, _ = complete_past_appointments(now=now)
+        appointment_writes = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "med_appointment"')]
+        self.assertEqual(len(appointment_writes), 1)
+        self.assertEqual(changed, 1)
+        self.assertEqual(Appointment.objects.get(pk=ended.pk).status, 'Completed')
+        self.assertEqual(Appointment.objects.get(pk=upcoming.pk).status, 'Confirmed')
+        self.assertEqual(Appointment.objects.get(pk=pending.pk).status, 'Pending')
+
+        # Confirmed long after it ended: outside the lookback window until a full sweep.
+        late = self.appointment(now.date() - timedelta(days=30), time(9, 0))
+        self.assertEqual(complete_past_appointments(now=now)[0], 0)
+        self.assertEqual(complete_past_appointments(now=now, full=True)[0], 1)
+        self.assertEqual(Appointment.objects.get(pk=late.pk).status, 'Completed')
+
+
+@override_settings(MED_SHARDS={'migrations': {'id': 9, 'locations': ['Pune']}})
+class ShardDataMigrationTests(ScratchMigrationTestCase):
+    # Configured like a shard (see medeasy.settings).
+    DATABASE_OPTIONS = {'foreign_keys': False}
+
+    def create_appointments(self, apps, *slots):
+        doctor = apps.get_model('med', 'Doctor').objects.using('migrations').create(
+            name='Dr. A', expert='Fever', location='Pune', price=500,
+        )
+        for day, slot_time, status in slots:
+            apps.get_model('med', 'Appointment').objects.using('migrations').create(
+                doctor_id=doctor.pk, patient_name='Pat', patient_age=30, patient_mobile='9999999999', disease='Fever',
+                appointment_date=day, appointment_time=slot_time, status=status,
+            )
+        return doctor
+
+    def test_availability_bitmaps_are_built_on_shards(self):
+        apps = self.migrate(('med', '0012_specialty_location_catalog'))
+        doctor = self.create_appointments(
+            apps, (date(2026, 5, 4), time(9, 0), 'Pending'), (date(2026, 5, 4), time(9, 30), 'Cancelled'),
+        )
+
+        apps = self.migrate(('med', '0013_doctordayavailability'))
+        self.assertEqual(
+            list(apps.get_model('med', 'DoctorDayAvailability').objects.using('migrations').values_list('doctor_id', 'booked')),
+            [(doctor.pk, 1 << 18)],
+        )
+
+    def test_duplicate_bookings_are_cancelled_on_shards(self):
+        apps = self.migrate(('med', '0013_doctordayavailability'))
+        self.create_appointments(apps, *[(date(2026, 5, 4), time(9, 0), 'Pending')] * 2)
+
+        apps = self.migrate(('med', '0014_appointment_unique_live_slot'))
+        self.assertEqual(
+            list(apps.get_model('med', 'Appointment').objects.using('migrations').order_by('pk').values_list('status', flat=True)),
+            ['Pending', 'Cancelled'],
+        )
+
+    def test_monthly_stats_are_built_on_shards(self):
+        apps = self.migrate(('med', '0016_schedulerlease'))
+        doctor = self.create_appointments(
+            apps, (date(2026, 5, 4), time(9, 0), 'Pending'), (date(2026, 5, 5), time(9, 0), 'Pending'),
+        )
+
+        apps = self.migrate(('med', '0017_doctormonthlystats'))
+        self.assertEqual(
+            list(apps.get_model('med', 'DoctorMonthlyStats').objects.using('migrations').values_list(
+                'doctor_id', 'year', 'month', 'status', 'count',
+            )),
+            [(doctor.pk, 2026, 5, 'Pending', 2)],
+        )
+
+    def test_ends_at_backfill_runs_on_shards(self):
+        apps = self.migrate(('med', '0014_appointment_unique_live_slot'))
+        self.create_appointments(apps, (date(2026, 5, 4), time(9, 30), 'Pending'))
+
+        apps = self.migrate(('med', '0015_appointment_ends_at_watermark'))
+        self.assertEqual(
+            list(apps.get_model('med', 'Appointment').objects.using('migrations').values_list('ends_at', flat=True)),
+            [timezone.make_aware(datetime(2026, 5, 4, 10, 0))],
+        )
+
+    def test_outbox_table_is_added_to_existing_shards(self):
+        self.migrate(('med', '0022_dataversion'))
+        with connections['migrations'].cursor() as cursor:
+            cursor.execute('DROP TABLE med_outboxmessage')  # as in shards migrated before it was a shard model
+
+        apps = self.migrate(('med', '0023_outboxmessage_shards'))
+        apps.get_model('med', 'OutboxMessage').objects.using('migrations').create(kind='appointment_confirmation', object_id=1)
+        self.assertEqual(apps.get_model('med', 'OutboxMessage').objects.using('migrations').count(), 1)
+
+
+class SchedulerTests(TestCase):
+    def test_only_one_holder_gets_the_lease_until_it_expires(self):
+        self.assertTrue(acquire_lease('node-a', ttl=60))
+        self.assertFalse(acquire_lease('node-b', ttl=60))
+        self.assertTrue(acquire_lease('node-a', ttl=60))  # renewal
+
+        SchedulerLease.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(acquire_lease('node-b', ttl=60))
+        self.assertFalse(acquire_lease('node-a', ttl=60))
+
+        release_lease('node-b')
+        self.assertTrue(acquire_lease('node-a', ttl=60))
+
+    def test_leader_catches_up_missed_runs_once_and_standby_runs_nothing(self):
+        calls = []
+        jobs = {'sweep': Job('sweep', lambda: calls.append('sweep'), interval=60)}
+        Watermark.objects.create(name='scheduler:sweep', value=timezone.now() - timedelta(minutes=10))
+
+        leader = Scheduler(jobs=jobs, holder='node-a')
+        standby = Scheduler(jobs=jobs, holder='node-b')
+        self.assertEqual(leader.run_pending(), ['sweep'])
+        self.assertEqual(standby.run_pending(), [])
+        self.assertEqual(leader.run_pending(), [])  # not due again for another interval
+        self.assertEqual(calls, ['sweep'])
+
+
+class SchedulerHeartbeatTests(TransactionTestCase):
+    """Jobs longer than the lease TTL; the heartbeat renews it from another thread."""
+
+    def test_lease_is_renewed_while_a_long_job_runs(self):
+        standby = []
+
+        def long_job():
+            clock.sleep(0.6)
+            standby.append(acquire_lease('node-b', ttl=0.3))
+
+        leader = Scheduler(jobs={'long': Job('long', long_job, interval=60)}, holder='node-a', lease_ttl=0.3)
+        self.assertEqual(leader.run_pending(), ['long'])
+        self.assertEqual(standby, [False])
+        self.assertTrue(leader.is_leader)
+
+    def test_leader_stops_after_a_job_during_which_it_lost_the_lease(self):
+        calls = []
+
+        def taken_over():
+            calls.append('taken_over')
+            SchedulerLease.objects.update(holder='node-b', expires_at=timezone.now() + timedelta(seconds=60))
+            clock.sleep(0.3)
+
+        jobs = {
+            'taken_over': Job('taken_over', taken_over, interval=60),
+            'next': Job('next', lambda: calls.append('next'), interval=60),
+        }
+        leader = Scheduler(jobs=jobs, holder='node-a', lease_ttl=0.3)
+        with self.assertLogs('med.scheduler', 'WARNING'):
+            self.assertEqual(leader.run_pending(), ['taken_over'])
+        self.assertFalse(leader.is_leader)
+        self.assertEqual(calls, ['taken_over'])
+
+
+class MonthlyStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        dashboard.counters.reset()
+        self.doctor = Doctor.objects.create(name='Dr. A', expert='Fever', location='Pune', price=500)
+
+    def appointment(self, day, slot_time, status='Pending'):
+        return Appointment.objects.create(
+            doctor=self.doctor, patient_name='Pat', patient_age=30, patient_mobile='9999999999',
+            disease='Fever', appointment_date=day, appointment_time=slot_time, status=status,
+        )
+
+    def snapshot(self):
+        return sorted(DoctorMonthlyStats.objects.filter(count__gt=0).values_list('year', 'month', 'status', 'count'))
+
+    def test_stats_follow_every_kind_of_change_and_match_a_rebuild(self):
+        now = timezone.now()
+        last_month = (now - timedelta(days=40)).date()
+        first = self.appointment(last_month, time(9, 0), status='Confirmed')
+        second = self.appointment(now.date() + timedelta(days=3), time(10, 0))
+        third = self.appointment(now.date() + timedelta(days=3), time(11, 0))
+
+        second = Appointment.objects.get(pk=second.pk)
+        second.appointment_date = last_month  # reschedule into another month
+        second.save(update_fields=['appointment_date'])
+        third.status = 'Cancelled'
+        third.save(update_fields=['status'])
+        Appointment.objects.get(pk=first.pk).delete()
+        self.appointment(last_month, time(14, 0), status='Confirmed')
+        complete_past_appointments(now=now, full=True)  # bulk UPDATE path
+
+        incremental = self.snapshot()
+        self.assertIn((last_month.year, last_month.month, 'Completed', 1), incremental)
+        stats.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_partially_loaded_appointments_apply_a_delta_instead_of_a_rebuild(self):
+        day = timezone.now().date() + timedelta(days=3)
+        self.appointment(day, time(9, 0), status='Confirmed')
+        appointment = self.appointment(day, time(10, 0))
+
+        with mock.patch('med.stats.rebuild') as rebuild, mock.patch('med.availability.rebuild_day') as rebuild_day:
+            deferred = Appointment.objects.only('status').get(pk=appointment.pk)
+            deferred.status = 'Cancelled'
+            deferred.save(update_fields=['status'])
+            Appointment.objects.only('id').get(pk=appointment.pk).delete()
+        rebuild.assert_not_called()
+        rebuild_day.assert_not_called()
+
+        incremental = self.snapshot()
+        self.assertEqual(incremental, [(day.year, day.month, 'Confirmed', 1)])
+        stats.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_a_field_changed_after_a_deferred_load_falls_back_to_a_rebuild(self):
+        day = timezone.now().date() + timedelta(days=3)
+        appointment = self.appointment(day, time(9, 0))
+
+        deferred = Appointment.objects.only('id').get(pk=appointment.pk)
+        deferred.status = 'Confirmed'  # the loaded status was never read
+        with mock.patch('med.stats.rebuild', wraps=stats.rebuild) as rebuild:
+            deferred.save(update_fields=['status'])
+        rebuild.assert_called_once()
+        self.assertEqual(self.snapshot(), [(day.year, day.month, 'Confirmed', 1)])
+
+    def login_doctor(self):
+        user = User.objects.create_user('doctor', 'doctor@example.com', 'password123')
+        user.groups.add(Group.objects.get_or_create(name='Doctors')[0])
+        self.doctor.user = user
+        self.doctor.save()
+        self.client.force_login(user)
+
+    def test_dashboard_reads_the_rollup(self):
+        self.appointment(date(2024, 3, 5), time(9, 0), status='Completed')
+        self.appointment(date(2024, 3, 6), time(9, 0), status='Cancelled')
+        self.appointment(date(2023, 7, 1), time(9, 0))
+        self.login_doctor()
+
+        self.client.get('/doctor/appointments/')  # caches the roles in the session
+        with self.assertNumQueries(5):  # session, user, roles version, then two small rollup reads
+            response = self.client.get('/doctor/dashboard/?year=2024')
+        self.assertEqual(response.context['available_years'], [2024, 2023])
+        self.assertEqual(response.context['total_bookings'], 2)
+        self.assertEqual(response.context['completed_count'], 1)
+        self.assertEqual(response.context['monthly_bookings_data'][2], 2)
+        self.assertEqual(response.context['pie_chart_labels'], ['Cancelled', 'Completed'])
+
+    def test_dashboard_is_cached_until_the_doctors_appointments_change(self):
+        appointment = self.appointment(date(2024, 3, 5), time(9, 0), status='Confirmed')
+        self.login_doctor()
+        self.client.get('/doctor/dashboard/?year=2024')
+
+        with self.assertNumQueries(3):  # session, user and roles version only
+            response = self.client.get('/doctor/dashboard/?year=2024')
+        self.assertEqual(response.context['confirmed_count'], 1)
+        self.assertEqual(dashboard.counters.stats()['hits'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.status = 'Completed'
+            appointment.save(update_fields=['status'])
+        response = self.client.get('/doctor/dashboard/?year=2024')
+        self.assertEqual(response.context['confirmed_count'], 0)
+        self.assertEqual(response.context['completed_count'], 1)
+        self.assertEqual(dashboard.counters.stats()['misses'], 4)
+
+
+class AdminDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password123')
+        User.objects.bulk_create([User(username=f'user{i:02d}', email=f'user{i:02d}@example.com') for i in range(40)])
+        self.client.force_login(self.admin)
+
+    def usernames(self, response):
+        return [user.username for user in response.context['page_obj']]
+
+    def test_keyset_pages_cover_every_user_once_at_a_constant_cost(self):
+        response = self.client.get('/admin-dashboard/')
+        self.assertEqual(response.context['user_count'], 41)
+        seen = self.usernames(response)
+        with CaptureQueriesContext(connection) as first_page:
+            self.client.get('/admin-dashboard/')
+        while response.context['page_obj'].has_next:
+            cursor = response.context['page_obj'].next_cursor
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/admin-dashboard/', {'after': cursor})
+            self.assertEqual(len(queries), len(first_page))
+            self.assertNotIn('OFFSET', queries[-2]['sql'])
+            seen += self.usernames(response)
+        self.assertEqual(seen, sorted(User.objects.values_list('username', flat=True)))
+
+        last = self.client.get('/admin-dashboard/', {'last': 1})
+        self.assertEqual(self.usernames(last), seen[-15:])
+        previous = self.client.get('/admin-dashboard/', {'before': last.context['page_obj'].previous_cursor})
+        self.assertEqual(self.usernames(previous), seen[-30:-15])
+
+    def test_prefix_filter_and_cached_count(self):
+        response = self.client.get('/admin-dashboard/', {'username': 'USER1'})
+        self.assertEqual(response.context['user_count'], 10)
+        self.assertEqual(len(self.client.get('/admin-dashboard/', {'email': 'ser1'}).context['page_obj']), 0)
+
+        User.objects.create_user('user1x', 'user1x@example.com', 'password123')
+        self.assertEqual(self.client.get('/admin-dashboard/', {'username': 'user1'}).context['user_count'], 11)
+
+    def test_invalid_cursor_shows_the_first_page(self):
+        response = self.client.get('/admin-dashboard/', {'after': 'not-a-cursor'})
+        self.assertEqual(self.usernames(response)[0], 'admin')
+
+    def test_filtered_pages_are_read_in_index_order(self):
+        with CaptureQueriesContext(connection) as queries:
+            for params in ({}, {'username': 'USER'}, {'email': 'User'}, {'username': 'user', 'email': 'user'}):
+                response = self.client.get('/admin-dashboard/', params)
+                self.assertTrue(response.context['page_obj'].has_next, params)
+                self.client.get('/admin-dashboard/', {**params, 'after': response.context['page_obj'].next_cursor})
+                self.client.get('/admin-dashboard/', {**params, 'last': 1})
+
+        checked = 0
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or 'FROM "auth_user"' not in sql or 'ORDER BY' not in sql:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            checked += 1
+            self.assertTrue(any('_nocase_idx' in step for step in plan), f'No NOCASE index:\n{sql}\n{plan}')
+            for step in plan:
+                self.assertNotIn('TEMP B-TREE FOR ORDER BY', step, f'Sort without an index:\n{sql}\n{plan}')
+        self.assertEqual(checked, 12)
+
+        # Pages of an email search are in email order.
+        response = self.client.get('/admin-dashboard/', {'email': 'user3'})
+        self.assertEqual(self.usernames(response), [f'user3{i}' for i in range(10)])
+
+
+class DoctorAppointmentListTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('doctor', 'doctor@example.com', 'password123')
+        user.groups.add(Group.objects.get_or_create(name='Doctors')[0])
+        self.doctor = Doctor.objects.create(name='Dr. A', expert='Fever', location='Pune', price=500, user=user)
+        start = date(2024, 1, 1)
+        Appointment.objects.bulk_create([
+            Appointment(
+                doctor=self.doctor, patient_name=f'Pat {i}', patient_age=30, patient_mobile='9999999999',
+                disease='Fever', appointment_date=start + timedelta(days=i // 4), appointment_time=time(9 + i % 4, 0),
+                status='Completed',
+            )
+            for i in range(60)
+        ])
+        self.client.force_login(user)
+
+    def test_filtered_history_is_paged_most_recent_first(self):
+        response = self.client.get('/doctor/appointments/', {'status': 'Completed'})
+        ids = [appt.id for appt in response.context['page_obj']]
+        self.assertEqual(len(ids), 25)
+        cursor = response.context['page_obj'].next_cursor
+        while cursor:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get('/doctor/appointments/', {'status': 'Completed', 'after': cursor, 'format': 'json'}).json()
+            page_query = queries[-1]['sql']
+            self.assertNotIn('OFFSET', page_query)
+            self.assertNotIn('booked_by_id', page_query)  # only the displayed columns
+            ids += [int(row_id) for row_id in re.findall(r'<th scope="row">(\d+)</th>', data['html'])]
+            cursor = data['next_cursor']
+
+        expected = list(
+            Appointment.objects.order_by('-appointment_date', '-appointment_time', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+
+class PatientAppointmentsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', 'patient@example.com', 'password123')
+        self.user.groups.add(Group.objects.get_or_create(name='Patients')[0])
+        self.client.force_login(self.user)
+
+    def book(self, count):
+        doctors = [
+            Doctor.objects.create(name=f'Dr. {i}', expert='Fever', location='Pune', price=500) for i in range(count)
+        ]
+        Appointment.objects.bulk_create([
+            Appointment(
+                doctor=doctor, booked_by=self.user, patient_name='Pat', patient_age=30, patient_mobile='9999999999',
+                disease='Fever', appointment_date=date(2024, 1, 1), appointment_time=time(9, 0),
+            )
+            for doctor in doctors
+        ])
+        LabTest.objects.bulk_create([LabTest(test_type='CBC', location='Pune', booked_by=self.user) for _ in range(count)])
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_counts_do_not_grow_with_the_number_of_bookings(self):
+        urls = [
+            ('/my-appointments/', None),
+            ('/my-appointments/', {'tab': 'lab-tests'}),
+            ('/my-appointments/tabs/appointments/', None),
+            ('/my-appointments/tabs/lab-tests/', {'format': 'json'}),
+        ]
+        self.book(2)
+        self.client.get('/my-appointments/')  # caches the roles in the session
+        few = [self.count_queries(url, params) for url, params in urls]
+        self.book(30)
+        many = [self.count_queries(url, params) for url, params in urls]
+        self.assertEqual(few, many)
+
+    def test_only_the_active_tab_is_rendered(self):
+        self.book(3)
+        response = self.client.get('/my-appointments/')
+        self.assertEqual(len(response.context['appointments_tab']['page_obj']), 3)
+        self.assertIsNone(response.context['lab_tests_tab'])
+        self.assertContains(response, 'data-url="/my-appointments/tabs/lab-tests/"')
+
+
+class RolesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('patient', 'patient@example.com', 'password123')
+        self.patients = Group.objects.get_or_create(name='Patients')[0]
+        self.user.groups.add(self.patients)
+        self.client.force_login(self.user)
+
+    def test_roles_are_cached_until_group_membership_changes(self):
+        self.assertEqual(self.client.get('/lab-test/').status_code, 200)
+        with self.assertNumQueries(3):  # session, user and roles version; no group check
+            self.client.get('/lab-test/')
+
+        self.patients.user_set.remove(self.user)  # from the group's side, as the admin does
+        self.assertRedirects(self.client.get('/lab-test/'), '/', fetch_redirect_response=False)
+
+        self.user.groups.add(Group.objects.get_or_create(name='Doctors')[0])
+        self.assertRedirects(self.client.get('/lab-test/'), '/doctor/dashboard/', fetch_redirect_response=False)
+
+    def test_roles_cached_by_one_process_are_valid_in_another(self):
+        self.client.get('/lab-test/')
+        cache.clear()  # another worker process, with its own local-memory cache
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/lab-test/').status_code, 200)
+        self.assertEqual(len(queries), 3)  # session, user and roles version
+        self.assertFalse(any('auth_group' in query['sql'] or 'UPDATE' in query['sql'] for query in queries))
+
+        self.user.groups.clear()
+        cache.clear()
+        self.assertRedirects(self.client.get('/lab-test/'), '/', fetch_redirect_response=False)
+
+    def test_linking_a_doctor_profile_is_picked_up(self):
+        self.user.groups.set([Group.objects.get_or_create(name='Doctors')[0]])
+        self.assertRedirects(self.client.get('/doctor/dashboard/'), '/', fetch_redirect_response=False)
+        Doctor.objects.create(name='Dr. A', expert='Fever', location='Pune', price=500, user=self.user)
+        self.assertContains(self.client.get('/doctor/dashboard/'), 'Welcome, Dr. A.')
+
+    def test_load_roles_reads_every_group_and_the_linked_profiles(self):
+        self.user.groups.add(Group.objects.get_or_create(name='Doctors')[0])
+        doctor = Doctor.objects.create(name='Dr. A', expert='Fever', location='Pune', price=500, user=self.user)
+        profile = Profile.objects.get_or_create(user=self.user)[0]
+        with self.assertNumQueries(1):
+            loaded = roles.load_roles(self.user)
+        self.assertEqual(loaded.as_dict(), {
+            'groups': ['Doctors', 'Patients'], 'doctor_id': doctor.pk, 'doctor_name': 'Dr. A',
+            'profile_id': profile.pk, 'doctor_shard': 'default',
+        })
+
+        nobody = User.objects.create_user('nobody', 'nobody@example.com', 'password123')
+        Profile.objects.filter(user=nobody).delete()
+        self.assertEqual(roles.load_roles(nobody).as_dict(), {
+            'groups': [], 'doctor_id': None, 'doctor_name': '', 'profile_id': None, 'doctor_shard': 'default',
+        })
+
+
+class IndexCoverageTests(TestCase):
+    """Runs EXPLAIN QUERY PLAN on every appointment and lab test query the views issue."""
+
+    TABLES = ('med_appointment', 'med_labtest')
+
+    def setUp(self):
+        cache.clear()
+        doctor_user = User.objects.create_user('doctor', 'doctor@example.com', 'password123')
+        doctor_user.groups.add(Group.objects.get_or_create(name='Doctors')[0])
+        self.doctor = Doctor.objects.create(
+            name='Dr. A', expert='Fever', location='Pune', price=500, user=doctor_user,
+            from_time=time(9, 0), to_time=time(17, 0),
+        )
+        self.patient = User.objects.create_user('patient', 'patient@example.com', 'password123')
+        self.patient.groups.add(Group.objects.get_or_create(name='Patients')[0])
+        today = timezone.localdate()
+        self.appointments = [
+            Appointment.objects.create(
+                doctor=self.doctor, booked_by=self.patient, patient_name='Pat', patient_age=30,
+                patient_mobile='9999999999', disease='Fever', appointment_date=today + timedelta(days=i - 5),
+                appointment_time=time(10, 0), status='Confirmed',
+            )
+            for i in range(10)
+        ]
+        self.lab_test = LabTest.objects.create(test_type='CBC', location='Pune', booked_by=self.patient)
+        self.doctor_client = self.client_class()
+        self.doctor_client.force_login(doctor_user)
+        self.client.force_login(self.patient)
+
+    def run_views(self):
+        token = booking.dumps(
+            self.patient, patient_name='Pat', age=30, mobile='9999999999', rescheduling_id=self.appointments[-3].pk,
+        )
+        day = (timezone.localdate() + timedelta(days=20)).isoformat()
+        self.client.post(
+            f'/create-appointment/{self.doctor.pk}/', {'appointment_date': day, 'appointment_time': '11:00', 'booking': token, 'confirm': '1'},
+        )
+        self.client.get('/my-appointments/')
+        self.client.get('/my-appointments/', {'tab': 'lab-tests', 'lab-status': 'Pending'})
+        self.client.get('/my-appointments/tabs/appointments/', {'appt-status': 'Confirmed', 'format': 'json'})
+        self.client.get(f'/my-appointments/{self.appointments[-1].pk}/cancel/')
+        self.client.get(f'/my-lab-tests/{self.lab_test.pk}/cancel/')
+        self.doctor_client.get('/doctor/appointments/')
+        self.doctor_client.get('/doctor/appointments/', {'status': 'Confirmed', 'patient_name': 'Pat'})
+        self.doctor_client.get(f'/appointment/{self.appointments[-2].pk}/update/Cancelled/')
+        complete_past_appointments()
+
+    def test_view_queries_use_indexes(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.run_views()
+
+        checked = 0
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith(('SELECT', 'UPDATE', 'DELETE')) or not any(f'"{table}"' in sql for table in self.TABLES):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            checked += 1
+            for step in plan:
+                for table in self.TABLES:
+                    self.assertFalse(step.startswith(f'SCAN {table}'), f'Full scan of {table}:\n{sql}\n{plan}')
+                self.assertNotIn('TEMP B-TREE FOR ORDER BY', step, f'Sort without an index:\n{sql}\n{plan}')
+        self.assertGreater(checked, 10)
+
+
+class BookingTokenTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', 'patient@example.com', 'password123')
+        self.user.groups.add(Group.objects.get_or_create(name='Patients')[0])
+        self.doctor = Doctor.objects.create(
+            name='Dr. A', expert='Fever', location='Pune', price=500, from_time=time(9, 0), to_time=time(12, 0),
+        )
+        self.day = (timezone.localdate() + timedelta(days=3)).isoformat()
+        self.client.force_login(self.user)
+        self.client.get('/book-appointment/')  # caches the roles in the session
+
+    def session_writes(self, queries):
+        return [query['sql'] for query in queries if 'django_session' in query['sql'] and not query['sql'].startswith('SELECT')]
+
+    def test_complete_booking_does_not_write_the_session(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/book-appointment/', {
+                'patient_name': 'Pat', 'age': '30', 'mobile': '9999999999', 'disease': 'Fever', 'location': 'Pune',
+            })
+            self.assertTemplateUsed(response, 'doctor_details.html')
+            token = response.context['booking_token']
+            response = self.client.post(f'/create-appointment/{self.doctor.pk}/', {'booking': token, 'appointment_date': self.day})
+            self.assertContains(response, f'name="booking" value="{token}"')
+            response = self.client.post(
+                f'/create-appointment/{self.doctor.pk}/',
+                {'booking': token, 'appointment_date': self.day, 'appointment_time': '10:00', 'confirm': '1'},
+            )
+        self.assertTemplateUsed(response, 'Book.html')
+        # Storing the wizard state in the session cost two writes per booking.
+        self.assertEqual(self.session_writes(queries), [])
+        appointment = Appointment.objects.get()
+        self.assertEqual((appointment.patient_name, appointment.disease), ('Pat', 'Fever'))
+
+        # Rescheduling, which also cost two writes
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/my-appointments/{appointment.pk}/reschedule/')
+            token = response.context['booking_token']
+            self.client.post(
+                f'/create-appointment/{self.doctor.pk}/',
+                {'booking': token, 'appointment_date': self.day, 'appointment_time': '11:00', 'confirm': '1'},
+            )
+        self.assertEqual(self.session_writes(queries), [])
+        self.assertEqual(Appointment.objects.get().appointment_time, time(11, 0))
+
+    def test_tokens_are_bound_to_the_user_and_expire(self):
+        token = booking.dumps(self.user, patient_name='Pat', age=30, mobile='9999999999')
+        self.assertEqual(booking.loads(self.user, token)['patient_name'], 'Pat')
+        other = User.objects.create_user('other', 'other@example.com', 'password123')
+        self.assertIsNone(booking.loads(other, token))
+        self.assertIsNone(booking.loads(self.user, token[:-1] + ('A' if token[-1] != 'A' else 'B')))
+        with override_settings(BOOKING_TOKEN_MAX_AGE=-1):
+            self.assertIsNone(booking.loads(self.user, token))
+
+    def test_tokens_travel_only_in_post_data(self):
+        for i in range(11):
+            Doctor.objects.create(name=f'Dr. {i:02}', expert='Fever', location='Pune', price=500)
+        response = self.client.post('/book-appointment/', {
+            'patient_name': 'Pat', 'age': '30', 'mobile': '9999999999', 'disease': 'Fever', 'location': 'Pune',
+        })
+        token = response.context['booking_token']
+        # The patient's details are in the token, so no link may carry it.
+        self.assertNotContains(response, 'booking=')
+        self.assertNotContains(response, 'href="?page=')
+
+        response = self.client.post('/doctor-details/', {'booking': token, 'page': '2'})
+        self.assertEqual(response.context['page_obj'].number, 2)
+        self.assertNotContains(response, 'booking=')
+
+        for url in ('/doctor-details/', f'/create-appointment/{self.doctor.pk}/'):
+            with self.subTest(url=url):
+                response = self.client.get(url, {'booking': token})
+                self.assertRedirects(response, '/book-appointment/', fetch_redirect_response=False)
+
+
+class SQLiteBackendTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.directory.name) / 'db.sqlite3')
+        sqlite_backend.counters.reset()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def wrapper(self, **options):
+        settings_dict = {**connection.settings_dict, 'NAME': self.path, 'OPTIONS': options}
+        wrapper = sqlite_backend.DatabaseWrapper(settings_dict, alias='backend_test')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_connections_use_wal_and_busy_timeout(self):
+        with self.wrapper(busy_timeout=1234).cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 1234)
+
+    def test_locked_statements_are_retried_and_transactions_counted(self):
+        wrapper = self.wrapper(busy_timeout=0, lock_retries=8, lock_retry_backoff=0.005)
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (id INTEGER PRIMARY KEY)')
+
+        # Another connection holds the write lock for a moment.
+        other = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        other.execute('BEGIN IMMEDIATE')
+        release = threading.Timer(0.05, other.execute, ['COMMIT'])
+        release.start()
+        try:
+            with wrapper.cursor() as cursor:
+                cursor.execute('INSERT INTO t (id) VALUES (1)')
+        finally:
+            release.join()
+            other.close()
+        self.assertGreater(sqlite_backend.counters.stats()['retries'], 0)
+        self.assertEqual(sqlite_backend.counters.stats()['failures'], 0)
+
+        # transaction.atomic() starts transactions this way; they take the write lock up front.
+        wrapper.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        self.assertTrue(wrapper.connection.in_transaction)
+        wrapper.rollback()
+        wrapper.set_autocommit(True)
+        self.assertEqual(sqlite_backend.counters.stats()['transactions'], 1)
+
+
+class ShardingTests(TransactionTestCase):
+    """Appointments split over two shard databases by doctor location."""
+
+    SHARDS = {'north': {'id': 1, 'locations': ['Kalyan']}, 'south': {'id': 2, 'locations': ['Pune']}}
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for alias in self.SHARDS:
+            connections.databases[alias] = {
+                **connection.settings_dict,
+                'NAME': str(Path(directory.name) / f'{alias}.sqlite3'),
+                'OPTIONS': {**connection.settings_dict['OPTIONS'], 'foreign_keys': False},
+            }
+            self.addCleanup(self.remove_database, alias)
+        shards = override_settings(MED_SHARDS=self.SHARDS)
+        shards.enable()
+        self.addCleanup(shards.disable)
+        for alias in self.SHARDS:
+            call_command('migrate', 'med', database=alias, verbosity=0)
+
+        self.patient = User.objects.create_user('patient', 'patient@example.com', 'password123')
+        self.patient.groups.add(Group.objects.get_or_create(name='Patients')[0])
+        doctor_user = User.objects.create_user('doctor', 'doctor@example.com', 'password123')
+        doctor_user.groups.add(Group.objects.get_or_create(name='Doctors')[0])
+        self.doctors = {
+            location: Doctor.objects.create(
+                name=f'Dr. {location}', expert='Fever', location=location, price=500,
+                user=doctor_user if location == 'Kalyan' else None,
+            )
+            for location in ('Kalyan', 'Pune', 'Thane')
+        }
+        self.doctor_client = self.client_class()
+        self.doctor_client.force_login(doctor_user)
+        self.client.force_login(self.patient)
+
+    def remove_database(self, alias):
+        connections[alias].close()
+        del connections[alias]
+        del connections.databases[alias]
+
+    def test_imported_doctors_are_replicated_to_their_shard(self):
+        rows = [
+            (2, {'username': 'doctor', 'name': 'Dr. Kalyan Renamed', 'expert': 'Fever', 'location': 'Kalyan', 'price': '600'}),
+            (3, {'username': 'dr.pune', 'name': 'Dr. New', 'expert': 'Fever', 'location': 'Pune', 'price': '700'}),
+        ]
+        totals = imports.import_doctors(rows)
+        self.assertEqual((totals.created, totals.updated), (1, 1))
+        self.assertEqual(
+            sorted(Doctor.objects.using('north').values_list('name', 'price')),
+            [('Dr. Kalyan Renamed', 600)],
+        )
+        new = Doctor.objects.get(user__username='dr.pune')
+        self.assertEqual(new.shard, 'south')
+        self.assertEqual(set(Doctor.objects.using('south').values_list('pk', flat=True)), {self.doctors['Pune'].pk, new.pk})
+
+        # Doctors without accounts, as seed_doctors creates them
+        imports.create_doctors([Doctor(name='Dr. Seeded', expert='Fever', location='Kalyan', price=500)])
+        seeded = Doctor.objects.get(name='Dr. Seeded')
+        self.assertEqual(Doctor.objects.using('north').get(pk=seeded.pk).name, 'Dr. Seeded')
+
+    def book(self, doctor, days_ahead):
+        token = booking.dumps(self.patient, patient_name='Pat', age=30, mobile='9999999999', disease='Fever')
+        day = timezone.localdate() + timedelta(days=days_ahead)
+        self.client.post(
+            f'/create-appointment/{doctor.pk}/',
+            {'booking': token, 'appointment_date': day.isoformat(), 'appointment_time': '10:00', 'confirm': '1'},
+        )
+        return Appointment.objects.using(doctor.shard).get(doctor=doctor, appointment_date=day)
+
+    @mock.patch('med.outbox.schedule_drain')  # drained below instead
+    def test_appointments_live_in_their_doctors_shard(self, schedule_drain):
+        self.assertEqual({location: doctor.shard for location, doctor in self.doctors.items()},
+                         {'Kalyan': 'north', 'Pune': 'south', 'Thane': 'default'})
+        # Each shard holds a replica of its own doctors only.
+        self.assertEqual(list(Doctor.objects.using('north').values_list('name', flat=True)), ['Dr. Kalyan'])
+
+        north, south, local = (self.book(self.doctors[location], days) for location, days in (('Kalyan', 1), ('Pune', 2), ('Thane', 3)))
+        self.assertEqual([sharding.shard_for_id(appointment.pk) for appointment in (north, south, local)], ['north', 'south', 'default'])
+        self.assertFalse(Appointment.objects.filter(pk__in=[north.pk, south.pk]).exists())
+        self.assertEqual(availability.booked_mask(north.doctor_id, north.appointment_date, 'north'), availability.slot_bit(time(10, 0)))
+
+        # The patient's list merges the shards, most recent first.
+        response = self.client.get('/my-appointments/')
+        self.assertEqual([appointment.pk for appointment in response.context['appointments_tab']['page_obj']], [local.pk, south.pk, north.pk])
+        # Each notification is queued in its appointment's database, and one drain sends them all.
+        self.assertEqual(
+            {alias: list(OutboxMessage.objects.using(alias).values_list('object_id', flat=True)) for alias in sharding.aliases()},
+            {'default': [local.pk], 'north': [north.pk], 'south': [south.pk]},
+        )
+        entities = load_entities(OutboxMessage.objects.using('south'))
+        self.assertEqual(entities[('appointment', south.pk)].doctor.name, 'Dr. Pune')
+        self.assertEqual(drain(), (3, 0))
+        self.assertEqual(sorted(EmailLog.objects.values_list('status', flat=True)), ['Sent'] * 3)
+
+        self.client.get(f'/my-appointments/{north.pk}/cancel/')
+        self.assertEqual(Appointment.objects.using('north').get(pk=north.pk).status, 'Cancelled')
+        self.assertEqual(availability.booked_mask(north.doctor_id, north.appointment_date, 'north'), 0)
+
+        response = self.doctor_client.get('/doctor/appointments/', {'status': 'Cancelled'})
+        self.assertEqual([appointment.pk for appointment in response.context['page_obj']], [north.pk])
+
+    @mock.patch('med.outbox.schedule_drain')
+    def test_shard_bookings_do_not_write_the_default_database(self, schedule_drain):
+        self.book(self.doctors['Kalyan'], 1)  # caches the roles in the session
+        with CaptureQueriesContext(connection) as queries:
+            appointment = self.book(self.doctors['Kalyan'], 2)
+            self.client.get(f'/my-appointments/{appointment.pk}/cancel/')
+        self.assertEqual([query['sql'] for query in queries if not query['sql'].startswith('SELECT')], [])
+        self.assertEqual(OutboxMessage.objects.using('north').count(), 3)
+
+    def test_status_sweep_covers_every_shard(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        for doctor in self.doctors.values():
+            Appointment.objects.using(doctor.shard).create(
+                doctor=doctor, patient_name='Pat', patient_age=30, patient_mobile='9999999999', disease='Fever',
+                appointment_date=yesterday, appointment_time=time(10, 0), status='Confirmed',
+            )
+        self.assertEqual(complete_past_appointments()[0], 3)
+        self.assertEqual(stats.year_buckets(self.doctors['Pune'].pk, yesterday.year, 'south'), [(yesterday.month, 'Completed', 1)])
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        doctor_user = User.objects.create_user('doctor', 'doctor@example.com', 'password123')
+        doctor_user.groups.add(Group.objects.get_or_create(name='Doctors')[0])
+        self.doctor = Doctor.objects.create(name='Dr. A', expert='Fever', location='Pune', price=500, user=doctor_user)
+        other = Doctor.objects.create(name='Dr. B', expert='Fever', location='Pune', price=500)
+        Appointment.objects.bulk_create([
+            Appointment(
+                doctor=doctor, patient_name=name, patient_age=30, patient_mobile='9999999999', disease='Fever',
+                appointment_date=date(2024, 1, 1 + i), appointment_time=time(10, 0), status=status,
+            )
+            for i, (doctor, name, status) in enumerate([
+                (self.doctor, 'Pat', 'Completed'), (self.doctor, '=HYPERLINK("x")', 'Completed'),
+                (self.doctor, 'Sam', 'Cancelled'), (other, 'Other', 'Completed'),
+            ])
+        ])
+        self.client.force_login(doctor_user)
+
+    def test_doctor_exports_own_filtered_appointments_as_a_stream(self):
+        response = self.client.get('/doctor/appointments/export/', {'status': 'Completed'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        chunks = iter(response.streaming_content)
+        # The header goes out before any row is read.
+        with self.assertNumQueries(0):
+            self.assertTrue(next(chunks).startswith(b'id,appointment_date,'))
+        lines = b''.join(chunks).decode().splitlines()
+        self.assertEqual([line.split(',')[3] for line in lines], ['Pat', '"\'=HYPERLINK(""x"")"'])
+
+    def test_users_export_in_chunks_with_groups_and_profile(self):
+        User.objects.bulk_create([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(5)])
+        patients = Group.objects.create(name='Patients')
+        for user in User.objects.filter(username__in=['user1', 'user3']):
+            user.groups.add(patients)
+        out = io.StringIO()
+        # Three chunks of two users: one query for the users, one per chunk for their groups.
+        with self.assertNumQueries(1 + 3):
+            call_command('export_data', 'users', '--format', 'jsonl', '--chunk-size', '2', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual({row['username']: row['groups'] for row in rows}['user3'], 'Patients')
+        self.assertIsNone(rows[-1]['mobile'])
+
+        out = io.StringIO()
+        call_command('export_data', 'users', '--filter', 'groups=%d' % patients.pk, stdout=out)
+        self.assertEqual([line.split(',')[1] for line in out.getvalue().splitlines()], ['username', 'user1', 'user3'])
+
+
+class ImportDoctorsTests(TestCase):
+    HEADER = 'username,email,mobile,name,expert,location,price,gender\n'
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('dr.priya', 'priya@example.com', 'password123')
+        Profile.objects.create(user=user, mobile='9000000000')
+        Doctor.objects.create(
+            name='Dr. Priya', expert='Fever', location='Pune', price=500, gender='Female',
+            description='Twenty years in practice.', user=user,
+        )
+
+    def import_file(self, content, *args):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'doctors.csv'
+        path.write_text(content)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_doctors', str(path), *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_upserts_doctors_with_accounts_and_reports_bad_rows(self):
+        out, err = self.import_file(
+            self.HEADER
+            + 'dr.priya,,9111111111,Dr. Priya Sharma,Skin-related issues,Pune,900,\n'
+            + 'dr.rohan,rohan@example.com,9876543210,Dr. Rohan Verma,Fever,Nagpur,700,Male\n'
+            + 'dr.bad,,,Dr. Bad,Fever,Pune,cheap,\n'
+            + 'dr.rohan,,,Dr. Rohan Again,Fever,Pune,800,\n',
+            '--chunk-size', '2',
+        )
+        self.assertIn('Imported 2 doctor(s) (1 created, 1 updated, 2 skipped)', out)
+        self.assertIn('Line 4: price:', err)
+        self.assertIn("Line 5: username: 'dr.rohan' is also on line 3.", err)
+
+        priya = Doctor.objects.select_related('specialty', 'user__profile').get(user__username='dr.priya')
+        self.assertEqual((priya.name, priya.price, priya.specialty.name), ('Dr. Priya Sharma', 900, 'Skin-related issues'))
+        # Columns the row leaves out keep their values.
+        self.assertEqual((priya.gender, priya.description, priya.user.email), ('Female', 'Twenty years in practice.', 'priya@example.com'))
+        self.assertEqual(priya.user.profile.mobile, '9111111111')
+
+        rohan = Doctor.objects.select_related('city', 'user__profile').get(user__username='dr.rohan')
+        self.assertEqual((rohan.city.name, rohan.shard, rohan.user.first_name), ('Nagpur', 'default', 'Rohan'))
+        self.assertFalse(rohan.user.has_usable_password())
+        self.assertEqual(rohan.user.profile.mobile, '9876543210')
+        self.assertEqual(list(rohan.user.groups.values_list('name', flat=True)), ['Doctors'])
+
+    def test_queries_per_chunk_do_not_grow_with_its_size(self):
+        def import_rows(start, count):
+            rows = [
+                (number, {'username': f'dr.{number}', 'name': f'Dr. {number}', 'expert': 'Fever', 'location': 'Pune', 'price': '500'})
+                for number in range(start, start + count)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                imports.import_doctors(rows, chunk_size=count)
+            return len(queries)
+
+        import_rows(0, 1)  # creates the Doctors group and catalog entries
+        self.assertEqual(import_rows(10, 3), import_rows(100, 60))
+        self.assertEqual(Doctor.objects.count(), 65)
+
+    def test_jsonl_and_seed_doctors(self):
+        out, err = self.import_file(
+            '{"username": "dr.json", "name": "Dr. Json", "expert": "Flu", "location": "Thane", "price": 450}\n\nnot json\n',
+            '--format', 'jsonl',
+        )
+        self.assertIn('1 created, 0 updated, 1 skipped', out)
+        self.assertIn('Line 3: Not a JSON object.', err)
+
+        call_command('seed_doctors', stdout=io.StringIO())
+        self.assertGreater(Doctor.objects.count(), 1000)
+        self.assertFalse(Doctor.objects.filter(Q(specialty=None) | Q(city=None) | Q(shard='')).exists())
+
+
+class GenerateLoadDataTests(TestCase):
+    ARGS = ['--today', '2024-06-01', '--patients', '20', '--doctors', '5', '--appointments', '300',
+            '--lab-tests', '10', '--email-logs', '30', '--days-back', '30', '--days-ahead', '10', '--batch-size', '100']
+
+    def generate(self, *args):
+        call_command('generate_load_data', *self.ARGS, *args, stdout=io.StringIO())
+        return sorted(Appointment.objects.values_list(
+            'doctor__name', 'appointment_date', 'appointment_time', 'status', 'patient_name', 'created_at',
+        ))
+
+    def test_generates_realistic_reproducible_data(self):
+        appointments = self.generate()
+        self.assertEqual(len(appointments), 300)
+        self.assertEqual((User.objects.filter(groups__name='Patients').count(), Doctor.objects.count()), (20, 5))
+        self.assertEqual((LabTest.objects.count(), EmailLog.objects.count()), (10, 30))
+        self.assertTrue(User.objects.get(username='load.patient3').check_password('password123'))
+
+        for appointment in Appointment.objects.select_related('doctor'):
+            doctor = appointment.doctor
+            self.assertTrue(doctor.from_time <= appointment.appointment_time and appointment.appointment_end_time <= doctor.to_time)
+            self.assertLess(appointment.created_at.date(), date(2024, 6, 1))
+            if appointment.appointment_date < date(2024, 6, 1):
+                self.assertIn(appointment.status, ['Completed', 'Cancelled'])
+        # Backdated, not stamped with the time they were written.
+        self.assertLess(LabTest.objects.latest('created_at').created_at.date(), date(2024, 6, 2))
+        self.assertLess(EmailLog.objects.latest('sent_at').sent_at.date(), date(2024, 6, 2))
+        # The derived tables are rebuilt from the generated appointments.
+        self.assertEqual(sum(DoctorMonthlyStats.objects.values_list('count', flat=True)), 300)
+        self.assertTrue(DoctorDayAvailability.objects.exists())
+
+        with self.assertRaises(CommandError):
+            self.generate()
+        # The same seed gives the same rows; another seed does not.
+        User.objects.filter(username__startswith='load.').delete()
+        self.assertEqual(self.generate(), appointments)
+        User.objects.filter(username__startswith='load.').delete()
+        self.assertNotEqual(self.generate('--seed', '2'), appointments)
@@ -6,6 +6,8 @@ from accounts import views as account_views
 urlpatterns= [
     path('',views.home,name='home'),
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    path('admin-dashboard/metrics/', views.metrics, name='metrics'),
+    path('admin-dashboard/export/<slug:kind>/', views.admin_export, name='admin_export'),
     path('home/', lambda request: redirect('home', permanent=True)),
     path('about/',views.about,name='about'),
     path('book-appointment/', views.book_appointment, name='book_appointment'),
@@ -13,7 +15,9 @@ urlpatterns= [
     path('create-appointment/<int:doctor_id>/', views.create_appointment, name='create_appointment'),
     path('doctor/dashboard/', views.doctor_dashboard, name='doctor_dashboard'),
     path('doctor/appointments/', views.doctor_appointment_list, name='doctor_appointment_list'),
+    path('doctor/appointments/export/', views.doctor_appointment_export, name='doctor_appointment_export'),
     path('my-appointments/', views.patient_appointments, name='patient_appointments'),
+    path('my-appointments/tabs/<slug:tab>/', views.patient_bookings_tab, name='patient_bookings_tab'),
     path('my-appointments/<int:appointment_id>/cancel/', views.cancel_appointment_patient, name='cancel_appointment_patient'),
     path('my-appointments/<int:appointment_id>/reschedule/', views.reschedule_appointment, name='reschedule_appointment'),
     path('my-lab-tests/<int:test_id>/cancel/', views.cancel_lab_test, name='cancel_lab_test'),
@@ -24,6 +28,7 @@ urlpatterns= [
     # API URLs
     path('api/locations/', views.get_locations, name='api_get_locations'),
     path('api/search-diseases/', views.search_diseases, name='api_search_diseases'),
+    path('api/doctors/<int:doctor_id>/availability/', views.doctor_availability, name='api_doctor_availability'),
     path('api/lab-locations/', views.get_lab_locations, name='api_get_lab_locations'),
     path('api/search-lab-tests/', views.search_lab_tests, name='api_search_lab_tests'),
 ]
\ No newline at end of file
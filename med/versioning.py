@@ -0,0 +1,81 @@
+"""
+Data version stamps.
+
+A version is a counter in the Django cache, named after the data it stamps
+('doctors', 'users', a doctor's stats...). Code that changes the data bumps
+it; code that builds something from the data (an autocomplete index, the
+symptom catalog, a cached dashboard or count) records the version it built
+from and rebuilds when the current version differs.
+
+Versions are only shared between processes that share the cache. With the
+default local-memory backend each worker process keeps its own counters, so
+a bump in one worker is invisible to the others, which keep serving what
+they built until the cache entries behind it expire. Deployments running
+several processes must configure a shared cache, e.g. the file-based one
+selected by DJANGO_CACHE_DIR (see CACHES in the settings), or memcached or
+Redis.
+
+That is acceptable for stamps kept next to the data in the same cache, but
+not for stamps stored elsewhere. Each process starts its counters at a
+different value, so a stamp saved in a session by one worker would never
+match the counter of the next worker to serve the session. Such stamps use
+`shared_versions()` and `bump_shared_version()` instead, which keep the
+counters in the DataVersion table: one small query per read, and the same
+value in every process whatever the cache backend.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import DataVersion
+
+VERSION_CACHE_KEY = 'med:data_version:{}'
+
+
+def _initial_version():
+    # Milliseconds rather than 0, so a counter that was evicted from the cache
+    # restarts above any value data may already be cached under.
+    return int(time.time() * 1000)
+
+
+def data_version(key):
+    """Returns the current change counter for `key`, starting one if there is none."""
+    cache_key = VERSION_CACHE_KEY.format(key)
+    version = cache.get(cache_key)
+    if version is None:
+        cache.add(cache_key, _initial_version(), timeout=None)
+        version = cache.get(cache_key, 0)
+    return version
+
+
+def bump_data_version(key):
+    """Increments the change counter for `key`, invalidating data built from it."""
+    cache_key = VERSION_CACHE_KEY.format(key)
+    try:
+        return cache.incr(cache_key)
+    except ValueError:
+        # Never read, or evicted: any fresh start value differs from the old one.
+        version = _initial_version()
+        cache.set(cache_key, version, timeout=None)
+        return version
+
+
+def shared_versions(names):
+    """Returns the DataVersion counters for `names` as a list, in one query; unset counters are 0."""
+    values = dict(DataVersion.objects.filter(name__in=names).values_list('name', 'value'))
+    return [values.get(name, 0) for name in names]
+
+
+def bump_shared_version(name):
+    """Increments the DataVersion counter `name` in the current transaction."""
+    counter = DataVersion.objects.filter(name=name)
+    if counter.update(value=F('value') + 1):
+        return
+    try:
+        with transaction.atomic():
+            DataVersion.objects.create(name=name, value=1)
+    except IntegrityError:
+        # Created concurrently by another bump.
+        counter.update(value=F('value') + 1)
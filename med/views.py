@@ -1,17 +1,27 @@
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
 from .models import Doctor, Appointment, LabTest, EmailLog
 from django.urls import reverse
-from django.db.models import Count
-from urllib.parse import urlencode
+from django.db.models.functions import Collate
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
 from datetime import datetime, timedelta
-from django.db import transaction
-from .email_utils import send_confirmation_email_async, send_reschedule_email_async, send_lab_test_email_async, send_appointment_cancellation_email_async, send_lab_test_cancellation_email_async, send_doctor_confirmation_email_async
+from django.db import IntegrityError, connection, transaction
+from .notifications import notify
+from . import availability, booking, dashboard, exports, outbox, sharding
+from .catalog import search_doctors
+from .autocomplete import get_source
+from .pagination import KeysetPaginator, ShardedKeysetPaginator, cached_count
 from .filters import AppointmentFilter, UserFilter, PatientAppointmentFilter, LabTestFilter
 from .decorators import group_required, superuser_required
-from django.http import JsonResponse
+from .roles import get_roles
+from .notification_pool import notification_pool
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.dateformat import time_format
+from django.conf import settings
+from django.views.decorators.http import condition
 from django.contrib.auth.models import User, Group
 
 # Create your views here.
@@ -24,15 +34,15 @@ def about(request):
 @login_required
 @group_required('Doctors')
 def doctor_dashboard(request):
-    try:
-        doctor = request.user.doctor_profile
-    except Doctor.DoesNotExist:
+    roles = get_roles(request)
+    if roles.doctor_id is None:
         messages.error(request, "Your doctor profile could not be found.")
         return redirect('home')
 
     # --- Year Filter ---
-    all_years = Appointment.objects.filter(doctor=doctor).dates('appointment_date', 'year', order='DESC')
-    available_years = [d.year for d in all_years]
+    # Counts come from the DoctorMonthlyStats rollup (see med.stats), cached
+    # until the doctor's appointments next change (see med.dashboard).
+    available_years = dashboard.available_years(roles.doctor_id, roles.doctor_shard)
 
     # Determine the default year. Use the most recent year with appointments,
     # or the current year if there are no appointments at all.
@@ -45,20 +55,20 @@ def doctor_dashboard(request):
         selected_year = default_year
 
     # --- Data Aggregation for the selected year ---
-    appointments = Appointment.objects.filter(doctor=doctor, appointment_date__year=selected_year)
+    if selected_year in available_years:
+        summary = dashboard.year_summary(roles.doctor_id, selected_year, roles.doctor_shard)
+        status_data = summary['status_data']
+        monthly_counts = summary['monthly_counts']
+    else:
+        status_data = {}
+        monthly_counts = [0] * 12
 
     # 1. Key Metrics
-    total_bookings = appointments.count()
-    status_counts = appointments.values('status').annotate(count=Count('id'))
-    
-    status_data = {item['status']: item['count'] for item in status_counts}
+    total_bookings = sum(status_data.values())
     completed_count = status_data.get('Completed', 0)
     confirmed_count = status_data.get('Confirmed', 0)
 
-    # 2. Monthly Bookings for Bar Chart
-    monthly_counts = {i: 0 for i in range(1, 13)}
-    for appt in appointments.values('appointment_date__month').annotate(count=Count('id')):
-        monthly_counts[appt['appointment_date__month']] = appt['count']
+    # 2. Monthly Bookings for Bar Chart (built above)
 
     # 3. Status Distribution for Pie Chart
     pie_chart_labels = list(status_data.keys())
@@ -72,13 +82,13 @@ def doctor_dashboard(request):
     pie_chart_colors = [status_color_map.get(status, '#6c757d') for status in pie_chart_labels] # Default to secondary
 
     context = {
-        'doctor': doctor,
+        'doctor_name': roles.doctor_name,
         'selected_year': selected_year,
         'available_years': available_years,
         'total_bookings': total_bookings,
         'completed_count': completed_count,
         'confirmed_count': confirmed_count,
-        'monthly_bookings_data': list(monthly_counts.values()),
+        'monthly_bookings_data': monthly_counts,
         'pie_chart_labels': pie_chart_labels,
         'pie_chart_data': pie_chart_data,
         'pie_chart_colors': pie_chart_colors,
@@ -89,25 +99,66 @@ def doctor_dashboard(request):
 @superuser_required
 def admin_dashboard(request):
     # Use prefetch_related and select_related for better performance
-    user_list = User.objects.prefetch_related('groups').select_related('profile').all().order_by('username')
+    user_list = User.objects.prefetch_related('groups').select_related('profile').all()
     user_filter = UserFilter(request.GET, queryset=user_list)
 
-    paginator = Paginator(user_filter.qs, 15)  # Show 15 users per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination on (username, id), or (email, id) when filtering on
+    # the email alone: every page is one index range scan, where Paginator
+    # would COUNT(*) and OFFSET past the earlier pages. The key is compared
+    # and sorted with NOCASE, the collation of the indexes the prefix filters
+    # use (med migration 0018); those indexes end in the id, so they serve
+    # the ORDER BY too instead of a sort of every matching user.
+    sort_field = 'email' if request.GET.get('email') and not request.GET.get('username') else 'username'
+    users = user_filter.qs.annotate(sort_key=Collate(sort_field, 'NOCASE'))
+    paginator = KeysetPaginator(users, ('sort_key', 'id'), 15)  # Show 15 users per page
+    page_obj = paginator.page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        last='last' in request.GET,
+    )
 
     # Preserve other GET parameters during pagination
     get_params = request.GET.copy()
-    if 'page' in get_params:
-        del get_params['page']
+    for param in ('after', 'before', 'last', 'page'):
+        get_params.pop(param, None)
 
     context = {
         'filter': user_filter,
         'page_obj': page_obj,
+        'user_count': cached_count(user_filter.qs, 'users'),
         'query_params': get_params.urlencode(),
     }
     return render(request, 'admin_dashboard.html', context)
 
+def _export_response(request, export, queryset):
+    """Streams `queryset` as a CSV (or with format=jsonl, JSON Lines) download."""
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return JsonResponse({'error': 'Unknown export format.'}, status=400)
+    response = StreamingHttpResponse(exports.stream(export, queryset, fmt), content_type=exports.FORMATS[fmt])
+    filename = f"{export.name}-{datetime.today():%Y-%m-%d}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@superuser_required
+def admin_export(request, kind):
+    """Exports lab tests, email logs or users, filtered like the admin lists."""
+    if kind not in ('lab-tests', 'email-logs', 'users'):
+        return JsonResponse({'error': 'Unknown export.'}, status=404)
+    export = exports.EXPORTS[kind]
+    return _export_response(request, export, export.rows(request.GET))
+
+@superuser_required
+def metrics(request):
+    """Returns runtime gauges and counters as JSON for monitoring."""
+    return JsonResponse({
+        'notifications': notification_pool.stats(),
+        'dashboard_cache': dashboard.counters.stats(),
+        # Lock waits and retries, when the default database uses medeasy.sqlite.
+        'database': connection.counters.stats() if hasattr(connection, 'counters') else None,
+        'outbox': outbox.status_counts(),
+    })
+
 @login_required
 @group_required('Patients')
 def lab_test(request): 
@@ -119,15 +170,16 @@ def lab_test(request):
             messages.error(request, 'Please select both a location and a lab test.')
             return render(request, 'lab_test.html')
 
-        # Create and save the LabTest record
-        new_lab_test = LabTest.objects.create(
-            test_type=test_type,
-            location=location,
-            booked_by=request.user
-        )
-        
-        # Send confirmation email asynchronously
-        send_lab_test_email_async(new_lab_test.id, request.user.id)
+        with transaction.atomic():
+            # Create and save the LabTest record
+            new_lab_test = LabTest.objects.create(
+                test_type=test_type,
+                location=location,
+                booked_by=request.user
+            )
+
+            # Queue the confirmation notification in the same transaction
+            notify('lab_test_confirmation', new_lab_test)
         
         # Instead of a message and redirect, render a dedicated confirmation page.
         return render(request, 'lab_test_booked.html')
@@ -136,69 +188,66 @@ def lab_test(request):
 @login_required
 @group_required('Patients')
 def doctor_details(request):
-    # Check if the user has come from the booking page by checking for session data
-    if 'patient_details' not in request.session:
+    # Check if the user has come from the booking page by checking for a booking token.
+    # The pages of results are requested with POST forms carrying the token.
+    token = booking.token_from_request(request)
+    patient_details = booking.loads(request.user, token)
+    if patient_details is None:
         messages.error(request, 'Please fill out the appointment form to find doctors.')
         return redirect('book_appointment')
+    return _render_doctor_list(request, token, patient_details)
 
-    # Get filter criteria from URL query parameters
-    disease = request.GET.get('disease')
-    location = request.GET.get('location')
+def _render_doctor_list(request, token, patient_details):
+    """
+    Renders the doctors matching the search terms in the booking token, on
+    the page given by the POSTed 'page' number. The token is passed on to the
+    pagination and booking forms.
+    """
+    disease = patient_details['disease']
+    location = patient_details['location']
 
     # Validate that both disease and location are present
     if not disease or not location:
         messages.error(request, 'Please select both a disease/symptom and a location to find doctors.')
         return redirect('book_appointment')
 
-    # Start with all doctors
-    docs_query = Doctor.objects.all()
-
-    # Apply filters if they exist
-    if disease not in ('Other'):
-        # Assuming 'expert' field in Doctors model stores expertise related to diseases
-        docs_query = docs_query.filter(expert__icontains=disease)
-
-    if location not in ('Other'):
-        docs_query = docs_query.filter(location__icontains=location)
-
-    # Order the results for consistent pagination
-    docs_query = docs_query.order_by('name')
+    # Match the search terms against the indexed speciality and location
+    # catalogs; results are ordered by name for consistent pagination.
+    docs_query = search_doctors(disease, location)
 
     paginator = Paginator(docs_query, 10)  # Show 10 doctors per page.
-    page_number = request.GET.get('page')
+    page_number = request.POST.get('page')
     page_obj = paginator.get_page(page_number)
 
     context = {
         'page_obj': page_obj,
         'searched_disease': disease,
         'searched_location': location,
+        'booking_token': token,
     }
     return render(request, 'doctor_details.html', context)
 
-def _generate_time_slots(start_time, end_time, interval_minutes=30):
-    """Helper function to generate time slots as (start, end) tuples."""
-    slots = []
-    if not start_time or not end_time:
-        return slots
-        
-    start_datetime = datetime.combine(datetime.today(), start_time)
-    end_datetime = datetime.combine(datetime.today(), end_time)
-    
-    current_start = start_datetime
-    while current_start < end_datetime:
-        current_end = current_start + timedelta(minutes=interval_minutes)
-        # Ensure the slot doesn't go past the doctor's end time
-        if current_end > end_datetime:
-            break
-        slots.append((current_start.time(), current_end.time()))
-        current_start = current_end
-        
-    return slots
+def _render_slot_picker(request, doctor, appointment_date, token, booked=None):
+    """
+    Renders the slot picker for `appointment_date` from the doctor-day
+    availability bitmap. The booking token is passed on to the form.
+    """
+    if booked is None:
+        booked = availability.booked_mask(doctor.pk, appointment_date, doctor.shard)
+    context = {
+        'doctor': doctor,
+        'time_slots': availability.slot_states(doctor, booked),
+        'fully_booked': availability.is_fully_booked(doctor, booked),
+        'appointment_date': appointment_date,
+        'booking_token': token,
+    }
+    return render(request, 'create_appointment.html', context)
 
 @login_required
 @group_required('Patients')
 def create_appointment(request, doctor_id):
-    patient_details = request.session.get('patient_details')
+    token = booking.token_from_request(request)
+    patient_details = booking.loads(request.user, token)
     if not patient_details:
         messages.error(request, 'Your session has expired. Please fill out the appointment form again.')
         return redirect('book_appointment')
@@ -209,138 +258,115 @@ def create_appointment(request, doctor_id):
         messages.error(request, 'The selected doctor could not be found.')
         return redirect('home')
 
-    # Determine the date for which to show slots. Default to today.
-    date_str = request.GET.get('date', datetime.today().strftime('%Y-%m-%d'))
-    try:
-        appointment_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-    except ValueError:
-        appointment_date = datetime.today().date()
-
-    # Get already booked time slots for the selected date for this doctor
-    booked_slots = list(Appointment.objects.filter(
-        doctor=doctor,
-        appointment_date=appointment_date,
-        appointment_time__isnull=False,
-    ).exclude(status='Cancelled').values_list('appointment_time', flat=True))
-
-    if request.method == 'POST':
-        # The date is submitted along with the time
-        appointment_date_str = request.POST.get('appointment_date')
-        selected_time_str = request.POST.get('appointment_time')
-        if not appointment_date_str or not selected_time_str:
-            messages.error(request, 'Please select both a date and an available time slot.')
-
-            # Re-build context for re-rendering the page with the error message
-            try:
-                # Use the date from the failed POST if available, otherwise today
-                appointment_date_for_rerender = datetime.strptime(appointment_date_str, '%Y-%m-%d').date() if appointment_date_str else datetime.today().date()
-            except (ValueError, TypeError):
-                appointment_date_for_rerender = datetime.today().date()
-
-            # Recalculate booked slots for the date that was being submitted
-            booked_slots_for_rerender = list(Appointment.objects.filter(
-                doctor=doctor,
-                appointment_date=appointment_date_for_rerender,
-                appointment_time__isnull=False
-            ).exclude(status='Cancelled').values_list('appointment_time', flat=True))
-
-            time_slots = _generate_time_slots(doctor.from_time, doctor.to_time)
-            context = {
-                'doctor': doctor, 'time_slots': time_slots,
-                'booked_slots': booked_slots_for_rerender, 'appointment_date': appointment_date_for_rerender
-            }
-            return render(request, 'create_appointment.html', context)
-
-        # Server-side validation to prevent booking an already taken slot
+    # The booking token only arrives in POST data. A POST without the form's
+    # 'confirm' button (the doctor list's Book button, or a change of date)
+    # shows the slots for the posted date, defaulting to today.
+    if 'confirm' not in request.POST:
+        date_str = request.POST.get('appointment_date') or datetime.today().strftime('%Y-%m-%d')
         try:
-            appointment_date = datetime.strptime(appointment_date_str, '%Y-%m-%d').date()
+            appointment_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            appointment_date = datetime.today().date()
+        return _render_slot_picker(request, doctor, appointment_date, token)
+
+    # The date is submitted along with the time
+    appointment_date_str = request.POST.get('appointment_date')
+    selected_time_str = request.POST.get('appointment_time')
+    if not appointment_date_str or not selected_time_str:
+        messages.error(request, 'Please select both a date and an available time slot.')
+
+        # Re-render the page for the date that was being submitted, otherwise today
+        try:
+            appointment_date_for_rerender = datetime.strptime(appointment_date_str, '%Y-%m-%d').date() if appointment_date_str else datetime.today().date()
         except (ValueError, TypeError):
-            messages.error(request, 'An invalid date was provided.')
-            return redirect('home')
-
-        # Re-fetch booked slots for the submitted date to prevent race conditions.
-        booked_slots_for_post_date = list(Appointment.objects.filter(
-            doctor=doctor,
-            appointment_date=appointment_date,
-            appointment_time__isnull=False
-        ).exclude(status='Cancelled').values_list('appointment_time', flat=True))
+            appointment_date_for_rerender = datetime.today().date()
+        return _render_slot_picker(request, doctor, appointment_date_for_rerender, token)
 
+    try:
+        appointment_date = datetime.strptime(appointment_date_str, '%Y-%m-%d').date()
         selected_time_obj = datetime.strptime(selected_time_str, '%H:%M').time()
-        if selected_time_obj in booked_slots_for_post_date:
-            messages.error(request, 'This time slot was just booked by someone else. Please select a different time.')
-            time_slots = _generate_time_slots(doctor.from_time, doctor.to_time)
-            context = {'doctor': doctor, 'time_slots': time_slots, 'booked_slots': booked_slots_for_post_date, 'appointment_date': appointment_date}
-            return render(request, 'create_appointment.html', context)
-
-        rescheduling_id = request.session.get('rescheduling_appointment_id')
+    except (ValueError, TypeError):
+        messages.error(request, 'An invalid date or time was provided.')
+        return redirect('home')
 
-        with transaction.atomic():
+    # Server-side validation against the doctor's hours and the slots
+    # already booked for the submitted date (one bitmap lookup).
+    booked = availability.booked_mask(doctor.pk, appointment_date, doctor.shard)
+    if not availability.is_slot_start(doctor, selected_time_obj):
+        messages.error(request, 'Please select one of the available time slots.')
+        return _render_slot_picker(request, doctor, appointment_date, token, booked)
+    if booked & availability.slot_bit(selected_time_obj):
+        messages.error(request, 'This time slot was just booked by someone else. Please select a different time.')
+        return _render_slot_picker(request, doctor, appointment_date, token, booked)
+
+    rescheduling_id = patient_details['rescheduling_id']
+    # The database holding the appointment (see med.sharding)
+    shard = sharding.shard_for_id(rescheduling_id) if rescheduling_id else doctor.shard
+
+    # The partial unique constraint on (doctor, date, time) is the final
+    # guard against two concurrent requests taking the same slot.
+    try:
+        with transaction.atomic(using=shard):
             if rescheduling_id:
                 try:
-                    # This is a reschedule: update the existing appointment
-                    appointment_to_update = Appointment.objects.get(pk=rescheduling_id, booked_by=request.user)
-                    
+                    # This is a reschedule: update the existing appointment. The token
+                    # stays valid after use, so check again that it can be rescheduled.
+                    appointment_to_update = Appointment.objects.using(shard).get(
+                        pk=rescheduling_id, booked_by=request.user, status__in=['Pending', 'Confirmed'],
+                    )
+                
                     appointment_to_update.appointment_date = appointment_date
                     appointment_to_update.appointment_time = selected_time_obj
                     # Reset status to 'Pending' so doctor must re-confirm the new time
                     appointment_to_update.status = 'Pending'
                     appointment_to_update.save(update_fields=['appointment_date', 'appointment_time', 'status'])
-                    
-                    # Send reschedule confirmation email asynchronously
-                    send_reschedule_email_async(appointment_to_update.id, request.user.id)
+                
+                    # Queue the reschedule confirmation notification
+                    notify('reschedule_confirmation', appointment_to_update)
                     messages.success(request, f'Your appointment with {doctor.name} has been successfully rescheduled.')
 
                 except Appointment.DoesNotExist:
                     messages.error(request, 'The appointment you were trying to reschedule could not be found.')
-                    # Clean up session just in case and redirect
-                    if 'rescheduling_appointment_id' in request.session:
-                        del request.session['rescheduling_appointment_id']
                     return redirect('patient_appointments')
             else:
                 # This is a new booking: create a new appointment
-                new_appointment = Appointment.objects.create(
+                new_appointment = Appointment.objects.using(shard).create(
                     doctor=doctor,
                     patient_name=patient_details['patient_name'],
                     patient_age=patient_details['age'],
                     patient_mobile=patient_details['mobile'],
                     booked_by=request.user,
-                    disease=request.session.get('searched_disease', 'Not specified'),
+                    disease=patient_details['disease'] or 'Not specified',
                     appointment_time=selected_time_obj,
                     appointment_date=appointment_date,
                 )
-                
-                # Send confirmation email asynchronously without blocking the user's request.
-                send_confirmation_email_async(new_appointment.id, request.user.id)
+            
+                # Queue the confirmation notification without blocking the user's request.
+                notify('appointment_confirmation', new_appointment)
                 messages.success(request, f'Your appointment request with {doctor.name} has been successfully submitted.')
-
-        # Clean up the session data after booking/rescheduling
-        for key in ['patient_details', 'searched_disease', 'searched_location', 'rescheduling_appointment_id']:
-            if key in request.session:
-                del request.session[key]
-
-        # Redirect based on whether it was a reschedule or a new booking
-        if rescheduling_id:
-            return redirect('patient_appointments')
-        else:
-            return render(request, 'book.html')
-
-    # Handle GET request
+    except IntegrityError:
+        # Only losing the slot to a concurrent booking is expected here;
+        # any other integrity error is a bug and is raised.
+        if not availability.slot_taken(doctor.pk, appointment_date, selected_time_obj, shard, exclude_id=rescheduling_id):
+            raise
+        messages.error(request, 'This time slot was just booked by someone else. Please select a different time.')
+        return _render_slot_picker(request, doctor, appointment_date, token)
+
+    # Redirect based on whether it was a reschedule or a new booking
+    if rescheduling_id:
+        return redirect('patient_appointments')
     else:
-        time_slots = _generate_time_slots(doctor.from_time, doctor.to_time)
-        context = {
-            'doctor': doctor,
-            'time_slots': time_slots,
-            'booked_slots': booked_slots,
-            'appointment_date': appointment_date,
-        }
-        return render(request, 'create_appointment.html', context)
+        return render(request, 'Book.html')
 
 @login_required
 @group_required('Doctors')
 def doctor_appointment_list(request):
     """Displays a filterable list of all appointments for a doctor."""
     try:
-        doctor = request.user.doctor_profile
+        roles = get_roles(request)
+        doctor_id = roles.doctor_id
+        if doctor_id is None:
+            raise Doctor.DoesNotExist
 
         # Check if any filter parameters are present and have a non-empty value.
         filter_fields = ['patient_name', 'disease', 'appointment_date', 'status']
@@ -348,53 +374,87 @@ def doctor_appointment_list(request):
 
         if is_filtered:
             # If filters are applied, search through all appointments, showing the most recent first.
-            base_queryset = Appointment.objects.filter(doctor=doctor).order_by('-appointment_date', '-appointment_time')
+            base_queryset = Appointment.objects.using(roles.doctor_shard).filter(doctor_id=doctor_id)
+            ordering = ('-appointment_date', '-appointment_time', '-id')
         else:
             # If no filters are applied, default to showing today's and future appointments, upcoming first.
             today = datetime.today().date()
-            base_queryset = Appointment.objects.filter(
-                doctor=doctor,
+            base_queryset = Appointment.objects.using(roles.doctor_shard).filter(
+                doctor_id=doctor_id,
                 appointment_date__gte=today
-            ).order_by('appointment_date', 'appointment_time')
+            )
+            ordering = ('appointment_date', 'appointment_time', 'id')
+
+        # Fetch only the columns the table shows (plus the doctor, which the
+        # model needs to track changes).
+        base_queryset = base_queryset.only(
+            'doctor', 'patient_name', 'patient_age', 'patient_mobile', 'disease',
+            'appointment_date', 'appointment_time', 'created_at', 'status',
+        )
 
         # Apply the filter using data from the request's GET parameters
         appointment_filter = AppointmentFilter(request.GET, queryset=base_queryset)
 
+        # Keyset pagination over the med_appt_doctor_slot_idx index, so each
+        # page reads a bounded number of rows however long the history is.
+        paginator = KeysetPaginator(appointment_filter.qs, ordering, 25)  # Show 25 appointments per page
+        page_obj = paginator.page(after=request.GET.get('after'))
+
+        # Preserve other GET parameters for the "load more" link
+        get_params = request.GET.copy()
+        for param in ('after', 'format'):
+            get_params.pop(param, None)
+
+        if request.GET.get('format') == 'json':
+            # "Load more" mode: the next rows, rendered, and the cursor after them.
+            return JsonResponse({
+                'html': render_to_string('doctor_appointment_rows.html', {'page_obj': page_obj}, request=request),
+                'next_cursor': page_obj.next_cursor,
+            })
+
         context = {
             'filter': appointment_filter,
+            'page_obj': page_obj,
+            'query_params': get_params.urlencode(),
         }
         return render(request, 'doctor_appointment_list.html', context)
     except Doctor.DoesNotExist:
         messages.error(request, "Your doctor profile could not be found.")
         return redirect('home')
 
+@login_required
+@group_required('Doctors')
+def doctor_appointment_export(request):
+    """Exports the doctor's appointments matching the appointment list filters."""
+    roles = get_roles(request)
+    if roles.doctor_id is None:
+        messages.error(request, "Your doctor profile could not be found.")
+        return redirect('home')
+    export = exports.EXPORTS['appointments']
+    queryset = exports.appointments_for_doctor(roles.doctor_id, roles.doctor_shard)
+    return _export_response(request, export, export.rows(request.GET, queryset))
+
 @login_required
 @group_required('Patients')
 def book_appointment(request):
     if request.method == 'POST':
-        # Store patient details in the session to carry them to the next step
-        request.session['patient_details'] = {
-            'patient_name': request.POST.get('patient_name'),
-            'age': request.POST.get('age'),
-            'mobile': request.POST.get('mobile'),
-        }
-
-        # Get filtering criteria for finding doctors and build query string
-        disease = request.POST.get('disease', '')
-        location = request.POST.get('location', '')
-        # Store search criteria in session for the final booking step
-        request.session['searched_disease'] = disease
-        request.session['searched_location'] = location
-        query_string = urlencode({'disease': disease, 'location': location})
-        
-        # Redirect to the doctor details page with search criteria
-        return redirect(f"{reverse('doctor_details')}?{query_string}")
+        # Carry the patient details and search criteria to the next steps in a
+        # signed token, sent back in the forms' hidden fields (see med.booking)
+        token = booking.dumps(
+            request.user,
+            patient_name=request.POST.get('patient_name'),
+            age=request.POST.get('age'),
+            mobile=request.POST.get('mobile'),
+            disease=request.POST.get('disease', ''),
+            location=request.POST.get('location', ''),
+        )
 
-    # For GET requests, clear any previous patient details from the session.
-    # This ensures a fresh start for each booking attempt.
-    if 'patient_details' in request.session:
-        del request.session['patient_details']
+        # Show the doctors matching the search criteria. There is no redirect,
+        # which would have to put the token in the URL.
+        return _render_doctor_list(request, token, booking.loads(request.user, token))
 
+    # For GET requests there is nothing to clear: each submission of the form
+    # starts a fresh booking token.
     return render(request, 'book_appointment.html')
 
 @login_required
@@ -404,10 +464,11 @@ def update_appointment_status(request, appointment_id, status):
     Updates the status of an appointment to 'Confirmed' or 'Cancelled'.
     Ensures the appointment belongs to the logged-in doctor.
     """
+    roles = get_roles(request)
     try:
         # Security check: ensure the appointment belongs to the logged-in doctor
-        appointment = Appointment.objects.get(pk=appointment_id, doctor=request.user.doctor_profile)
-    except (Appointment.DoesNotExist, Doctor.DoesNotExist):
+        appointment = Appointment.objects.using(roles.doctor_shard).get(pk=appointment_id, doctor_id=roles.doctor_id)
+    except Appointment.DoesNotExist:
         messages.error(request, "Appointment not found or you don't have permission to modify it.")
         return redirect('doctor_appointment_list')
 
@@ -417,14 +478,25 @@ def update_appointment_status(request, appointment_id, status):
         messages.error(request, "Invalid status update.")
         return redirect('doctor_appointment_list')
 
-    appointment.status = status
-    appointment.save()
-
-    # Notify the patient when the doctor confirms or cancels the appointment.
-    if status == 'Confirmed':
-        send_doctor_confirmation_email_async(appointment.id, appointment.booked_by.id)
-    elif status == 'Cancelled':
-        send_appointment_cancellation_email_async(appointment.id, appointment.booked_by.id)
+    try:
+        with transaction.atomic(using=roles.doctor_shard):
+            appointment.status = status
+            appointment.save()
+
+            # Notify the patient when the doctor confirms or cancels the appointment.
+            if status == 'Confirmed':
+                notify('doctor_confirmation', appointment)
+            elif status == 'Cancelled':
+                notify('appointment_cancellation', appointment)
+    except IntegrityError:
+        # Reinstating a cancelled appointment whose slot has since been taken.
+        if not availability.slot_taken(
+            appointment.doctor_id, appointment.slot_date(), appointment.appointment_time, roles.doctor_shard,
+            exclude_id=appointment.pk,
+        ):
+            raise
+        messages.error(request, "This time slot has been booked by another patient since the appointment was cancelled.")
+        return redirect('doctor_appointment_list')
 
     messages.success(request, f"The appointment has been successfully marked as {status.lower()}.")
     return redirect('doctor_appointment_list')
@@ -434,33 +506,69 @@ def update_appointment_status(request, appointment_id, status):
 def patient_appointments(request):
     # Determine active tab from GET parameter, default to 'appointments'
     active_tab = request.GET.get('tab', 'appointments')
+    if active_tab not in PATIENT_TABS:
+        active_tab = 'appointments'
 
-    # Base querysets for the logged-in user
-    appointment_qs = Appointment.objects.filter(
-        booked_by=request.user
-    ).order_by('-appointment_date', '-appointment_time')
-
-    lab_test_qs = LabTest.objects.filter(
-        booked_by=request.user
-    ).order_by('-created_at')
-
-    # Initialize filters with querysets
-    appointment_filter = PatientAppointmentFilter(request.GET, queryset=appointment_qs, prefix='appt')
-    lab_test_filter = LabTestFilter(request.GET, queryset=lab_test_qs, prefix='lab')
-
+    # Only the active tab is queried here; the other one is fetched from
+    # patient_bookings_tab when it is first shown.
     context = {
-        'appointment_filter': appointment_filter,
-        'lab_test_filter': lab_test_filter,
         'active_tab': active_tab,
+        'appointments_tab': _patient_tab_context(request, 'appointments') if active_tab == 'appointments' else None,
+        'lab_tests_tab': _patient_tab_context(request, 'lab-tests') if active_tab == 'lab-tests' else None,
     }
     return render(request, 'patient_appointments.html', context)
 
+PATIENT_TABS = ('appointments', 'lab-tests')
+
+def _patient_tab_context(request, tab):
+    """Filters and paginates one tab of the logged-in patient's bookings."""
+    if tab == 'appointments':
+        # Join the doctor in the same query rather than loading it per row.
+        queryset = Appointment.objects.filter(booked_by=request.user).select_related('doctor').only(
+            'doctor__name', 'doctor__location', 'appointment_date', 'appointment_time', 'status',
+        )
+        tab_filter = PatientAppointmentFilter(request.GET, queryset=queryset, prefix='appt')
+        # The patient may have booked doctors in any region: read every shard concurrently and merge.
+        paginator = ShardedKeysetPaginator(
+            {alias: tab_filter.qs.using(alias) for alias in sharding.aliases()},
+            ('-appointment_date', '-appointment_time', '-id'), 20,  # Show 20 bookings per page
+        )
+    else:
+        queryset = LabTest.objects.filter(booked_by=request.user).only('test_type', 'location', 'status', 'created_at')
+        tab_filter = LabTestFilter(request.GET, queryset=queryset, prefix='lab')
+        paginator = KeysetPaginator(tab_filter.qs, ('-created_at', '-id'), 20)
+    page_obj = paginator.page(after=request.GET.get('after'))
+
+    # Preserve the tab's filters for the "load more" link
+    get_params = request.GET.copy()
+    for param in ('after', 'format', 'tab'):
+        get_params.pop(param, None)
+
+    return {'filter': tab_filter, 'page_obj': page_obj, 'query_params': get_params.urlencode()}
+
+@login_required
+@group_required('Patients')
+def patient_bookings_tab(request, tab):
+    """Returns one bookings tab as an HTML fragment, or with format=json its next rows."""
+    if tab not in PATIENT_TABS:
+        return JsonResponse({'error': 'Unknown tab.'}, status=404)
+    name = tab.replace('-', '_')
+    context = {f'{name}_tab': _patient_tab_context(request, tab)}
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'html': render_to_string(f'patient_{name}_rows.html', context, request=request),
+            'next_cursor': context[f'{name}_tab']['page_obj'].next_cursor,
+        })
+    return render(request, f'patient_{name}_tab.html', context)
+
 @login_required
 @group_required('Patients')
 def reschedule_appointment(request, appointment_id):
     try:
         # Security check: ensure the appointment belongs to the logged-in patient
-        appointment = Appointment.objects.get(pk=appointment_id, booked_by=request.user)
+        appointment = Appointment.objects.using(sharding.shard_for_id(appointment_id)).get(
+            pk=appointment_id, booked_by=request.user,
+        )
     except Appointment.DoesNotExist:
         messages.error(request, "Appointment not found or you don't have permission to modify it.")
         return redirect('patient_appointments')
@@ -470,32 +578,37 @@ def reschedule_appointment(request, appointment_id):
         messages.error(request, f"You cannot reschedule an appointment with '{appointment.status}' status.")
         return redirect('patient_appointments')
 
-    # Store patient details from the existing appointment into the session
-    request.session['patient_details'] = {
-        'patient_name': appointment.patient_name,
-        'age': appointment.patient_age,
-        'mobile': appointment.patient_mobile,
-    }
-    request.session['searched_disease'] = appointment.disease
-    request.session['rescheduling_appointment_id'] = appointment.id
+    # Carry the patient details from the existing appointment in a booking token
+    token = booking.dumps(
+        request.user,
+        patient_name=appointment.patient_name,
+        age=appointment.patient_age,
+        mobile=appointment.patient_mobile,
+        disease=appointment.disease,
+        rescheduling_id=appointment.id,
+    )
 
     messages.info(request, f"Please select a new date and time to reschedule your appointment with {appointment.doctor.name}.")
-    return redirect('create_appointment', doctor_id=appointment.doctor.id)
+    # Show the slot picker directly, so the token travels only in its form
+    return _render_slot_picker(request, appointment.doctor, datetime.today().date(), token)
 
 @login_required
 @group_required('Patients')
 def cancel_appointment_patient(request, appointment_id):
     try:
-        appointment = Appointment.objects.get(pk=appointment_id, booked_by=request.user)
+        appointment = Appointment.objects.using(sharding.shard_for_id(appointment_id)).get(
+            pk=appointment_id, booked_by=request.user,
+        )
     except Appointment.DoesNotExist:
         messages.error(request, "Appointment not found or you don't have permission to modify it.")
         return redirect('patient_appointments')
 
-    appointment.status = 'Cancelled'
-    appointment.save(update_fields=['status'])
+    with transaction.atomic(using=appointment._state.db):
+        appointment.status = 'Cancelled'
+        appointment.save(update_fields=['status'])
 
-    # Send cancellation confirmation email
-    send_appointment_cancellation_email_async(appointment.id, request.user.id)
+        # Queue the cancellation confirmation notification
+        notify('appointment_cancellation', appointment)
 
     messages.success(request, "Your appointment has been successfully cancelled.")
     return redirect('patient_appointments')
@@ -514,72 +627,84 @@ def cancel_lab_test(request, test_id):
         messages.error(request, f"You cannot cancel a lab test with '{lab_test.status}' status.")
         return redirect('patient_appointments')
 
-    lab_test.status = 'Cancelled'
-    lab_test.save(update_fields=['status'])
+    with transaction.atomic():
+        lab_test.status = 'Cancelled'
+        lab_test.save(update_fields=['status'])
 
-    # Send cancellation confirmation email
-    send_lab_test_cancellation_email_async(lab_test.id, request.user.id)
+        # Queue the cancellation confirmation notification
+        notify('lab_test_cancellation', lab_test)
 
     messages.success(request, "Your lab test request has been successfully cancelled.")
     return redirect(f"{reverse('patient_appointments')}?tab=lab-tests")
 
 
-# API views for Appointment Booking
+# API views for the booking form autocomplete widgets.
+# Lookups are served from the in-memory indexes in med.autocomplete, and
+# each response carries an ETag so select2 can revalidate it with a 304.
+def _autocomplete_etag(source_name):
+    def etag(request, *args, **kwargs):
+        return get_source(source_name).etag(request.GET.get('term', ''))
+    return etag
+
+def _autocomplete_response(request, source_name):
+    values = get_source(source_name).search(request.GET.get('term', ''))
+    response = JsonResponse({'results': [{'id': value, 'text': value} for value in values]})
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 @login_required
 @group_required('Patients')
+@condition(etag_func=_autocomplete_etag('locations'))
 def get_locations(request):
-    term = request.GET.get('term', '').strip().lower()
-    # Using distinct locations from the Doctor model
-    locations_query = Doctor.objects.values_list('location', flat=True).distinct()
-    
-    if term:
-        locations = [loc for loc in locations_query if term in loc.lower()]
-    else:
-        locations = list(locations_query)
-    
-    results = [{'id': loc, 'text': loc} for loc in locations]
-    return JsonResponse({'results': results})
+    return _autocomplete_response(request, 'locations')
 
 @login_required
 @group_required('Patients')
+@condition(etag_func=_autocomplete_etag('diseases'))
 def search_diseases(request):
-    term = request.GET.get('term', '').strip().lower()
-    # In a real app, this would come from a Disease model
-    diseases = [
-        "Fever", "Cold", "Cough", "Headache", "Stomach Pain", 
-        "Diabetes", "Hypertension", "Heart Problem", "Skin Rash", "Allergy", "Other"
-    ]
-    
-    if term:
-        results = [{'id': d, 'text': d} for d in diseases if term in d.lower()]
-    else:
-        results = [{'id': d, 'text': d} for d in diseases]
-        
-    return JsonResponse({'results': results})
+    return _autocomplete_response(request, 'diseases')
+
+@login_required
+@group_required('Patients')
+def doctor_availability(request, doctor_id):
+    """
+    Returns a doctor's slots with their booked state for a range of days,
+    e.g. ?start=2024-05-01&days=14, so the slot picker can change dates
+    without reloading the page.
+    """
+    try:
+        doctor = Doctor.objects.only('from_time', 'to_time', 'shard').get(pk=doctor_id)
+    except Doctor.DoesNotExist:
+        return JsonResponse({'error': 'Doctor not found.'}, status=404)
+
+    try:
+        start = datetime.strptime(request.GET['start'], '%Y-%m-%d').date() if request.GET.get('start') else datetime.today().date()
+        days = int(request.GET.get('days', 14))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start date or number of days.'}, status=400)
+    days = max(1, min(days, getattr(settings, 'AVAILABILITY_MAX_DAYS', 31)))
+
+    result = []
+    for day, booked in availability.range_masks(doctor.pk, start, days, doctor.shard).items():
+        result.append({
+            'date': day.isoformat(),
+            'fully_booked': availability.is_fully_booked(doctor, booked),
+            'slots': [
+                {'start': slot_start.strftime('%H:%M'), 'label': f"{time_format(slot_start, 'g:i A')} - {time_format(slot_end, 'g:i A')}", 'booked': is_booked}
+                for slot_start, slot_end, is_booked in availability.slot_states(doctor, booked)
+            ],
+        })
+    return JsonResponse({'doctor': doctor.pk, 'days': result})
 
 # API views for Lab Test Booking
 @login_required
 @group_required('Patients')
+@condition(etag_func=_autocomplete_etag('lab_locations'))
 def get_lab_locations(request):
-    term = request.GET.get('term', '').strip().lower()
-    locations = ["Aurangabad", "Beed", "Latur", "Osmanabad", "Solapur"]
-    
-    if term:
-        results = [{'id': loc, 'text': loc} for loc in locations if term in loc.lower()]
-    else:
-        results = [{'id': loc, 'text': loc} for loc in locations]
-        
-    return JsonResponse({'results': results})
+    return _autocomplete_response(request, 'lab_locations')
 
 @login_required
 @group_required('Patients')
+@condition(etag_func=_autocomplete_etag('lab_tests'))
 def search_lab_tests(request):
-    term = request.GET.get('term', '').strip().lower()
-    tests = ["Blood Test", "Urine Test", "RTPCR Test", "HIV Test", "DNA Test"]
-    
-    if term:
-        results = [{'id': test, 'text': test} for test in tests if term in test.lower()]
-    else:
-        results = [{'id': test, 'text': test} for test in tests]
-        
-    return JsonResponse({'results': results})
\ No newline at end of file
+    return _autocomplete_response(request, 'lab_tests')
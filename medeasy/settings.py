@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+import json
 import os
 from pathlib import Path
 
@@ -74,6 +75,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'med.context_processors.roles',
             ],
         },
     },
@@ -84,8 +86,16 @@ WSGI_APPLICATION = 'medeasy.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # django.db.backends.sqlite3 plus WAL mode, lock waits and retries
+        # for concurrent writers; see medeasy/sqlite/base.py for OPTIONS.
+        'ENGINE': 'medeasy.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open between requests instead of reconnecting
+        # and reapplying the pragmas each time.
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'busy_timeout': 5000,
+        },
     }
 }
 
@@ -140,3 +150,142 @@ EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')      # Your Gmail address
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')  # Your 16-digit Gmail App Password
+
+# --- Background Notifications ---
+# Notification emails are sent by a shared, bounded pool of worker threads.
+# Set NOTIFICATION_WORKERS to 0 to send them inline (useful in tests).
+NOTIFICATION_WORKERS = int(os.environ.get('NOTIFICATION_WORKERS', 2))
+NOTIFICATION_QUEUE_SIZE = int(os.environ.get('NOTIFICATION_QUEUE_SIZE', 500))
+# What to do when the queue is full: 'block', 'drop' or 'spill' (to disk).
+NOTIFICATION_QUEUE_FULL_POLICY = os.environ.get('NOTIFICATION_QUEUE_FULL_POLICY', 'spill')
+NOTIFICATION_BLOCK_TIMEOUT = 5  # seconds, used by the 'block' policy
+NOTIFICATION_SPILL_DIR = BASE_DIR / 'var' / 'notification_spill'
+# Seconds process exit waits for queued notifications before spilling them.
+NOTIFICATION_SHUTDOWN_TIMEOUT = 5
+
+# --- Email Outbox ---
+# Notification emails are written to an outbox table and sent in batches by
+# `python manage.py drain_outbox` (and by the notification pool after each commit).
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_BASE_DELAY = 30  # seconds; doubles after every failed attempt
+OUTBOX_RETRY_MAX_DELAY = 3600  # seconds
+OUTBOX_CLAIM_TIMEOUT = 300  # seconds before a batch claimed by a dead drainer is retried
+
+# Channels every notification is delivered on. 'sms' is a stub that appends
+# messages to SMS_OUTBOX_FILE until a real SMS gateway is configured.
+NOTIFICATION_CHANNELS = ['email']
+SMS_OUTBOX_FILE = BASE_DIR / 'var' / 'sms_outbox.jsonl'
+
+# --- Email Log Retention ---
+# `python manage.py archive_email_logs` moves EmailLog rows older than this
+# into gzip JSONL segments under EMAIL_LOG_ARCHIVE_DIR.
+EMAIL_LOG_RETENTION_DAYS = 90
+EMAIL_LOG_ARCHIVE_DIR = BASE_DIR / 'var' / 'email_archive'
+# Seconds a stored email body is kept before it can be pruned as unused.
+EMAIL_BODY_PRUNE_GRACE = 3600
+
+# --- Autocomplete ---
+# Maximum number of suggestions returned by the booking form autocomplete APIs.
+AUTOCOMPLETE_MAX_RESULTS = 20
+
+# Minimum trigram similarity for a disease/symptom search term to match a
+# specialty or one of its synonyms (see med.catalog).
+SYMPTOM_MATCH_THRESHOLD = 0.3
+
+# --- Availability ---
+# The multi-day availability API caches each doctor-week of slot bitmaps for
+# this many seconds; booking changes drop the affected week immediately.
+AVAILABILITY_CACHE_TIMEOUT = 600
+AVAILABILITY_MAX_DAYS = 31
+
+# --- Appointment Status Sweep ---
+# update_appointment_statuses only checks appointments that ended since its
+# last run, reaching back this many days further for late confirmations.
+APPOINTMENT_SWEEP_LOOKBACK_DAYS = 7
+
+# --- Scheduler ---
+# `python manage.py run_scheduler` checks for due jobs every SCHEDULER_TICK
+# seconds. The leader renews its lease for SCHEDULER_LEASE_TTL seconds each
+# tick, and every third of that while a job runs, so a standby takes over
+# within that time if the leader dies.
+SCHEDULER_TICK = 5
+SCHEDULER_LEASE_TTL = 60
+
+# --- Cache ---
+# Data version stamps (med.versioning) and the caches keyed on them live
+# here. The local-memory backend is per process, so one worker's version
+# bumps are invisible to the others; when running several worker processes
+# on one machine, set DJANGO_CACHE_DIR to share a file-based cache between them.
+# The roles stamps saved in sessions do not depend on this: they are kept in
+# the database (see med.roles).
+if os.environ.get('DJANGO_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['DJANGO_CACHE_DIR'],
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+# Dashboard entries are keyed on a version stamp; this only lets idle ones expire.
+DASHBOARD_CACHE_TIMEOUT = 24 * 3600
+# Listing totals (med.pagination.cached_count) are also dropped when their
+# version stamp is bumped; this bounds how stale a missed bump can leave them.
+LIST_COUNT_CACHE_TIMEOUT = 300
+
+# --- Roles ---
+# How long a session may reuse the user's cached groups and doctor profile
+# before they are reloaded, even without a change being signalled.
+ROLE_CACHE_TIMEOUT = 300
+
+# --- Booking wizard ---
+# How long a booking token (see med.booking) stays valid, in seconds.
+BOOKING_TOKEN_MAX_AGE = 3600
+
+# --- Sessions ---
+# Sessions only hold authentication state and the cached roles, so they
+# are rarely written. With a cache shared by all processes, reads are served
+# from it as well. A per-process cache could keep serving a session that
+# another process has logged out, so the plain database engine stays the
+# default.
+if os.environ.get('DJANGO_CACHE_DIR'):
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# --- Appointment shards ---
+# Appointments, availability bitmaps and monthly stats can be split across
+# per-region SQLite files by doctor location (see med/sharding.py). Set
+# DJANGO_SHARD_MAP to a JSON file such as
+#   {"north": {"id": 1, "locations": ["Kalyan", "Bhiwandi"]}, ...}
+# and create each shard with `python manage.py migrate --database <alias>`.
+# Shard ids must never change once appointments have been booked.
+MED_SHARDS = {}
+if os.environ.get('DJANGO_SHARD_MAP'):
+    with open(os.environ['DJANGO_SHARD_MAP']) as shard_map_file:
+        MED_SHARDS = json.load(shard_map_file)
+for shard_alias in MED_SHARDS:
+    DATABASES[shard_alias] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / f'db_{shard_alias}.sqlite3',
+        # Shard rows refer to users in the default database.
+        'OPTIONS': {**DATABASES['default']['OPTIONS'], 'foreign_keys': False},
+    }
+DATABASE_ROUTERS = ['med.sharding.ShardRouter']
+# Threads that query the shards concurrently for a patient's bookings.
+SHARD_FANOUT_WORKERS = 8
+
+# --- Exports ---
+# Rows fetched per query by the streaming CSV/JSON Lines exports (see
+# med/exports.py); memory use depends on this, not on the size of the export.
+EXPORT_CHUNK_SIZE = 2000
+
+# --- Doctor imports ---
+# Rows validated and written per transaction by `manage.py import_doctors`
+# (see med/imports.py).
+IMPORT_CHUNK_SIZE = 1000
@@ -0,0 +1,173 @@
+"""
+SQLite backend tuned for concurrent requests and background threads.
+
+Compared with django.db.backends.sqlite3, each connection:
+
+- runs in WAL mode with synchronous=NORMAL, so readers never block the
+  writer and commits do not wait for an fsync of the main database file;
+- sets busy_timeout, mmap_size and cache_size from the OPTIONS below;
+- starts transactions with BEGIN IMMEDIATE. A transaction takes the write
+  lock up front, waiting for it under busy_timeout, instead of failing with
+  "database is locked" when a read inside it is followed by a write while
+  another connection is writing. Once it holds the lock, none of its
+  statements can hit lock contention;
+- retries, with exponential backoff and jitter, a BEGIN or a statement run
+  outside a transaction that still fails because the database is locked.
+  Neither has changed anything yet, so retrying them is safe.
+
+Waits and retries are counted process-wide in `DatabaseWrapper.counters`,
+reported by the admin metrics view.
+
+Settings (DATABASES['default']['OPTIONS'], all optional):
+
+    'busy_timeout': 5000,       # ms to wait for the write lock
+    'mmap_size': 256 * 2**20,   # bytes
+    'cache_size': 64 * 2**10,   # KiB
+    'lock_retries': 5,          # attempts after the first
+    'lock_retry_backoff': 0.01, # seconds before the first retry, doubling
+    'foreign_keys': True,       # False for databases whose rows refer to
+                                # rows in another database (see med.sharding)
+"""
+import random
+import threading
+import time
+
+from django.db.backends.sqlite3 import base as sqlite3_base
+
+# Options read by this backend rather than passed to sqlite3.connect().
+DEFAULTS = {
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 2**20,
+    'cache_size': 64 * 2**10,
+    'lock_retries': 5,
+    'lock_retry_backoff': 0.01,
+    'foreign_keys': True,
+}
+
+# A BEGIN IMMEDIATE that takes longer than this is counted as a lock wait.
+LOCK_WAIT_THRESHOLD = 0.001
+
+
+def is_lock_error(exc):
+    message = str(exc).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class LockCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self.reset()
+
+    def add(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters['lock_wait_seconds'] = round(counters['lock_wait_seconds'], 3)
+        return counters
+
+    def reset(self):
+        with self._lock:
+            self._counters = {
+                'transactions': 0,
+                'lock_waits': 0,
+                'lock_wait_seconds': 0.0,
+                'retries': 0,
+                'failures': 0,
+            }
+
+
+counters = LockCounters()
+
+
+def run_with_retry(execute, retries, backoff):
+    """Calls `execute`, retrying it while it fails because the database is locked."""
+    for attempt in range(retries + 1):
+        try:
+            return execute()
+        except sqlite3_base.Database.OperationalError as exc:
+            if not is_lock_error(exc):
+                raise
+            if attempt == retries:
+                counters.add('failures')
+                raise
+        counters.add('retries')
+        delay = backoff * 2 ** attempt
+        time.sleep(delay + random.uniform(0, delay))
+
+
+class SQLiteCursorWrapper(sqlite3_base.SQLiteCursorWrapper):
+    """Retries statements run outside a transaction when the database is locked."""
+
+    retries = DEFAULTS['lock_retries']
+    backoff = DEFAULTS['lock_retry_backoff']
+
+    def execute(self, query, params=None):
+        if self.connection.in_transaction:
+            return super().execute(query, params)
+        return run_with_retry(lambda: super(SQLiteCursorWrapper, self).execute(query, params), self.retries, self.backoff)
+
+    def executemany(self, query, param_list):
+        if self.connection.in_transaction:
+            return super().executemany(query, param_list)
+        param_list = list(param_list)  # may be an iterator, consumed by a failed attempt
+        return run_with_retry(
+            lambda: super(SQLiteCursorWrapper, self).executemany(query, param_list), self.retries, self.backoff,
+        )
+
+
+class DatabaseWrapper(sqlite3_base.DatabaseWrapper):
+    counters = counters
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict.get('OPTIONS', {})
+        self.tuning = {key: options.get(key, default) for key, default in DEFAULTS.items()}
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        for key in DEFAULTS:
+            kwargs.pop(key, None)
+        # busy_timeout is set below; sqlite3.connect()'s own timeout would override it.
+        kwargs['timeout'] = self.tuning['busy_timeout'] / 1000
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        # journal_mode needs the lock briefly when switching to WAL, e.g. on a new database.
+        run_with_retry(lambda: conn.execute('PRAGMA journal_mode=WAL'), self.tuning['lock_retries'], self.tuning['lock_retry_backoff'])
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=%d' % self.tuning['busy_timeout'])
+        conn.execute('PRAGMA mmap_size=%d' % self.tuning['mmap_size'])
+        # A negative cache_size is in KiB rather than pages.
+        conn.execute('PRAGMA cache_size=%d' % -self.tuning['cache_size'])
+        if not self.tuning['foreign_keys']:
+            conn.execute('PRAGMA foreign_keys=OFF')
+        return conn
+
+    def enable_constraint_checking(self):
+        if self.tuning['foreign_keys']:
+            super().enable_constraint_checking()
+
+    def check_constraints(self, table_names=None):
+        if self.tuning['foreign_keys']:
+            super().check_constraints(table_names)
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.retries = self.tuning['lock_retries']
+        cursor.backoff = self.tuning['lock_retry_backoff']
+        return cursor
+
+    def _start_transaction_under_autocommit(self):
+        started = time.monotonic()
+        self.cursor().execute('BEGIN IMMEDIATE')
+        waited = time.monotonic() - started
+        self.counters.add('transactions')
+        if waited > LOCK_WAIT_THRESHOLD:
+            self.counters.add('lock_waits')
+            self.counters.add('lock_wait_seconds', waited)
+